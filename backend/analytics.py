@@ -1,13 +1,20 @@
-from datetime import datetime, timezone
-from typing import Dict, Any, Optional, List
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, List, Tuple
 import asyncio
 import json
 from clickhouse_driver import Client
-from clickhouse_driver.errors import Error as ClickHouseError
 import structlog
 from pydantic import BaseModel
 from enum import Enum
 
+from analytics_schema import (
+    HOT_PROPERTIES, LEGACY_EVENT_COLUMNS, MAP_COLUMNS, NOT_DELETED, TYPED_EVENT_COLUMNS,
+    apply_migrations, applied_versions
+)
+from analytics_client import AsyncClickHouseClient
+from analytics_writer import ClickHouseBatchWriter
+from config import settings
+
 logger = structlog.get_logger()
 
 
@@ -47,25 +54,155 @@ class AnalyticsEvent(BaseModel):
     location_info: Dict[str, Any] = {}
 
 
+EVENTS_COLUMNS = (
+    "event_id", "event_type", "user_id", "session_id", "timestamp"
+) + TYPED_EVENT_COLUMNS
+
+USERS_COLUMNS = (
+    "user_id", "registration_date", "last_activity", "total_lessons_completed",
+    "total_time_spent", "subscription_type", "user_properties", "updated_at"
+)
+
+
+def _property_value(value: Any) -> str:
+    """Значение свойства для Map(String, String): строки как есть, прочее в JSON"""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def event_row(event: AnalyticsEvent, legacy_json: bool = False,
+              typed_columns: bool = True) -> tuple:
+    """Строка events в порядке EVENTS_COLUMNS (+ JSON-колонки v1)
+
+    Правила преобразования совпадают с DEFAULT-выражениями миграции v2,
+    поэтому новые и дозаполненные строки не отличаются. Без
+    typed_columns (v2 еще не применена) - только первые пять колонок
+    EVENTS_COLUMNS и JSON-колонки v1.
+    """
+    sources = {
+        "properties": event.properties,
+        "user_properties": event.user_properties,
+        "device_info": event.device_info,
+        "location_info": event.location_info,
+    }
+
+    hot = []
+    for source, key in HOT_PROPERTIES.values():
+        value = sources[source].get(key)
+        hot.append("" if value is None else _property_value(value))
+
+    hot_keys = {(source, key) for source, key in HOT_PROPERTIES.values()}
+    maps = [
+        {key: _property_value(value) for key, value in sources[source].items()
+         if value is not None and (source, key) not in hot_keys}
+        for source in MAP_COLUMNS
+    ]
+
+    row = (
+        event.event_id,
+        event.event_type.value,
+        event.user_id,
+        event.session_id,
+        event.timestamp
+    )
+    if typed_columns:
+        row += (*hot, *maps)
+    if legacy_json:
+        row += tuple(json.dumps(sources[source], ensure_ascii=False)
+                     for source in LEGACY_EVENT_COLUMNS)
+    return row
+
+
+def rollup_segments(start: datetime, end: datetime) -> List[Tuple[str, str, Any, Any]]:
+    """Разбиение окна [start, end) по агрегатам: (таблица, колонка, от, до)
+
+    Полные сутки читаются из events_daily, неполные на краях окна - из
+    events_hourly; начало окна округляется вниз до часа. Время в UTC,
+    как и часовой пояс сервера ClickHouse.
+    """
+    start = start.replace(minute=0, second=0, microsecond=0)
+    first_day = start.replace(hour=0)
+    if first_day < start:
+        first_day += timedelta(days=1)
+    last_day = end.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if first_day >= last_day:
+        return [("events_hourly", "hour", start, end)]
+
+    segments = []
+    if start < first_day:
+        segments.append(("events_hourly", "hour", start, first_day))
+    segments.append(("events_daily", "date", first_day.date(), last_day.date()))
+    if last_day < end:
+        segments.append(("events_hourly", "hour", last_day, end))
+    return segments
+
+
+def rollup_source(segments: List[Tuple[str, str, Any, Any]]) -> Tuple[str, Dict[str, Any]]:
+    """UNION ALL состояний агрегатов по сегментам окна и его параметры"""
+    parts, params = [], {}
+    for number, (table, column, start, end) in enumerate(segments):
+        parts.append(
+            f"SELECT event_type, events_count, unique_users, unique_sessions FROM {table} "
+            f"WHERE {column} >= %(start_{number})s AND {column} < %(end_{number})s")
+        params[f"start_{number}"] = start
+        params[f"end_{number}"] = end
+    return " UNION ALL ".join(parts), params
+
+
 class ClickHouseAnalytics:
     """Класс для работы с ClickHouse аналитикой"""
 
-    def __init__(self, host: str = "localhost", port: int = 9000, database: str = "analytics"):
+    def __init__(self, host: str = "localhost", port: int = 9000, database: str = "analytics",
+                 pool_size: int = 8, query_timeout: float = 10.0):
         self.host = host
         self.port = port
         self.database = database
         self.client = None
+        # Запросы чтения: пул соединений, параллельные запросы с таймаутами
+        self.reader = AsyncClickHouseClient(
+            self._create_client, pool_size=pool_size, query_timeout=query_timeout)
+        self.writers: Dict[str, ClickHouseBatchWriter] = {}
+        self._typed_columns = True
+        self._legacy_json = False
         self._initialized = False
 
+    def _create_client(self) -> Client:
+        return Client(
+            host=self.host,
+            port=self.port,
+            database=self.database
+        )
+
     async def initialize(self):
         """Инициализация подключения к ClickHouse"""
         try:
-            self.client = Client(
-                host=self.host,
-                port=self.port,
-                database=self.database
-            )
-            await self._create_tables()
+            self.client = self._create_client()
+            apply_migrations(self.client)
+
+            # Типизированные колонки пишутся после ручной миграции 2 (и
+            # перезапуска); JSON-колонки v1 - пока их не удалила миграция 3:
+            # их еще читают экземпляры приложения предыдущей версии
+            applied = applied_versions(self.client)
+            self._typed_columns = 2 in applied
+            self._legacy_json = 3 not in applied
+            events_columns = (
+                (EVENTS_COLUMNS if self._typed_columns else EVENTS_COLUMNS[:5])
+                + (LEGACY_EVENT_COLUMNS if self._legacy_json else ()))
+
+            # Запись событий пакетами через отдельные соединения
+            for table, columns in (("events", events_columns), ("users", USERS_COLUMNS)):
+                writer = ClickHouseBatchWriter(
+                    self._create_client, table, columns,
+                    batch_size=settings.ANALYTICS_BATCH_SIZE,
+                    max_age_seconds=settings.ANALYTICS_FLUSH_INTERVAL_SECONDS,
+                    max_buffer_rows=settings.ANALYTICS_BUFFER_MAX_ROWS,
+                    wal_dir=settings.ANALYTICS_WAL_DIR
+                )
+                writer.start()
+                self.writers[table] = writer
+
             self._initialized = True
             logger.info("ClickHouse analytics initialized",
                         host=self.host, database=self.database)
@@ -73,123 +210,6 @@ class ClickHouseAnalytics:
             logger.error("Failed to initialize ClickHouse", error=str(e))
             raise
 
-    async def _create_tables(self):
-        """Создание таблиц для аналитики"""
-
-        # Основная таблица событий
-        events_table = """
-        CREATE TABLE IF NOT EXISTS events (
-            event_id String,
-            event_type String,
-            user_id Nullable(String),
-            session_id Nullable(String),
-            timestamp DateTime64(3),
-            properties String,
-            user_properties String,
-            device_info String,
-            location_info String,
-            date Date MATERIALIZED toDate(timestamp)
-        ) ENGINE = MergeTree()
-        PARTITION BY toYYYYMM(timestamp)
-        ORDER BY (event_type, timestamp, user_id)
-        SETTINGS index_granularity = 8192
-        """
-
-        # Таблица пользователей
-        users_table = """
-        CREATE TABLE IF NOT EXISTS users (
-            user_id String,
-            registration_date DateTime64(3),
-            last_activity DateTime64(3),
-            total_lessons_completed UInt32,
-            total_time_spent UInt64,
-            subscription_type String,
-            user_properties String,
-            created_at DateTime64(3) DEFAULT now(),
-            updated_at DateTime64(3) DEFAULT now()
-        ) ENGINE = ReplacingMergeTree(updated_at)
-        ORDER BY user_id
-        """
-
-        # Таблица сессий
-        sessions_table = """
-        CREATE TABLE IF NOT EXISTS sessions (
-            session_id String,
-            user_id Nullable(String),
-            start_time DateTime64(3),
-            end_time Nullable(DateTime64(3)),
-            duration_seconds Nullable(UInt64),
-            page_views UInt32,
-            events_count UInt32,
-            device_info String,
-            location_info String,
-            referrer Nullable(String)
-        ) ENGINE = ReplacingMergeTree(end_time)
-        ORDER BY (session_id, start_time)
-        """
-
-        # Таблица уроков
-        lessons_analytics_table = """
-        CREATE TABLE IF NOT EXISTS lessons_analytics (
-            lesson_id String,
-            user_id String,
-            started_at DateTime64(3),
-            completed_at Nullable(DateTime64(3)),
-            duration_seconds Nullable(UInt64),
-            progress_percent UInt8,
-            quiz_score Nullable(Float32),
-            attempts_count UInt32,
-            is_completed Bool
-        ) ENGINE = ReplacingMergeTree(completed_at)
-        ORDER BY (lesson_id, user_id, started_at)
-        """
-
-        # Материализованные представления для агрегации
-        daily_stats_view = """
-        CREATE MATERIALIZED VIEW IF NOT EXISTS daily_stats
-        ENGINE = SummingMergeTree()
-        ORDER BY (date, event_type)
-        AS SELECT
-            toDate(timestamp) as date,
-            event_type,
-            count() as events_count,
-            uniq(user_id) as unique_users,
-            uniq(session_id) as unique_sessions
-        FROM events
-        GROUP BY date, event_type
-        """
-
-        hourly_stats_view = """
-        CREATE MATERIALIZED VIEW IF NOT EXISTS hourly_stats
-        ENGINE = SummingMergeTree()
-        ORDER BY (hour, event_type)
-        AS SELECT
-            toStartOfHour(timestamp) as hour,
-            event_type,
-            count() as events_count,
-            uniq(user_id) as unique_users
-        FROM events
-        GROUP BY hour, event_type
-        """
-
-        tables = [
-            events_table,
-            users_table,
-            sessions_table,
-            lessons_analytics_table,
-            daily_stats_view,
-            hourly_stats_view
-        ]
-
-        for table_sql in tables:
-            try:
-                self.client.execute(table_sql)
-                logger.info("Table created successfully")
-            except ClickHouseError as e:
-                logger.error("Failed to create table",
-                             error=str(e), sql=table_sql)
-                raise
-
     async def track_event(self, event: AnalyticsEvent):
         """Отправка события в аналитику"""
         if not self._initialized:
@@ -197,25 +217,11 @@ class ClickHouseAnalytics:
             return
 
         try:
-            data = {
-                'event_id': event.event_id,
-                'event_type': event.event_type.value,
-                'user_id': event.user_id,
-                'session_id': event.session_id,
-                'timestamp': event.timestamp,
-                'properties': json.dumps(event.properties, ensure_ascii=False),
-                'user_properties': json.dumps(event.user_properties, ensure_ascii=False),
-                'device_info': json.dumps(event.device_info, ensure_ascii=False),
-                'location_info': json.dumps(event.location_info, ensure_ascii=False)
-            }
-
-            self.client.execute(
-                "INSERT INTO events VALUES",
-                [data]
-            )
+            await self.writers["events"].write(event_row(
+                event, self._legacy_json, self._typed_columns))
 
-            logger.info("Event tracked", event_type=event.event_type,
-                        user_id=event.user_id)
+            logger.debug("Event tracked", event_type=event.event_type,
+                         user_id=event.user_id)
 
         except Exception as e:
             logger.error("Failed to track event", error=str(e),
@@ -223,86 +229,98 @@ class ClickHouseAnalytics:
 
     async def update_user_stats(self, user_id: str, properties: Dict[str, Any]):
         """Обновление статистики пользователя"""
-        try:
-            data = {
-                'user_id': user_id,
-                'registration_date': properties.get('registration_date', datetime.now(timezone.utc)),
-                'last_activity': datetime.now(timezone.utc),
-                'total_lessons_completed': properties.get('total_lessons_completed', 0),
-                'total_time_spent': properties.get('total_time_spent', 0),
-                'subscription_type': properties.get('subscription_type', 'free'),
-                'user_properties': json.dumps(properties, ensure_ascii=False),
-                'updated_at': datetime.now(timezone.utc)
-            }
+        if not self._initialized:
+            logger.warning("Analytics not initialized, skipping user stats")
+            return
 
-            self.client.execute(
-                "INSERT INTO users VALUES",
-                [data]
-            )
+        try:
+            now = datetime.now(timezone.utc)
+            await self.writers["users"].write((
+                user_id,
+                properties.get('registration_date', now),
+                now,
+                properties.get('total_lessons_completed', 0),
+                properties.get('total_time_spent', 0),
+                properties.get('subscription_type', 'free'),
+                json.dumps(properties, ensure_ascii=False, default=str),
+                now
+            ))
 
         except Exception as e:
             logger.error("Failed to update user stats",
                          error=str(e), user_id=user_id)
 
     async def get_user_analytics(self, user_id: str) -> Dict[str, Any]:
-        """Получение аналитики по пользователю"""
-        try:
-            # Основная статистика пользователя
-            user_stats = self.client.execute(
-                """
-                SELECT 
-                    total_lessons_completed,
-                    total_time_spent,
-                    subscription_type,
-                    registration_date,
-                    last_activity
-                FROM users 
-                WHERE user_id = %(user_id)s
-                ORDER BY updated_at DESC
-                LIMIT 1
-                """,
-                {'user_id': user_id}
-            )
-
-            # Активность по дням
-            daily_activity = self.client.execute(
-                """
-                SELECT 
-                    toDate(timestamp) as date,
-                    count() as events_count,
-                    countIf(event_type = 'lesson_complete') as lessons_completed,
-                    countIf(event_type = 'ai_chat_message') as ai_interactions
-                FROM events 
-                WHERE user_id = %(user_id)s 
-                AND timestamp >= now() - INTERVAL 30 DAY
-                GROUP BY date
-                ORDER BY date
-                """,
-                {'user_id': user_id}
-            )
-
-            # Прогресс по урокам
-            lessons_progress = self.client.execute(
-                """
-                SELECT 
-                    lesson_id,
-                    max(progress_percent) as max_progress,
-                    max(is_completed) as is_completed,
-                    min(started_at) as first_attempt,
-                    max(completed_at) as completed_at,
-                    count() as attempts
-                FROM lessons_analytics 
-                WHERE user_id = %(user_id)s
-                GROUP BY lesson_id
-                ORDER BY first_attempt
-                """,
-                {'user_id': user_id}
-            )
+        """Получение аналитики по пользователю
 
+        Запросы выполняются параллельно; если часть из них не удалась,
+        ответ содержит остальные разделы и имена упавших в failed_sections.
+        """
+        try:
+            params = {'user_id': user_id}
+            results, failed = await self.reader.gather({
+                # Основная статистика пользователя
+                'user_stats': (
+                    f"""
+                    SELECT 
+                        total_lessons_completed,
+                        total_time_spent,
+                        subscription_type,
+                        registration_date,
+                        last_activity
+                    FROM users 
+                    WHERE user_id = %(user_id)s
+                    AND {NOT_DELETED}
+                    ORDER BY updated_at DESC
+                    LIMIT 1
+                    """,
+                    params
+                ),
+                # Активность по дням
+                'daily_activity': (
+                    f"""
+                    SELECT 
+                        toString(toDate(timestamp)) as date,
+                        count() as events_count,
+                        countIf(event_type = 'lesson_complete') as lessons_completed,
+                        countIf(event_type = 'ai_chat_message') as ai_interactions
+                    FROM events 
+                    WHERE user_id = %(user_id)s 
+                    AND timestamp >= now() - INTERVAL 30 DAY
+                    AND {NOT_DELETED}
+                    GROUP BY date
+                    ORDER BY date
+                    """,
+                    params
+                ),
+                # Прогресс по урокам
+                'lessons_progress': (
+                    f"""
+                    SELECT 
+                        lesson_id,
+                        max(progress_percent) as max_progress,
+                        max(is_completed) as is_completed,
+                        min(started_at) as first_attempt,
+                        max(completed_at) as completed_at,
+                        count() as attempts
+                    FROM lessons_analytics 
+                    WHERE user_id = %(user_id)s
+                    AND {NOT_DELETED}
+                    GROUP BY lesson_id
+                    ORDER BY first_attempt
+                    """,
+                    params
+                ),
+            })
+            if not results:
+                return {}
+
+            user_stats = results.get('user_stats')
             return {
                 'user_stats': user_stats[0] if user_stats else None,
-                'daily_activity': daily_activity,
-                'lessons_progress': lessons_progress
+                'daily_activity': results.get('daily_activity', []),
+                'lessons_progress': results.get('lessons_progress', []),
+                'failed_sections': failed
             }
 
         except Exception as e:
@@ -311,77 +329,96 @@ class ClickHouseAnalytics:
             return {}
 
     async def get_platform_analytics(self, days: int = 30) -> Dict[str, Any]:
-        """Получение общей аналитики платформы"""
-        try:
-            # Общая статистика
-            overview = self.client.execute(
-                """
-                SELECT 
-                    uniq(user_id) as total_users,
-                    count() as total_events,
-                    countIf(event_type = 'user_registration') as new_registrations,
-                    countIf(event_type = 'lesson_complete') as lessons_completed,
-                    countIf(event_type = 'ai_chat_message') as ai_interactions
-                FROM events 
-                WHERE timestamp >= now() - INTERVAL %(days)s DAY
-                """,
-                {'days': days}
-            )
-
-            # Активность по дням
-            daily_metrics = self.client.execute(
-                """
-                SELECT 
-                    date,
-                    sum(events_count) as total_events,
-                    sum(unique_users) as daily_active_users,
-                    sumIf(events_count, event_type = 'lesson_complete') as lessons_completed
-                FROM daily_stats 
-                WHERE date >= today() - %(days)s
-                GROUP BY date
-                ORDER BY date
-                """,
-                {'days': days}
-            )
-
-            # Топ уроков
-            top_lessons = self.client.execute(
-                """
-                SELECT 
-                    lesson_id,
-                    count() as completions,
-                    uniq(user_id) as unique_users,
-                    avg(duration_seconds) as avg_duration
-                FROM lessons_analytics 
-                WHERE is_completed = 1
-                AND started_at >= now() - INTERVAL %(days)s DAY
-                GROUP BY lesson_id
-                ORDER BY completions DESC
-                LIMIT 10
-                """,
-                {'days': days}
-            )
+        """Получение общей аналитики платформы
 
-            # Воронка конверсии
-            funnel = self.client.execute(
-                """
-                SELECT 
-                    countIf(event_type = 'user_registration') as registrations,
-                    countIf(event_type = 'lesson_start') as lesson_starts,
-                    countIf(event_type = 'lesson_complete') as lesson_completions,
-                    countIf(event_type = 'course_enrollment') as course_enrollments,
-                    countIf(event_type = 'payment_completed') as payments
-                FROM events 
-                WHERE timestamp >= now() - INTERVAL %(days)s DAY
-                """,
-                {'days': days}
-            )
+        Все показатели событий читаются из агрегатов events_daily и
+        events_hourly, объем чтения не зависит от количества событий.
+        Фильтр NOT_DELETED к агрегатам не применяется: удаленные
+        пользователи остаются в итогах и DAU. Запросы выполняются
+        параллельно, см. get_user_analytics.
+        """
+        try:
+            end = datetime.now(timezone.utc).replace(tzinfo=None)
+            source, params = rollup_source(rollup_segments(end - timedelta(days=days), end))
+
+            results, failed = await self.reader.gather({
+                # Общая статистика и воронка конверсии одним проходом
+                'totals': (
+                    f"""
+                    SELECT
+                        uniqMerge(unique_users) as total_users,
+                        countMerge(events_count) as total_events,
+                        countMergeIf(events_count, event_type = 'user_registration') as registrations,
+                        countMergeIf(events_count, event_type = 'lesson_start') as lesson_starts,
+                        countMergeIf(events_count, event_type = 'lesson_complete') as lesson_completions,
+                        countMergeIf(events_count, event_type = 'course_enrollment') as course_enrollments,
+                        countMergeIf(events_count, event_type = 'payment_completed') as payments,
+                        countMergeIf(events_count, event_type = 'ai_chat_message') as ai_interactions
+                    FROM ({source})
+                    """,
+                    params
+                ),
+                # Активность по дням
+                'daily_metrics': (
+                    """
+                    SELECT
+                        toString(date) as date,
+                        countMerge(events_count) as total_events,
+                        uniqMerge(unique_users) as daily_active_users,
+                        countMergeIf(events_count, event_type = 'lesson_complete') as lessons_completed
+                    FROM events_daily
+                    WHERE date >= today() - %(days)s
+                    GROUP BY date
+                    ORDER BY date
+                    """,
+                    {'days': days}
+                ),
+                # Топ уроков
+                'top_lessons': (
+                    f"""
+                    SELECT 
+                        lesson_id,
+                        count() as completions,
+                        uniq(user_id) as unique_users,
+                        avg(duration_seconds) as avg_duration
+                    FROM lessons_analytics 
+                    WHERE is_completed = 1
+                    AND started_at >= now() - INTERVAL %(days)s DAY
+                    AND {NOT_DELETED}
+                    GROUP BY lesson_id
+                    ORDER BY completions DESC
+                    LIMIT 10
+                    """,
+                    {'days': days}
+                ),
+            })
+            if not results:
+                return {}
+
+            overview = funnel = None
+            if 'totals' in results:
+                totals = results['totals'][0]
+                overview = {
+                    'total_users': totals['total_users'],
+                    'total_events': totals['total_events'],
+                    'new_registrations': totals['registrations'],
+                    'lessons_completed': totals['lesson_completions'],
+                    'ai_interactions': totals['ai_interactions'],
+                }
+                funnel = {
+                    key: totals[key]
+                    for key in ('registrations', 'lesson_starts', 'lesson_completions',
+                                'course_enrollments', 'payments')
+                }
+            else:
+                failed = [name for name in failed if name != 'totals'] + ['overview', 'funnel']
 
             return {
-                'overview': overview[0] if overview else {},
-                'daily_metrics': daily_metrics,
-                'top_lessons': top_lessons,
-                'funnel': funnel[0] if funnel else {}
+                'overview': overview,
+                'daily_metrics': results.get('daily_metrics', []),
+                'top_lessons': results.get('top_lessons', []),
+                'funnel': funnel,
+                'failed_sections': failed
             }
 
         except Exception as e:
@@ -389,56 +426,86 @@ class ClickHouseAnalytics:
             return {}
 
     async def get_real_time_metrics(self) -> Dict[str, Any]:
-        """Получение метрик в реальном времени"""
-        try:
-            # Активность за последний час
-            last_hour = self.client.execute(
-                """
-                SELECT 
-                    count() as events_count,
-                    uniq(user_id) as active_users,
-                    uniq(session_id) as active_sessions
-                FROM events 
-                WHERE timestamp >= now() - INTERVAL 1 HOUR
-                """
-            )
-
-            # События по типам за последний час
-            events_by_type = self.client.execute(
-                """
-                SELECT 
-                    event_type,
-                    count() as count
-                FROM events 
-                WHERE timestamp >= now() - INTERVAL 1 HOUR
-                GROUP BY event_type
-                ORDER BY count DESC
-                """
-            )
-
-            # Активные сессии
-            active_sessions = self.client.execute(
-                """
-                SELECT count() as count
-                FROM sessions 
-                WHERE start_time >= now() - INTERVAL 1 HOUR
-                AND (end_time IS NULL OR end_time >= now() - INTERVAL 30 MINUTE)
-                """
-            )
+        """Получение метрик в реальном времени
 
+        Запросы выполняются параллельно, см. get_user_analytics.
+        """
+        try:
+            results, failed = await self.reader.gather({
+                # Активность за последний час
+                'last_hour': (
+                    f"""
+                    SELECT 
+                        count() as events_count,
+                        uniq(user_id) as active_users,
+                        uniq(session_id) as active_sessions
+                    FROM events 
+                    WHERE timestamp >= now() - INTERVAL 1 HOUR
+                    AND {NOT_DELETED}
+                    """,
+                    None
+                ),
+                # События по типам за последний час
+                'events_by_type': (
+                    f"""
+                    SELECT 
+                        event_type,
+                        count() as count
+                    FROM events 
+                    WHERE timestamp >= now() - INTERVAL 1 HOUR
+                    AND {NOT_DELETED}
+                    GROUP BY event_type
+                    ORDER BY count DESC
+                    """,
+                    None
+                ),
+                # Активные сессии
+                'active_sessions': (
+                    f"""
+                    SELECT count() as count
+                    FROM sessions 
+                    WHERE start_time >= now() - INTERVAL 1 HOUR
+                    AND (end_time IS NULL OR end_time >= now() - INTERVAL 30 MINUTE)
+                    AND {NOT_DELETED}
+                    """,
+                    None
+                ),
+            })
+            if not results:
+                return {}
+
+            last_hour = results.get('last_hour')
+            active_sessions = results.get('active_sessions')
             return {
-                'last_hour': last_hour[0] if last_hour else {},
-                'events_by_type': events_by_type,
-                'active_sessions': active_sessions[0]['count'] if active_sessions else 0
+                'last_hour': last_hour[0] if last_hour else None,
+                'events_by_type': results.get('events_by_type', []),
+                'active_sessions': active_sessions[0]['count'] if active_sessions else None,
+                'failed_sections': failed
             }
 
         except Exception as e:
             logger.error("Failed to get real-time metrics", error=str(e))
             return {}
 
+    async def close(self):
+        """Запись буферов и закрытие соединений при остановке приложения"""
+        for writer in self.writers.values():
+            await writer.stop()
+        self.writers.clear()
+        self._initialized = False
+        self.reader.close()
+        if self.client is not None:
+            self.client.disconnect()
+
 
 # Глобальный экземпляр аналитики
-analytics = ClickHouseAnalytics()
+analytics = ClickHouseAnalytics(
+    host=settings.CLICKHOUSE_HOST,
+    port=settings.CLICKHOUSE_PORT,
+    database=settings.CLICKHOUSE_DATABASE,
+    pool_size=settings.CLICKHOUSE_POOL_SIZE,
+    query_timeout=settings.CLICKHOUSE_QUERY_TIMEOUT_SECONDS
+)
 
 
 # Декораторы для автоматического трекинга
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import redis
+import structlog
+
+from config import settings
+from database import redis_client
+from metrics import analytics_cache_requests_total
+
+logger = structlog.get_logger()
+
+Compute = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+class AnalyticsResultCache:
+    """Кеш результатов аналитических эндпоинтов в Redis
+
+    Ключ - эндпоинт, хеш параметров и номер интервала времени длиной TTL
+    эндпоинта: все запросы внутри интервала получают один результат.
+    Когда интервал сменился, отдается результат предыдущего интервала,
+    а пересчет идет в фоне (stale-while-revalidate). Пересчет одного
+    ключа выполняется один раз: внутри процесса запросы ждут общую
+    задачу, между процессами - блокировку SET NX в Redis. Клиент Redis
+    синхронный, его вызовы выполняются в потоке, не блокируя event loop.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None,
+                 ttls: Optional[Dict[str, int]] = None, lock_seconds: int = 30):
+        self.redis = redis_client
+        self.ttls = ttls or {}
+        self.lock_seconds = lock_seconds
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _base_key(endpoint: str, params: Dict[str, Any]) -> str:
+        digest = hashlib.sha1(
+            json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        return f"analytics_cache:{endpoint}:{digest}"
+
+    async def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = await asyncio.to_thread(self.redis.get, key)
+        except redis.RedisError as e:
+            logger.warning("Analytics cache Redis read failed", error=str(e))
+            return None
+        return json.loads(raw) if raw else None
+
+    async def get_or_compute(self, endpoint: str, params: Dict[str, Any],
+                             compute: Compute) -> Tuple[Dict[str, Any], float]:
+        """Результат эндпоинта и его возраст в секундах"""
+        if self.redis is None:
+            return await compute(), 0.0
+
+        ttl = self.ttls[endpoint]
+        bucket = int(time.time() // ttl)
+        base_key = self._base_key(endpoint, params)
+        key = f"{base_key}:{bucket}"
+
+        entry = await self._read(key)
+        if entry is not None:
+            result = "hit"
+        else:
+            entry = await self._read(f"{base_key}:{bucket - 1}")
+            if entry is not None:
+                result = "stale"
+                self._single_flight(key, compute, ttl, wait=False)
+            else:
+                result = "miss"
+                entry = await asyncio.shield(self._single_flight(key, compute, ttl, wait=True))
+                if entry is None:
+                    # Присоединились к фоновому пересчету, который уступил
+                    # блокировку другому процессу
+                    entry = await self._fill(key, compute, ttl, wait=True)
+
+        analytics_cache_requests_total.labels(endpoint=endpoint, result=result).inc()
+        return entry["data"], max(0.0, time.time() - entry["computed_at"])
+
+    def _single_flight(self, key: str, compute: Compute, ttl: int,
+                       wait: bool) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fill(key, compute, ttl, wait))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return task
+
+    def _finished(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        # Ошибка фонового пересчета не должна теряться молча
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Analytics cache refresh failed", key=key,
+                         error=str(task.exception()))
+
+    async def _fill(self, key: str, compute: Compute, ttl: int,
+                    wait: bool) -> Optional[Dict[str, Any]]:
+        """Пересчет ключа; если его уже считает другой процесс - ожидание
+
+        Без wait при чужой блокировке сразу возвращает None.
+        """
+        lock_key = f"{key}:lock"
+        try:
+            locked = bool(await asyncio.to_thread(
+                self.redis.set, lock_key, "1", nx=True, ex=self.lock_seconds))
+        except redis.RedisError as e:
+            logger.warning("Analytics cache Redis lock failed", error=str(e))
+            locked = None
+
+        if locked is False:
+            if not wait:
+                return None
+            deadline = time.monotonic() + self.lock_seconds
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                entry = await self._read(key)
+                if entry is not None:
+                    return entry
+            # Процесс с блокировкой не успел: считаем сами
+
+        try:
+            data = await compute()
+            entry = {"computed_at": time.time(), "data": data}
+            # Пустой или частичный результат - ошибка ClickHouse, его не кешируем
+            if data and not data.get("failed_sections"):
+                # Ключ живет два интервала: второй - как устаревшая копия
+                await asyncio.to_thread(
+                    self.redis.set, key, json.dumps(entry, ensure_ascii=False, default=str),
+                    ex=ttl * 2)
+            return entry
+        except redis.RedisError as e:
+            logger.warning("Analytics cache Redis write failed", error=str(e))
+            return entry
+        finally:
+            if locked:
+                try:
+                    await asyncio.to_thread(self.redis.delete, lock_key)
+                except redis.RedisError:
+                    pass
+
+
+# Глобальный экземпляр кеша аналитики
+analytics_cache = AnalyticsResultCache(
+    redis_client=redis_client if settings.ANALYTICS_CACHE_ENABLED else None,
+    ttls={
+        "platform": settings.ANALYTICS_CACHE_TTL_PLATFORM,
+        "real_time": settings.ANALYTICS_CACHE_TTL_REAL_TIME,
+        "dashboard_overview": settings.ANALYTICS_CACHE_TTL_DASHBOARD,
+    },
+    lock_seconds=settings.ANALYTICS_CACHE_LOCK_SECONDS
+)
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import structlog
+from clickhouse_driver import Client
+
+from metrics import clickhouse_query_duration_seconds, clickhouse_query_errors_total
+
+logger = structlog.get_logger()
+
+Rows = List[Dict[str, Any]]
+Query = Tuple[str, Optional[Dict[str, Any]]]
+
+
+class AsyncClickHouseClient:
+    """Асинхронный доступ к ClickHouse для запросов чтения
+
+    Запросы выполняются в пуле из pool_size потоков; у каждого потока
+    свое соединение (clickhouse_driver.Client не потокобезопасен), так
+    что пул потоков одновременно является пулом соединений. Таймаут
+    запроса передается серверу как max_execution_time и ограничивает
+    ожидание в event loop.
+    """
+
+    def __init__(self, client_factory: Callable[[], Client], pool_size: int = 8,
+                 query_timeout: float = 10.0):
+        self.client_factory = client_factory
+        self.pool_size = pool_size
+        self.query_timeout = query_timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._clients: List[Client] = []
+        self._clients_lock = threading.Lock()
+
+    def _thread_client(self) -> Client:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self.client_factory()
+            self._local.client = client
+            with self._clients_lock:
+                self._clients.append(client)
+        return client
+
+    def _run(self, query: str, params: Optional[Dict[str, Any]], timeout: float) -> Rows:
+        client = self._thread_client()
+        try:
+            rows, columns = client.execute(
+                query, params, with_column_types=True,
+                settings={"max_execution_time": timeout}
+            )
+        except Exception:
+            # Соединение могло остаться в неопределенном состоянии
+            client.disconnect()
+            raise
+        names = [name for name, _ in columns]
+        return [dict(zip(names, row)) for row in rows]
+
+    async def execute(self, query: str, params: Optional[Dict[str, Any]] = None,
+                      timeout: Optional[float] = None, name: str = "query") -> Rows:
+        """Строки результата в виде словарей"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.pool_size, thread_name_prefix="clickhouse")
+        timeout = timeout or self.query_timeout
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            # Небольшой запас, чтобы сервер успел вернуть свою ошибку таймаута
+            rows = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, self._run, query, params, timeout),
+                timeout=timeout + 1.0
+            )
+        except asyncio.TimeoutError:
+            clickhouse_query_errors_total.labels(query=name, error="timeout").inc()
+            raise
+        except Exception:
+            clickhouse_query_errors_total.labels(query=name, error="error").inc()
+            raise
+        finally:
+            clickhouse_query_duration_seconds.labels(query=name).observe(
+                time.perf_counter() - started)
+        return rows
+
+    async def gather(self, queries: Dict[str, Query],
+                     timeout: Optional[float] = None) -> Tuple[Dict[str, Rows], List[str]]:
+        """Параллельное выполнение независимых запросов
+
+        Возвращает результаты успешных запросов и имена упавших: ошибка
+        или таймаут одного запроса не отменяет остальные.
+        """
+        names = list(queries)
+        outcomes = await asyncio.gather(
+            *(self.execute(query, params, timeout=timeout, name=name)
+              for name, (query, params) in queries.items()),
+            return_exceptions=True
+        )
+
+        results, failed = {}, []
+        for name, outcome in zip(names, outcomes):
+            if isinstance(outcome, BaseException):
+                failed.append(name)
+                logger.error("ClickHouse query failed", query=name,
+                             error=str(outcome) or type(outcome).__name__)
+            else:
+                results[name] = outcome
+        return results, failed
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._clients_lock:
+            for client in self._clients:
+                client.disconnect()
+            self._clients.clear()
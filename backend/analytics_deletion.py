@@ -0,0 +1,287 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import redis
+import structlog
+from clickhouse_driver import Client
+
+from analytics_schema import USER_DATA_TABLES
+from config import settings
+from database import redis_client
+from metrics import analytics_deletion_pending_users, analytics_deletion_batches_total
+
+logger = structlog.get_logger()
+
+
+class _Connection:
+    """Соединение ClickHouse, запросы выполняются по одному в отдельном потоке"""
+
+    def __init__(self, client_factory: Callable[[], Client]):
+        self.client_factory = client_factory
+        self._client: Optional[Client] = None
+        self._lock = asyncio.Lock()
+
+    async def execute(self, query: str, params: Any = None) -> List[Dict[str, Any]]:
+        def run():
+            if self._client is None:
+                self._client = self.client_factory()
+            try:
+                rows, columns = self._client.execute(query, params, with_column_types=True)
+            except Exception:
+                self._client.disconnect()
+                self._client = None
+                raise
+            names = [name for name, _ in columns]
+            return [dict(zip(names, row)) for row in rows]
+
+        async with self._lock:
+            return await asyncio.to_thread(run)
+
+    def disconnect(self):
+        if self._client is not None:
+            self._client.disconnect()
+            self._client = None
+
+
+class UserDeletionQueue:
+    """Очередь удаления данных пользователей из ClickHouse (GDPR)
+
+    Запрос на удаление только записывает tombstone в user_tombstones:
+    с этого момента запросы аналитики исключают пользователя (фильтр
+    NOT_DELETED). Раз в interval_seconds все накопившиеся запросы
+    объединяются в один пакет - одна мутация на таблицу вместо мутации
+    на каждого пользователя. Следующий пакет запускается только после
+    завершения мутаций предыдущего, поэтому всплеск запросов не создает
+    очередь мутаций на кластере. Цикл выполняет один экземпляр
+    приложения (блокировка в Redis).
+
+    Исключение - агрегаты events_hourly/events_daily: в них нет user_id,
+    фильтр по tombstone к ним не применить, а удаление из events их не
+    пересчитывает. Итоги и DAU платформы сохраняют обезличенный вклад
+    удаленных пользователей (см. USER_DATA_TABLES).
+
+    mode: "lightweight" - DELETE FROM (строки помечаются и удаляются при
+    слияниях, ClickHouse 23.3+), "mutation" - ALTER TABLE ... DELETE.
+    Lightweight DELETE выполняется синхронно, поэтому у цикла свое
+    соединение: запросы request/status из HTTP-обработчиков его не ждут.
+    """
+
+    def __init__(self, client_factory: Callable[[], Client],
+                 redis_client: Optional[redis.Redis] = None,
+                 mode: str = "lightweight", interval_seconds: float = 300.0,
+                 max_batch_users: int = 1000):
+        if mode not in ("lightweight", "mutation"):
+            raise ValueError(f"Unknown deletion mode: {mode}")
+        self.client_factory = client_factory
+        self.redis = redis_client
+        self.mode = mode
+        self.interval_seconds = interval_seconds
+        self.max_batch_users = max_batch_users
+        # Запросы обработчиков и фонового цикла идут по разным соединениям
+        self._connection = _Connection(client_factory)
+        self._cycle_connection = _Connection(client_factory)
+        self._task: Optional[asyncio.Task] = None
+
+    async def _execute(self, query: str, params: Any = None,
+                       cycle: bool = False) -> List[Dict[str, Any]]:
+        """Запрос на собственном соединении очереди (cycle - соединение цикла)"""
+        connection = self._cycle_connection if cycle else self._connection
+        return await connection.execute(query, params)
+
+    async def request(self, user_id: str) -> Dict[str, Any]:
+        """Постановка пользователя в очередь удаления"""
+        existing = await self.status(user_id)
+        if existing["status"] != "not_requested":
+            return existing
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        await self._execute(
+            "INSERT INTO user_tombstones (user_id, requested_at, status) VALUES",
+            [(user_id, now, "pending")]
+        )
+        logger.info("User analytics deletion requested", user_id=user_id)
+        return {"user_id": user_id, "status": "pending", "requested_at": now,
+                "batch_id": None, "mutations": []}
+
+    async def status(self, user_id: str) -> Dict[str, Any]:
+        """Состояние удаления пользователя и прогресс мутаций его пакета"""
+        rows = await self._execute(
+            """
+            SELECT user_id, requested_at, batch_id, status
+            FROM user_tombstones FINAL
+            WHERE user_id = %(user_id)s
+            """,
+            {"user_id": user_id}
+        )
+        if not rows:
+            return {"user_id": user_id, "status": "not_requested"}
+
+        tombstone = rows[0]
+        mutations = []
+        if tombstone["batch_id"]:
+            mutations = await self._mutations(tombstone["batch_id"])
+        return {**tombstone, "batch_id": tombstone["batch_id"] or None,
+                "mutations": mutations}
+
+    async def batches(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Последние пакеты удаления с прогрессом мутаций"""
+        batches = await self._execute(
+            """
+            SELECT batch_id, mode, users_count, created_at, status, finished_at
+            FROM deletion_batches FINAL
+            ORDER BY created_at DESC
+            LIMIT %(limit)s
+            """,
+            {"limit": limit}
+        )
+        for batch in batches:
+            batch["mutations"] = await self._mutations(batch["batch_id"])
+        return batches
+
+    async def _mutations(self, batch_id: str, cycle: bool = False) -> List[Dict[str, Any]]:
+        # Условие мутаций пакета содержит его id (см. _start_batch)
+        return await self._execute(
+            """
+            SELECT table, mutation_id, is_done, parts_to_do, create_time,
+                   latest_fail_reason
+            FROM system.mutations
+            WHERE database = currentDatabase()
+            AND position(command, %(batch_id)s) > 0
+            ORDER BY table
+            """,
+            {"batch_id": batch_id},
+            cycle=cycle
+        )
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._connection.disconnect()
+        self._cycle_connection.disconnect()
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                if self._acquire_cycle():
+                    await self.run_cycle()
+            except Exception as e:
+                logger.error("User deletion cycle failed", error=str(e))
+
+    def _acquire_cycle(self) -> bool:
+        """Один цикл на интервал для всех экземпляров приложения"""
+        if self.redis is None:
+            return True
+        try:
+            return bool(self.redis.set("analytics_deletion:cycle", "1", nx=True,
+                                       ex=max(1, int(self.interval_seconds * 0.9))))
+        except redis.RedisError as e:
+            logger.warning("User deletion lock failed", error=str(e))
+            return False
+
+    async def run_cycle(self):
+        """Проверка текущего пакета или запуск следующего"""
+        running = await self._execute(
+            "SELECT batch_id FROM deletion_batches FINAL WHERE status = 'running'",
+            cycle=True
+        )
+        if running:
+            for batch in running:
+                await self._check_batch(batch["batch_id"])
+            return
+
+        pending = await self._execute(
+            """
+            SELECT user_id FROM user_tombstones FINAL
+            WHERE status = 'pending'
+            ORDER BY requested_at
+            LIMIT %(limit)s
+            """,
+            {"limit": self.max_batch_users},
+            cycle=True
+        )
+        analytics_deletion_pending_users.set(len(pending))
+        if pending:
+            await self._start_batch([row["user_id"] for row in pending])
+
+    async def _start_batch(self, user_ids: List[str]):
+        batch_id = f"gdpr_{uuid.uuid4().hex}"
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+        await self._execute(
+            "INSERT INTO deletion_batches (batch_id, mode, users_count, created_at, status) VALUES",
+            [(batch_id, self.mode, len(user_ids), now, "running")],
+            cycle=True
+        )
+        await self._execute(
+            "INSERT INTO user_tombstones (user_id, requested_at, batch_id, status) "
+            "SELECT user_id, requested_at, %(batch_id)s, 'purging' FROM user_tombstones FINAL "
+            "WHERE user_id IN %(user_ids)s",
+            {"batch_id": batch_id, "user_ids": tuple(user_ids)},
+            cycle=True
+        )
+
+        # Константное условие с id пакета находит его мутации в system.mutations
+        condition = "user_id IN %(user_ids)s AND %(batch_id)s != ''"
+        for table in USER_DATA_TABLES:
+            if self.mode == "lightweight":
+                query = f"DELETE FROM {table} WHERE {condition}"
+            else:
+                query = f"ALTER TABLE {table} DELETE WHERE {condition}"
+            await self._execute(query, {"user_ids": tuple(user_ids), "batch_id": batch_id},
+                                cycle=True)
+
+        analytics_deletion_batches_total.labels(mode=self.mode).inc()
+        logger.info("User deletion batch started", batch_id=batch_id,
+                    users=len(user_ids), mode=self.mode)
+
+    async def _check_batch(self, batch_id: str):
+        mutations = await self._mutations(batch_id, cycle=True)
+        if len(mutations) < len(USER_DATA_TABLES) or not all(m["is_done"] for m in mutations):
+            failed = [m for m in mutations if m["latest_fail_reason"]]
+            if failed:
+                logger.warning("User deletion mutations failing", batch_id=batch_id,
+                               tables=[m["table"] for m in failed],
+                               reason=failed[0]["latest_fail_reason"])
+            return
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        await self._execute(
+            "INSERT INTO user_tombstones (user_id, requested_at, batch_id, status) "
+            "SELECT user_id, requested_at, batch_id, 'purged' FROM user_tombstones FINAL "
+            "WHERE batch_id = %(batch_id)s",
+            {"batch_id": batch_id},
+            cycle=True
+        )
+        await self._execute(
+            "INSERT INTO deletion_batches (batch_id, mode, users_count, created_at, status, finished_at) "
+            "SELECT batch_id, mode, users_count, created_at, 'done', %(now)s "
+            "FROM deletion_batches FINAL WHERE batch_id = %(batch_id)s",
+            {"batch_id": batch_id, "now": now},
+            cycle=True
+        )
+        logger.info("User deletion batch finished", batch_id=batch_id)
+
+
+# Глобальная очередь удаления
+user_deletions = UserDeletionQueue(
+    client_factory=lambda: Client(
+        host=settings.CLICKHOUSE_HOST,
+        port=settings.CLICKHOUSE_PORT,
+        database=settings.CLICKHOUSE_DATABASE
+    ),
+    redis_client=redis_client,
+    mode=settings.ANALYTICS_DELETION_MODE,
+    interval_seconds=settings.ANALYTICS_DELETION_INTERVAL_SECONDS,
+    max_batch_users=settings.ANALYTICS_DELETION_MAX_BATCH_USERS
+)
@@ -0,0 +1,192 @@
+import asyncio
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from clickhouse_driver import Client
+
+from analytics_schema import MAP_COLUMNS, NOT_DELETED, TYPED_EVENT_COLUMNS
+
+EXPORT_COLUMNS = ("event_id", "event_type", "session_id", "timestamp") + TYPED_EVENT_COLUMNS
+
+PARQUET_SCHEMA = pa.schema(
+    [("event_id", pa.string()), ("event_type", pa.string()),
+     ("session_id", pa.string()), ("timestamp", pa.timestamp("ms"))]
+    + [(name, pa.string()) for name in TYPED_EVENT_COLUMNS if name not in MAP_COLUMNS.values()]
+    + [(name, pa.map_(pa.string(), pa.string())) for name in MAP_COLUMNS.values()]
+)
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+Rows = List[Dict[str, Any]]
+
+
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """Время в UTC без tzinfo - часовой пояс сервера ClickHouse"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _datetime64_param(value: datetime) -> str:
+    """Граница для toDateTime64(..., 3): escape_datetime драйвера отбрасывает миллисекунды"""
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+class UserEventsExport:
+    """Потоковое чтение событий пользователя из ClickHouse
+
+    События читаются через execute_iter блоками по chunk_rows строк на
+    отдельном соединении, в памяти находится только текущий блок. Порядок
+    (timestamp, event_id) делает выгрузку возобновляемой: продолжение -
+    start = timestamp и after_event_id = event_id последней полученной
+    строки.
+    """
+
+    def __init__(self, client_factory: Callable[[], Client], user_id: str,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 after_event_id: Optional[str] = None, chunk_rows: int = 10000):
+        if after_event_id is not None and start is None:
+            raise ValueError("after_event_id requires start")
+        self.client_factory = client_factory
+        self.user_id = user_id
+        self.start = _utc_naive(start)
+        self.end = _utc_naive(end)
+        self.after_event_id = after_event_id
+        self.chunk_rows = chunk_rows
+
+    def query(self) -> tuple:
+        conditions = ["user_id = %(user_id)s", NOT_DELETED]
+        params: Dict[str, Any] = {"user_id": self.user_id}
+        if self.after_event_id is not None:
+            conditions.append(
+                "(timestamp, event_id) > (toDateTime64(%(start)s, 3), %(after_event_id)s)")
+            params.update(start=_datetime64_param(self.start),
+                          after_event_id=self.after_event_id)
+        elif self.start is not None:
+            conditions.append("timestamp >= toDateTime64(%(start)s, 3)")
+            params["start"] = _datetime64_param(self.start)
+        if self.end is not None:
+            conditions.append("timestamp < toDateTime64(%(end)s, 3)")
+            params["end"] = _datetime64_param(self.end)
+
+        sql = (f"SELECT {', '.join(EXPORT_COLUMNS)} FROM events "
+               f"WHERE {' AND '.join(conditions)} ORDER BY timestamp, event_id")
+        return sql, params
+
+    async def chunks(self) -> AsyncIterator[Rows]:
+        sql, params = self.query()
+        client = self.client_factory()
+        try:
+            rows = client.execute_iter(sql, params, settings={"max_block_size": self.chunk_rows})
+            while True:
+                chunk = await asyncio.to_thread(lambda: list(islice(rows, self.chunk_rows)))
+                if not chunk:
+                    return
+                yield [dict(zip(EXPORT_COLUMNS, row)) for row in chunk]
+        finally:
+            # Прерванная выгрузка оставляет соединение посреди ответа
+            client.disconnect()
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def encode_ndjson(chunks: AsyncIterator[Rows]) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        yield "".join(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n"
+                      for row in chunk).encode("utf-8")
+
+
+async def encode_csv(chunks: AsyncIterator[Rows]) -> AsyncIterator[bytes]:
+    """CSV с заголовком; Map-колонки записываются JSON-объектами"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    async for chunk in chunks:
+        for row in chunk:
+            writer.writerow([
+                json.dumps(value, ensure_ascii=False) if isinstance(value, dict)
+                else value.isoformat() if isinstance(value, datetime)
+                else value
+                for value in row.values()
+            ])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файл для ParquetWriter, отдающий записанные байты по частям"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # Смещения в footer Parquet считаются от начала файла
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+async def encode_parquet(chunks: AsyncIterator[Rows]) -> AsyncIterator[bytes]:
+    """Parquet: один row group на блок, сжатие zstd внутри файла"""
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), PARQUET_SCHEMA,
+                              compression="zstd")
+    try:
+        async for chunk in chunks:
+            for row in chunk:
+                for name in MAP_COLUMNS.values():
+                    row[name] = list(row[name].items())
+            writer.write_table(pa.Table.from_pylist(chunk, schema=PARQUET_SCHEMA))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+async def gzip_stream(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Сжатие gzip на лету, без буферизации всего ответа"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for data in stream:
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+ENCODERS = {
+    "ndjson": encode_ndjson,
+    "csv": encode_csv,
+    "parquet": encode_parquet,
+}
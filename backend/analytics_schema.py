@@ -0,0 +1,461 @@
+"""
+Версионированная схема аналитики в ClickHouse
+
+Каждая миграция - набор идемпотентных DDL с номером версии; примененные
+версии записываются в schema_migrations. Автоматические миграции
+выполняются при инициализации ClickHouseAnalytics, ручные (manual) -
+только через scripts.migrate_analytics.
+
+Переход events на типизированные колонки (версии 2 и 3) выполняется без
+простоя:
+1. Все экземпляры обновляются до версии, которая вставляет события с
+   явным списком колонок. Прежние версии вставляют словари через
+   INSERT INTO events VALUES без списка: clickhouse_driver берет все
+   колонки таблицы, включая колонки с DEFAULT, и ищет каждую в словаре,
+   поэтому после v2 такие вставки падают с KeyError.
+2. v2 (manual) добавляет колонки lesson_id/platform/country и
+   Map-колонки с DEFAULT-выражениями из JSON-строк. Это изменение только
+   метаданных: для старых кусков значения вычисляются при чтении, а
+   вставки с явным списком без новых колонок заполняют их сервером.
+   После v2 экземпляры перезапускаются и начинают писать новые колонки;
+   экспорт событий (analytics_export) читает их и доступен после v2.
+3. backfill_events() материализует колонки по одной партиции, чтобы
+   запросы перестали разбирать JSON при чтении старых данных.
+4. v3 (manual) удаляет JSON-строки после backfill и перезапуска всех
+   экземпляров приложения.
+
+Агрегаты events_hourly/events_daily (v4) хранят состояния countState и
+uniqState, которые корректно объединяются при слиянии кусков и при
+запросе за произвольный набор интервалов. Новые события попадают в них
+через материализованные представления, история - через backfill_rollups()
+(пересчет закрытых месяцев с подменой партиции).
+Старые daily_stats/hourly_stats (SummingMergeTree суммировал uniq)
+удаляет ручная миграция v5.
+"""
+
+import logging
+from typing import Callable, Dict, List, NamedTuple, Optional, Set
+
+from clickhouse_driver import Client
+
+logger = logging.getLogger(__name__)
+
+# Часто используемые свойства событий: колонка -> (JSON-колонка, ключ)
+HOT_PROPERTIES: Dict[str, tuple] = {
+    "lesson_id": ("properties", "lesson_id"),
+    "platform": ("device_info", "platform"),
+    "country": ("location_info", "country"),
+}
+
+# JSON-колонка v1 -> Map-колонка с остальными ключами
+MAP_COLUMNS: Dict[str, str] = {
+    "properties": "properties_map",
+    "user_properties": "user_properties_map",
+    "device_info": "device_info_map",
+    "location_info": "location_info_map",
+}
+
+# Агрегаты событий: таблица -> (колонка интервала, ее тип, выражение)
+ROLLUPS: Dict[str, tuple] = {
+    "events_hourly": ("hour", "DateTime", "toStartOfHour(timestamp)"),
+    "events_daily": ("date", "Date", "toDate(timestamp)"),
+}
+
+TYPED_EVENT_COLUMNS = tuple(HOT_PROPERTIES) + tuple(MAP_COLUMNS.values())
+LEGACY_EVENT_COLUMNS = tuple(MAP_COLUMNS)
+
+
+def _json_value_sql(column: str, key: str) -> str:
+    """Значение ключа JSON строкой: строки без кавычек, остальное как в JSON"""
+    return (f"if(JSONType({column}, {key}) = 'String', "
+            f"JSONExtractString({column}, {key}), JSONExtractRaw({column}, {key}))")
+
+
+def _hot_property_sql(column: str, key: str) -> str:
+    return (f"if(JSONType({column}, '{key}') = 'Null', '', "
+            f"{_json_value_sql(column, repr(key))})")
+
+
+def _map_sql(column: str) -> str:
+    """Map из JSON-объекта без null-значений и ключей типизированных колонок"""
+    hot_keys = [key for source, key in HOT_PROPERTIES.values() if source == column]
+    condition = f"JSONType({column}, k) != 'Null'"
+    if hot_keys:
+        condition += f" AND k NOT IN ({', '.join(repr(k) for k in hot_keys)})"
+    return (f"CAST(arrayMap(k -> (k, {_json_value_sql(column, 'k')}), "
+            f"arrayFilter(k -> {condition}, JSONExtractKeys({column}))) "
+            f"AS Map(LowCardinality(String), String))")
+
+
+def _rollup_select(rollup: str) -> str:
+    column, _, expression = ROLLUPS[rollup]
+    return f"""
+        SELECT
+            {expression} AS {column},
+            event_type,
+            countState() AS events_count,
+            uniqState(user_id) AS unique_users,
+            uniqState(session_id) AS unique_sessions
+        FROM events
+        """
+
+
+def _rollup_statements(rollup: str) -> List[str]:
+    column, column_type, _ = ROLLUPS[rollup]
+    return [
+        f"""
+        CREATE TABLE IF NOT EXISTS {rollup} (
+            {column} {column_type},
+            event_type LowCardinality(String),
+            events_count AggregateFunction(count),
+            unique_users AggregateFunction(uniq, Nullable(String)),
+            unique_sessions AggregateFunction(uniq, Nullable(String))
+        ) ENGINE = AggregatingMergeTree()
+        PARTITION BY toYYYYMM({column})
+        ORDER BY ({column}, event_type)
+        """,
+        f"CREATE MATERIALIZED VIEW IF NOT EXISTS {rollup}_mv TO {rollup} AS "
+        f"{_rollup_select(rollup)} GROUP BY {column}, event_type",
+    ]
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: List[str]
+    manual: bool = False
+
+
+MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version UInt32,
+    description String,
+    applied_at DateTime DEFAULT now()
+) ENGINE = MergeTree()
+ORDER BY version
+"""
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "base tables", [
+        # Основная таблица событий
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            event_id String,
+            event_type String,
+            user_id Nullable(String),
+            session_id Nullable(String),
+            timestamp DateTime64(3),
+            properties String,
+            user_properties String,
+            device_info String,
+            location_info String,
+            date Date MATERIALIZED toDate(timestamp)
+        ) ENGINE = MergeTree()
+        PARTITION BY toYYYYMM(timestamp)
+        ORDER BY (event_type, timestamp, user_id)
+        SETTINGS index_granularity = 8192
+        """,
+        # Таблица пользователей
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id String,
+            registration_date DateTime64(3),
+            last_activity DateTime64(3),
+            total_lessons_completed UInt32,
+            total_time_spent UInt64,
+            subscription_type String,
+            user_properties String,
+            created_at DateTime64(3) DEFAULT now(),
+            updated_at DateTime64(3) DEFAULT now()
+        ) ENGINE = ReplacingMergeTree(updated_at)
+        ORDER BY user_id
+        """,
+        # Таблица сессий
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id String,
+            user_id Nullable(String),
+            start_time DateTime64(3),
+            end_time Nullable(DateTime64(3)),
+            duration_seconds Nullable(UInt64),
+            page_views UInt32,
+            events_count UInt32,
+            device_info String,
+            location_info String,
+            referrer Nullable(String)
+        ) ENGINE = ReplacingMergeTree(end_time)
+        ORDER BY (session_id, start_time)
+        """,
+        # Таблица уроков
+        """
+        CREATE TABLE IF NOT EXISTS lessons_analytics (
+            lesson_id String,
+            user_id String,
+            started_at DateTime64(3),
+            completed_at Nullable(DateTime64(3)),
+            duration_seconds Nullable(UInt64),
+            progress_percent UInt8,
+            quiz_score Nullable(Float32),
+            attempts_count UInt32,
+            is_completed Bool
+        ) ENGINE = ReplacingMergeTree(completed_at)
+        ORDER BY (lesson_id, user_id, started_at)
+        """,
+        # Материализованные представления для агрегации
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS daily_stats
+        ENGINE = SummingMergeTree()
+        ORDER BY (date, event_type)
+        AS SELECT
+            toDate(timestamp) as date,
+            event_type,
+            count() as events_count,
+            uniq(user_id) as unique_users,
+            uniq(session_id) as unique_sessions
+        FROM events
+        GROUP BY date, event_type
+        """,
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS hourly_stats
+        ENGINE = SummingMergeTree()
+        ORDER BY (hour, event_type)
+        AS SELECT
+            toStartOfHour(timestamp) as hour,
+            event_type,
+            count() as events_count,
+            uniq(user_id) as unique_users
+        FROM events
+        GROUP BY hour, event_type
+        """,
+    ]),
+    Migration(2, "typed event properties", [
+        "ALTER TABLE events "
+        + ", ".join(
+            [f"ADD COLUMN IF NOT EXISTS {name} LowCardinality(String) "
+             f"DEFAULT {_hot_property_sql(source, key)}"
+             for name, (source, key) in HOT_PROPERTIES.items()]
+            + [f"ADD COLUMN IF NOT EXISTS {name} Map(LowCardinality(String), String) "
+               f"DEFAULT {_map_sql(source)}"
+               for source, name in MAP_COLUMNS.items()]),
+        "ALTER TABLE events ADD INDEX IF NOT EXISTS lesson_id_idx lesson_id "
+        "TYPE bloom_filter GRANULARITY 4",
+    ], manual=True),
+    Migration(3, "drop legacy JSON event columns", [
+        "ALTER TABLE events "
+        + ", ".join(f"MODIFY COLUMN {name} REMOVE DEFAULT" for name in TYPED_EVENT_COLUMNS),
+        "ALTER TABLE events "
+        + ", ".join(f"DROP COLUMN IF EXISTS {name}" for name in LEGACY_EVENT_COLUMNS),
+    ], manual=True),
+    Migration(4, "aggregating event rollups", [
+        *(statement for rollup in ROLLUPS for statement in _rollup_statements(rollup)),
+        """
+        CREATE TABLE IF NOT EXISTS rollup_backfills (
+            rollup String,
+            partition_id String,
+            backfilled_at DateTime DEFAULT now()
+        ) ENGINE = MergeTree()
+        ORDER BY (rollup, partition_id)
+        """,
+    ]),
+    Migration(5, "drop summing stats views", [
+        "DROP VIEW IF EXISTS daily_stats",
+        "DROP VIEW IF EXISTS hourly_stats",
+    ], manual=True),
+    Migration(6, "user deletion queue", [
+        # Запросы на удаление: очередь и фильтр запросов до физического удаления
+        """
+        CREATE TABLE IF NOT EXISTS user_tombstones (
+            user_id String,
+            requested_at DateTime,
+            batch_id String DEFAULT '',
+            status LowCardinality(String),
+            updated_at DateTime64(3) DEFAULT now64(3)
+        ) ENGINE = ReplacingMergeTree(updated_at)
+        ORDER BY user_id
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS deletion_batches (
+            batch_id String,
+            mode LowCardinality(String),
+            users_count UInt32,
+            created_at DateTime,
+            status LowCardinality(String),
+            finished_at Nullable(DateTime),
+            updated_at DateTime64(3) DEFAULT now64(3)
+        ) ENGINE = ReplacingMergeTree(updated_at)
+        ORDER BY batch_id
+        """,
+    ]),
+]
+
+# Таблицы с данными пользователя, которые очищает UserDeletionQueue.
+# Агрегаты events_hourly/events_daily сюда не входят: в них нет user_id,
+# только счетчики и состояния uniq, а MV срабатывает лишь на вставку, так
+# что DELETE в events их не меняет. Вклад удаленных пользователей остается
+# в обезличенных суммах и DAU платформы.
+USER_DATA_TABLES = ("events", "users", "sessions", "lessons_analytics")
+
+# Условие для запросов к USER_DATA_TABLES: исключает пользователей,
+# запросивших удаление, пока их строки физически не удалены (и события,
+# пришедшие с опозданием после удаления). К агрегатам не применимо -
+# показатели get_platform_analytics учитывают и удаленных пользователей
+NOT_DELETED = "(user_id IS NULL OR user_id NOT IN (SELECT user_id FROM user_tombstones))"
+
+
+def applied_versions(client: Client) -> Set[int]:
+    client.execute(MIGRATIONS_TABLE)
+    return {row[0] for row in client.execute("SELECT DISTINCT version FROM schema_migrations")}
+
+
+def apply_migrations(client: Client, include_manual: bool = False,
+                     target: Optional[int] = None) -> List[int]:
+    """Применение недостающих миграций; возвращает номера примененных
+
+    DDL идемпотентны, поэтому одновременный запуск нескольких экземпляров
+    приложения безопасен (версия может записаться дважды).
+    """
+    applied = applied_versions(client)
+    done = []
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        if target is not None and migration.version > target:
+            break
+        if migration.manual and not include_manual:
+            continue
+        for statement in migration.statements:
+            client.execute(statement)
+        client.execute(
+            "INSERT INTO schema_migrations (version, description) VALUES",
+            [(migration.version, migration.description)]
+        )
+        logger.info(f"Analytics schema migration {migration.version} applied: "
+                    f"{migration.description}")
+        done.append(migration.version)
+    return done
+
+
+def pending_backfill_partitions(client: Client, table: str = "events") -> List[str]:
+    """Партиции, в кусках которых типизированные колонки еще не записаны"""
+    rows = client.execute(
+        """
+        SELECT DISTINCT partition_id
+        FROM system.parts
+        WHERE database = currentDatabase() AND table = %(table)s AND active
+        AND name NOT IN (
+            SELECT name FROM system.parts_columns
+            WHERE database = currentDatabase() AND table = %(table)s
+            AND active AND column = %(column)s
+        )
+        ORDER BY partition_id
+        """,
+        {"table": table, "column": TYPED_EVENT_COLUMNS[-1]}
+    )
+    return [row[0] for row in rows]
+
+
+def backfill_events(client: Client,
+                    on_partition: Optional[Callable[[str, int, int], None]] = None) -> int:
+    """Материализация типизированных колонок по одной партиции
+
+    Каждая партиция - отдельная мутация, дождаться которой позволяет
+    mutations_sync: нагрузка на диск ограничена одной партицией, а
+    прерванный backfill продолжается с непройденных партиций.
+    """
+    partitions = pending_backfill_partitions(client)
+    commands = [f"MATERIALIZE COLUMN {name} IN PARTITION ID %(partition_id)s"
+                for name in TYPED_EVENT_COLUMNS]
+    commands.append("MATERIALIZE INDEX lesson_id_idx IN PARTITION ID %(partition_id)s")
+
+    for number, partition_id in enumerate(partitions, start=1):
+        client.execute(
+            "ALTER TABLE events " + ", ".join(commands),
+            {"partition_id": partition_id},
+            settings={"mutations_sync": 1}
+        )
+        if on_partition:
+            on_partition(partition_id, number, len(partitions))
+    return len(partitions)
+
+
+def backfill_rollups(client: Client,
+                     on_partition: Optional[Callable[[str, str], None]] = None,
+                     max_attempts: int = 3) -> int:
+    """Пересчет агрегатов по закрытым партициям events (месяцы до текущего)
+
+    Граница по времени события не годится: событие с опозданием, вставленное
+    после создания MV, уже учтено представлением и было бы посчитано
+    второй раз. Поэтому партиция агрегата целиком пересчитывается из
+    events во временную таблицу {rollup}_backfill и подменяется через
+    REPLACE PARTITION - атомарно и без двойного учета. Если за время
+    пересчета в партицию events что-то вставили (изменилось число строк),
+    пересчет повторяется: такие строки MV записал в заменяемую партицию.
+
+    Текущий месяц еще получает вставки, его партиция пропускается -
+    запустите backfill повторно после окончания месяца. Пройденные
+    партиции запоминаются в rollup_backfills отдельной вставкой после
+    REPLACE (не атомарно); если процесс прервался между ними, повторный
+    запуск просто пересчитает партицию еще раз.
+    """
+    total = 0
+    for rollup, (column, _, _) in ROLLUPS.items():
+        staging = f"{rollup}_backfill"
+        done = {row[0] for row in client.execute(
+            "SELECT partition_id FROM rollup_backfills WHERE rollup = %(rollup)s",
+            {"rollup": rollup}
+        )}
+        partitions = [row[0] for row in client.execute(
+            """
+            SELECT DISTINCT partition_id FROM system.parts
+            WHERE database = currentDatabase() AND table = 'events' AND active
+            AND partition_id < toString(toYYYYMM(now()))
+            ORDER BY partition_id
+            """
+        )]
+        partitions = [partition_id for partition_id in partitions if partition_id not in done]
+        if not partitions:
+            continue
+
+        client.execute(f"CREATE TABLE IF NOT EXISTS {staging} AS {rollup}")
+        try:
+            for partition_id in partitions:
+                params = {"partition_id": partition_id}
+                for attempt in range(1, max_attempts + 1):
+                    client.execute(f"ALTER TABLE {staging} DROP PARTITION ID %(partition_id)s",
+                                   params)
+                    rows_before = _partition_rows(client, partition_id)
+                    client.execute(
+                        f"INSERT INTO {staging} {_rollup_select(rollup)} "
+                        f"WHERE _partition_id = %(partition_id)s GROUP BY {column}, event_type",
+                        params
+                    )
+                    client.execute(
+                        f"ALTER TABLE {rollup} REPLACE PARTITION ID %(partition_id)s "
+                        f"FROM {staging}",
+                        params
+                    )
+                    if _partition_rows(client, partition_id) == rows_before:
+                        break
+                    logger.warning(f"{rollup}: events partition {partition_id} changed "
+                                   f"during backfill (attempt {attempt}), recomputing")
+                else:
+                    raise RuntimeError(f"{rollup}: events partition {partition_id} keeps "
+                                       f"changing, backfill it later")
+
+                client.execute(
+                    "INSERT INTO rollup_backfills (rollup, partition_id) VALUES",
+                    [(rollup, partition_id)]
+                )
+                total += 1
+                if on_partition:
+                    on_partition(rollup, partition_id)
+        finally:
+            client.execute(f"DROP TABLE IF EXISTS {staging}")
+    return total
+
+
+def _partition_rows(client: Client, partition_id: str) -> int:
+    return client.execute(
+        "SELECT count() FROM events WHERE _partition_id = %(partition_id)s",
+        {"partition_id": partition_id}
+    )[0][0]
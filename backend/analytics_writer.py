@@ -0,0 +1,291 @@
+import asyncio
+import json
+import os
+import struct
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Sequence
+
+import structlog
+from clickhouse_driver import Client
+
+from metrics import (
+    analytics_buffer_rows, analytics_flushes_total, analytics_wal_batches,
+    analytics_quarantined_batches_total
+)
+
+logger = structlog.get_logger()
+
+# Коды ошибок ClickHouse, при которых пакет не будет принят и при повторе
+QUARANTINE_ERROR_CODES = frozenset({
+    6,    # CANNOT_PARSE_TEXT
+    16,   # NO_SUCH_COLUMN_IN_TABLE
+    26,   # CANNOT_PARSE_QUOTED_STRING
+    27,   # CANNOT_PARSE_INPUT_ASSERTION_FAILED
+    38,   # CANNOT_PARSE_DATE
+    41,   # CANNOT_PARSE_DATETIME
+    53,   # TYPE_MISMATCH (в т.ч. TypeMismatchError clickhouse_driver)
+    69,   # ARGUMENT_OUT_OF_BOUND
+    70,   # CANNOT_CONVERT_TYPE
+    72,   # CANNOT_PARSE_NUMBER
+    117,  # INCORRECT_DATA
+    321,  # VALUE_IS_OUT_OF_RANGE_OF_DATA_TYPE
+})
+
+
+def is_data_error(error: Exception) -> bool:
+    """Пакет отклонен из-за данных, а не из-за недоступности ClickHouse
+
+    Ошибки сериализации строк в драйвере (TypeError, ValueError,
+    struct.error, ...) и ошибки разбора/типов сервера. Сетевые ошибки,
+    таймауты и все остальные считаются временными: пакет повторяется.
+    """
+    if isinstance(error, (TypeError, ValueError, KeyError, OverflowError, struct.error)):
+        return True
+    return getattr(error, "code", None) in QUARANTINE_ERROR_CODES
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    raise TypeError(f"Unsupported WAL value: {type(value).__name__}")
+
+
+def _decode_value(obj: dict) -> Any:
+    if "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+class ClickHouseBatchWriter:
+    """Буферизованная запись строк в таблицу ClickHouse
+
+    Строки копятся в памяти и вставляются одним колоночным INSERT, когда
+    набирается batch_size строк или самой старой строке исполняется
+    max_age_seconds. При max_buffer_rows строк в буфере write() ждет
+    освобождения места. Пакет, который не удалось вставить, сохраняется
+    в WAL файл в wal_dir и повторяется после следующей успешной вставки.
+    Пакет, отклоненный из-за данных (is_data_error), не повторяется, а
+    переносится в wal_dir/<table>/quarantine для разбора вручную.
+    У писателя собственное соединение: clickhouse_driver.Client не
+    потокобезопасен, а вставки выполняются в отдельном потоке.
+    """
+
+    def __init__(self, client_factory: Callable[[], Client], table: str,
+                 columns: Sequence[str], batch_size: int = 1000,
+                 max_age_seconds: float = 1.0, max_buffer_rows: int = 50000,
+                 wal_dir: Optional[str] = None, wal_retry_seconds: float = 30.0):
+        self.client_factory = client_factory
+        self.table = table
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.max_age_seconds = max_age_seconds
+        self.max_buffer_rows = max_buffer_rows
+        self.wal_dir = os.path.join(wal_dir, table) if wal_dir else None
+        self.quarantine_dir = os.path.join(self.wal_dir, "quarantine") if self.wal_dir else None
+        self.wal_retry_seconds = wal_retry_seconds
+
+        self._client: Optional[Client] = None
+        self._buffer: List[tuple] = []
+        self._oldest: Optional[float] = None
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._wal_count = 0
+        self._replay_after = 0.0
+
+    def insert_sql(self, columns: Optional[Sequence[str]] = None) -> str:
+        return f"INSERT INTO {self.table} ({', '.join(columns or self.columns)}) VALUES"
+
+    def start(self):
+        if self.wal_dir:
+            os.makedirs(self.wal_dir, exist_ok=True)
+            self._wal_count = len(self._wal_files())
+            analytics_wal_batches.labels(table=self.table).set(self._wal_count)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def write(self, row: tuple):
+        """Добавление строки (значения в порядке columns)"""
+        while len(self._buffer) >= self.max_buffer_rows:
+            self._space.clear()
+            self._wakeup.set()
+            await self._space.wait()
+
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.append(row)
+        analytics_buffer_rows.labels(table=self.table).set(len(self._buffer))
+
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def stop(self):
+        """Остановка с записью оставшихся строк (в ClickHouse или WAL)"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self._client is not None:
+            self._client.disconnect()
+            self._client = None
+
+    async def _flush_loop(self):
+        while True:
+            timeout = self.max_age_seconds
+            if self._oldest is not None:
+                timeout = max(0.0, self._oldest + self.max_age_seconds - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            while self._buffer and (
+                    self._stopping
+                    or len(self._buffer) >= self.batch_size
+                    or time.monotonic() - self._oldest >= self.max_age_seconds):
+                await self._flush(self._take_batch())
+
+            if self._stopping and not self._buffer:
+                return
+
+            # Пакеты прошлых сбоев (в т.ч. от предыдущего запуска)
+            if self._wal_count and not self._buffer and time.monotonic() >= self._replay_after:
+                await self._replay_wal()
+
+    def _take_batch(self) -> List[tuple]:
+        batch = self._buffer[:self.batch_size]
+        del self._buffer[:self.batch_size]
+        self._oldest = time.monotonic() if self._buffer else None
+        analytics_buffer_rows.labels(table=self.table).set(len(self._buffer))
+        self._space.set()
+        return batch
+
+    async def _flush(self, batch: List[tuple]):
+        try:
+            await asyncio.to_thread(self._insert, batch)
+            analytics_flushes_total.labels(table=self.table, status="success").inc()
+        except Exception as e:
+            if is_data_error(e):
+                analytics_flushes_total.labels(table=self.table, status="rejected").inc()
+                logger.error("ClickHouse rejected batch, moving to quarantine",
+                             table=self.table, rows=len(batch), error=str(e))
+                try:
+                    self._quarantine_batch(batch)
+                except OSError as wal_error:
+                    logger.error("Quarantine write failed, batch dropped",
+                                 table=self.table, rows=len(batch), error=str(wal_error))
+                return
+
+            analytics_flushes_total.labels(table=self.table, status="failed").inc()
+            logger.error("ClickHouse batch insert failed, spilling to WAL",
+                         table=self.table, rows=len(batch), error=str(e))
+            try:
+                self._spill(batch)
+            except OSError as wal_error:
+                logger.error("WAL write failed, batch dropped",
+                             table=self.table, rows=len(batch), error=str(wal_error))
+            return
+
+        if self._wal_count:
+            await self._replay_wal()
+
+    def _insert(self, batch: List[tuple], columns: Optional[Sequence[str]] = None):
+        if self._client is None:
+            self._client = self.client_factory()
+        try:
+            self._client.execute(self.insert_sql(columns), list(zip(*batch)), columnar=True)
+        except Exception:
+            # Соединение могло остаться в неопределенном состоянии
+            self._client.disconnect()
+            self._client = None
+            raise
+
+    def _wal_files(self) -> List[str]:
+        if not self.wal_dir or not os.path.isdir(self.wal_dir):
+            return []
+        return sorted(f for f in os.listdir(self.wal_dir) if f.endswith(".wal"))
+
+    def _write_batch(self, directory: str, batch: List[tuple]) -> str:
+        """Запись пакета в файл .wal в directory (через .tmp и os.replace)
+
+        Первая строка файла - список колонок, чтобы пакет можно было
+        повторить и после изменения схемы таблицы.
+        """
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.wal"
+        tmp_path = os.path.join(directory, name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"columns": self.columns}))
+            f.write("\n")
+            for row in batch:
+                f.write(json.dumps(row, default=_encode_value, ensure_ascii=False))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(directory, name))
+        return name
+
+    def _spill(self, batch: List[tuple]):
+        """Сохранение пакета в WAL; без wal_dir пакет теряется"""
+        if not self.wal_dir:
+            logger.error("No WAL directory, batch dropped", table=self.table, rows=len(batch))
+            return
+        self._write_batch(self.wal_dir, batch)
+        self._wal_count += 1
+        analytics_wal_batches.labels(table=self.table).set(self._wal_count)
+
+    def _quarantine_batch(self, batch: List[tuple]):
+        """Сохранение отклоненного пакета в карантин; без wal_dir пакет теряется"""
+        analytics_quarantined_batches_total.labels(table=self.table).inc()
+        if not self.quarantine_dir:
+            logger.error("No WAL directory, rejected batch dropped",
+                         table=self.table, rows=len(batch))
+            return
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        self._write_batch(self.quarantine_dir, batch)
+
+    def _quarantine_file(self, name: str, error: Exception):
+        """Перенос файла WAL, который ClickHouse не примет, в карантин"""
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        os.replace(os.path.join(self.wal_dir, name), os.path.join(self.quarantine_dir, name))
+        self._wal_count -= 1
+        analytics_wal_batches.labels(table=self.table).set(self._wal_count)
+        analytics_quarantined_batches_total.labels(table=self.table).inc()
+        logger.error("WAL batch moved to quarantine", table=self.table, file=name,
+                     error=str(error))
+
+    async def _replay_wal(self):
+        """Повторная вставка пакетов из WAL, начиная со старых
+
+        Сетевые ошибки и таймауты прерывают повтор до следующей попытки
+        через wal_retry_seconds. Пакет, отклоненный из-за данных (или
+        испорченный файл), уходит в карантин, повтор продолжается.
+        """
+        for name in self._wal_files():
+            path = os.path.join(self.wal_dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    header = json.loads(f.readline() or "{}")
+                    batch = [tuple(json.loads(line, object_hook=_decode_value))
+                             for line in f if line.strip()]
+            except ValueError as e:
+                self._quarantine_file(name, e)
+                continue
+            try:
+                if batch:
+                    await asyncio.to_thread(self._insert, batch, header.get("columns"))
+            except Exception as e:
+                if is_data_error(e):
+                    self._quarantine_file(name, e)
+                    continue
+                logger.warning("WAL replay failed", table=self.table, file=name, error=str(e))
+                self._replay_after = time.monotonic() + self.wal_retry_seconds
+                return
+            os.remove(path)
+            self._wal_count -= 1
+            analytics_wal_batches.labels(table=self.table).set(self._wal_count)
+            logger.info("WAL batch replayed", table=self.table, file=name, rows=len(batch))
@@ -0,0 +1,114 @@
+"""
+Микро-бенчмарк разбивки уроков на части
+
+Сравнивает старый _split_content_into_chunks, который заново токенизирует
+растущую часть на каждом предложении, с потоковым _iter_content_chunks,
+токенизирующим каждое предложение один раз. Для потокового варианта также
+измеряется пик памяти при чтении текста фрагментами.
+
+Запуск (из директории backend):
+    python -m benchmarks.chunking --sizes-mb 1 4 --max-tokens 500
+"""
+
+import argparse
+import re
+import time
+import tracemalloc
+from typing import Iterator, List
+
+from services.vector_service import VectorService
+
+PARAGRAPH = (
+    "Финансовая подушка безопасности должна покрывать от трех до шести месяцев расходов. "
+    "Храните ее на отдельном счете с быстрым доступом! "
+    "Сколько процентов дохода вы откладываете каждый месяц? "
+    "Даже десять процентов со временем превращаются в заметную сумму. "
+)
+
+
+def legacy_split(encoding, content: str, max_tokens: int) -> List[str]:
+    """Копия прежней реализации _split_content_into_chunks"""
+    sentences = re.split(r'[.!?]+', content)
+    chunks = []
+    current_chunk = ""
+
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+
+        test_chunk = current_chunk + " " + sentence if current_chunk else sentence
+        tokens = encoding.encode(test_chunk)
+
+        if len(tokens) <= max_tokens:
+            current_chunk = test_chunk
+        else:
+            if current_chunk:
+                chunks.append(current_chunk)
+            current_chunk = sentence
+
+    if current_chunk:
+        chunks.append(current_chunk)
+
+    return chunks
+
+
+def make_lesson(size_bytes: int) -> str:
+    repeats = size_bytes // len(PARAGRAPH.encode("utf-8")) + 1
+    return PARAGRAPH * repeats
+
+
+def stream_lesson(size_bytes: int, piece_size: int = 64 * 1024) -> Iterator[str]:
+    """Генерирует текст урока фрагментами, не держа его целиком в памяти"""
+    produced = 0
+    paragraph_bytes = len(PARAGRAPH.encode("utf-8"))
+    per_piece = max(1, piece_size // paragraph_bytes)
+    while produced < size_bytes:
+        yield PARAGRAPH * per_piece
+        produced += paragraph_bytes * per_piece
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 4])
+    parser.add_argument("--max-tokens", type=int, default=500)
+    parser.add_argument("--overlap", type=int, default=0)
+    parser.add_argument("--skip-legacy-above-mb", type=float, default=8,
+                        help="не запускать старую реализацию на больших текстах")
+    args = parser.parse_args()
+
+    service = VectorService(db=None)
+
+    for size_mb in args.sizes_mb:
+        size = int(size_mb * 1024 * 1024)
+        content = make_lesson(size)
+        print(f"--- {size_mb} MB, max_tokens={args.max_tokens}, overlap={args.overlap}")
+
+        if size_mb <= args.skip_legacy_above_mb:
+            started = time.perf_counter()
+            legacy_chunks = legacy_split(service.encoding, content, args.max_tokens)
+            legacy_time = time.perf_counter() - started
+            print(f"  legacy:    {legacy_time:8.2f}s  chunks={len(legacy_chunks)}")
+        else:
+            legacy_time = None
+            print("  legacy:    skipped")
+
+        started = time.perf_counter()
+        chunks = service._split_content_into_chunks(content, args.max_tokens, args.overlap)
+        streaming_time = time.perf_counter() - started
+        print(f"  streaming: {streaming_time:8.2f}s  chunks={len(chunks)}")
+        if legacy_time:
+            print(f"  speedup:   x{legacy_time / streaming_time:.1f}")
+
+        del content, chunks
+        tracemalloc.start()
+        count = sum(1 for _ in service._iter_content_chunks(
+            stream_lesson(size), args.max_tokens, args.overlap))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  generator: chunks={count} peak memory={peak / 1024 / 1024:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Бенчмарк схемы событий ClickHouse: JSON-строки против типизированных колонок
+
+Создает две временные таблицы с одинаковыми синтетическими событиями:
+- json: схема v1, свойства хранятся JSON-строками;
+- typed: схема после миграций 2 и 3 (LowCardinality-колонки и Map).
+Сравнивает размер на диске и для типовых запросов дашбордов - время,
+прочитанные строки и байты (по данным сервера о последнем запросе).
+
+Запуск (из директории backend, нужен доступный ClickHouse):
+    python -m benchmarks.clickhouse_schema --events 1000000 --repeat 5
+"""
+
+import argparse
+import random
+import statistics
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from analytics import AnalyticsEvent, EventType, analytics, event_row
+from analytics_schema import MIGRATIONS
+
+TABLES = {"json": "bench_events_json", "typed": "bench_events_typed"}
+
+PLATFORMS = ["web", "ios", "android", "desktop"]
+COUNTRIES = ["RU", "KZ", "BY", "UZ", "AM", "GE", "KG", "AZ", "MD", "TJ"]
+
+QUERIES = {
+    "top lessons": (
+        "SELECT JSONExtractString(properties, 'lesson_id') AS lesson, count() AS c "
+        "FROM {table} WHERE event_type = 'lesson_complete' "
+        "GROUP BY lesson ORDER BY c DESC LIMIT 10",
+        "SELECT lesson_id AS lesson, count() AS c "
+        "FROM {table} WHERE event_type = 'lesson_complete' "
+        "GROUP BY lesson ORDER BY c DESC LIMIT 10",
+    ),
+    "countries on ios": (
+        "SELECT JSONExtractString(location_info, 'country') AS c, count() "
+        "FROM {table} WHERE JSONExtractString(device_info, 'platform') = 'ios' GROUP BY c",
+        "SELECT country AS c, count() FROM {table} WHERE platform = 'ios' GROUP BY c",
+    ),
+    "single lesson": (
+        "SELECT count() FROM {table} WHERE JSONExtractString(properties, 'lesson_id') = 'lesson_42'",
+        "SELECT count() FROM {table} WHERE lesson_id = 'lesson_42'",
+    ),
+    "long-tail property": (
+        "SELECT avg(JSONExtractFloat(properties, 'duration_seconds')) "
+        "FROM {table} WHERE event_type = 'lesson_complete'",
+        "SELECT avg(toFloat64OrZero(properties_map['duration_seconds'])) "
+        "FROM {table} WHERE event_type = 'lesson_complete'",
+    ),
+}
+
+
+def for_table(sql: str, table: str) -> str:
+    return (sql.replace("IF NOT EXISTS events", f"IF NOT EXISTS {table}")
+               .replace("ALTER TABLE events", f"ALTER TABLE {table}"))
+
+
+def create_tables(client):
+    events_v1 = MIGRATIONS[0].statements[0]
+    for table in TABLES.values():
+        client.execute(f"DROP TABLE IF EXISTS {table}")
+        client.execute(for_table(events_v1, table))
+    # Таблица typed проходит те же миграции, что и events
+    for migration in MIGRATIONS[1:3]:
+        for statement in migration.statements:
+            client.execute(for_table(statement, TABLES["typed"]))
+
+
+def make_events(count: int, lessons: int):
+    event_types = [EventType.LESSON_START, EventType.LESSON_COMPLETE,
+                   EventType.PAGE_VIEW, EventType.AI_CHAT_MESSAGE]
+    start = datetime.now(timezone.utc) - timedelta(days=90)
+    for _ in range(count):
+        event_type = random.choice(event_types)
+        properties = {"lesson_id": f"lesson_{random.randrange(lessons)}"}
+        if event_type == EventType.LESSON_COMPLETE:
+            properties["duration_seconds"] = random.randint(60, 3600)
+            properties["quiz_score"] = round(random.random() * 100, 1)
+        elif event_type == EventType.PAGE_VIEW:
+            properties["path"] = f"/lessons/{random.randrange(lessons)}"
+        yield AnalyticsEvent(
+            event_id=str(uuid.uuid4()),
+            event_type=event_type,
+            user_id=f"user_{random.randrange(count // 20 + 1)}",
+            session_id=uuid.uuid4().hex,
+            timestamp=start + timedelta(seconds=random.randrange(90 * 86400)),
+            properties=properties,
+            user_properties={"subscription_type": random.choice(["free", "premium"])},
+            device_info={"platform": random.choice(PLATFORMS), "app_version": "2.4.1"},
+            location_info={"country": random.choice(COUNTRIES), "timezone": "Europe/Moscow"}
+        )
+
+
+def insert(client, events, batch_size: int = 100_000):
+    json_columns = ("event_id", "event_type", "user_id", "session_id", "timestamp",
+                    "properties", "user_properties", "device_info", "location_info")
+    typed_columns = ("event_id", "event_type", "user_id", "session_id", "timestamp",
+                     "lesson_id", "platform", "country", "properties_map",
+                     "user_properties_map", "device_info_map", "location_info_map")
+    batch = []
+
+    def flush():
+        rows = [event_row(event, legacy_json=True) for event in batch]
+        # Строка event_row: 5 общих колонок, 7 типизированных, 4 JSON-строки
+        json_rows = [row[:5] + row[-4:] for row in rows]
+        typed_rows = [row[:-4] for row in rows]
+        for table, columns, rows in ((TABLES["json"], json_columns, json_rows),
+                                     (TABLES["typed"], typed_columns, typed_rows)):
+            client.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES",
+                           list(zip(*rows)), columnar=True)
+        batch.clear()
+
+    for event in events:
+        batch.append(event)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+
+def storage(client):
+    rows = client.execute(
+        """
+        SELECT table, sum(data_compressed_bytes), sum(data_uncompressed_bytes)
+        FROM system.columns
+        WHERE database = currentDatabase() AND table IN %(tables)s
+        GROUP BY table
+        """,
+        {"tables": tuple(TABLES.values())}
+    )
+    return {table: (compressed, uncompressed) for table, compressed, uncompressed in rows}
+
+
+def run_query(client, sql: str, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        client.execute(sql)
+        timings.append(client.last_query.elapsed)
+    progress = client.last_query.progress
+    return statistics.median(timings), progress.rows, progress.bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--lessons", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="не удалять таблицы")
+    args = parser.parse_args()
+
+    client = analytics._create_client()
+    try:
+        create_tables(client)
+        insert(client, make_events(args.events, args.lessons))
+        for table in TABLES.values():
+            client.execute(f"OPTIMIZE TABLE {table} FINAL")
+
+        sizes = storage(client)
+        print(f"events={args.events} lessons={args.lessons}")
+        for name, table in TABLES.items():
+            compressed, uncompressed = sizes[table]
+            print(f"{name:>6}: {compressed / 2**20:8.1f} MiB on disk, "
+                  f"{uncompressed / 2**20:8.1f} MiB uncompressed")
+
+        print(f"{'query':<20} {'schema':>6} {'median ms':>10} {'rows':>12} {'MiB read':>10}")
+        for title, variants in QUERIES.items():
+            for name, sql in zip(TABLES, variants):
+                elapsed, rows, read_bytes = run_query(
+                    client, sql.format(table=TABLES[name]), args.repeat)
+                print(f"{title:<20} {name:>6} {elapsed * 1000:10.1f} {rows:12d} "
+                      f"{read_bytes / 2**20:10.1f}")
+    finally:
+        if not args.keep:
+            for table in TABLES.values():
+                client.execute(f"DROP TABLE IF EXISTS {table}")
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Нагрузочный бенчмарк слоя базы данных
+
+Сравнивает пропускную способность (requests/sec) двух вариантов обработчика:
+- before: async-роут с синхронной сессией на StaticPool (старый database.py),
+  блокирующий event loop на время каждого запроса к БД;
+- after: async-роут с AsyncSession (asyncpg) и пулом соединений.
+
+Оба варианта поднимаются в одном процессе и нагружаются через ASGI-транспорт
+httpx, поэтому блокировка event loop видна напрямую в цифрах.
+
+Запуск (из директории backend, нужен доступный PostgreSQL):
+    python -m benchmarks.db_load --concurrency 50 --duration 10
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from config import settings
+from database import get_async_db, close_db
+
+# Старая конфигурация: одно общее соединение на процесс
+legacy_engine = create_engine(settings.DATABASE_URL, poolclass=StaticPool)
+LegacySessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=legacy_engine)
+
+
+def get_legacy_db():
+    db = LegacySessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def build_app(query: str) -> FastAPI:
+    app = FastAPI()
+    statement = text(query)
+
+    @app.get("/before")
+    async def before(db: Session = Depends(get_legacy_db)):
+        db.execute(statement).fetchall()
+        return {"status": "ok"}
+
+    @app.get("/after")
+    async def after(db: AsyncSession = Depends(get_async_db)):
+        (await db.execute(statement)).fetchall()
+        return {"status": "ok"}
+
+    return app
+
+
+async def run_load(app: FastAPI, path: str, concurrency: int, duration: float) -> dict:
+    """Нагружает endpoint в течение duration секунд и собирает статистику"""
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - started)
+                except Exception:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": count / elapsed if elapsed else 0.0,
+        "p50_ms": latencies[count // 2] * 1000 if count else 0.0,
+        "p99_ms": latencies[min(count - 1, int(count * 0.99))] * 1000 if count else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--query", default="SELECT pg_sleep(0.005)",
+                        help="SQL, имитирующий типичный запрос роутера")
+    args = parser.parse_args()
+
+    app = build_app(args.query)
+
+    print(f"concurrency={args.concurrency} duration={args.duration}s query={args.query!r}")
+    results = {}
+    for name in ("before", "after"):
+        results[name] = await run_load(app, f"/{name}", args.concurrency, args.duration)
+        r = results[name]
+        print(f"{name:>6}: {r['rps']:8.1f} req/s  p50={r['p50_ms']:.1f}ms  "
+              f"p99={r['p99_ms']:.1f}ms  errors={r['errors']}")
+
+    if results["before"]["rps"]:
+        print(f"speedup: x{results['after']['rps'] / results['before']['rps']:.2f}")
+
+    legacy_engine.dispose()
+    await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
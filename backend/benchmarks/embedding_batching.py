@@ -0,0 +1,81 @@
+"""
+Бенчмарк пакетного создания embeddings
+
+Сравнивает последовательный вызов create_embedding на каждую часть урока
+(старый vectorize_lesson_content) с пакетным create_embeddings.
+Запросы уходят в stub-сервер в том же процессе, сеть и API ключ не нужны.
+
+Запуск (из директории backend):
+    python -m benchmarks.embedding_batching --lessons 20 --chunks 40 --latency-ms 150
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.stub_embeddings_server import create_app
+from services.embedding_cache import EmbeddingCache
+from services.openai_client import OpenAIClient
+from services.vector_service import VectorService
+
+
+def build_service(stub_app) -> VectorService:
+    service = VectorService(db=None)
+    service.client = OpenAIClient(
+        api_key="stub",
+        base_url="http://stub/v1",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=stub_app)),
+        requests_per_minute=10 ** 6,
+    )
+    # Кеш отключен, чтобы сравнивать именно запросы к API
+    service.cache = EmbeddingCache(redis_client=None, lru_size=0)
+    return service
+
+
+def make_chunks(lessons: int, chunks: int):
+    sentence = "Бюджет помогает контролировать расходы и копить на цели. "
+    return [[f"Урок {lesson}, часть {c}. " + sentence * 20 for c in range(chunks)]
+            for lesson in range(lessons)]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=40, help="частей на урок")
+    parser.add_argument("--latency-ms", type=float, default=150.0)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=None)
+    args = parser.parse_args()
+
+    catalog = make_chunks(args.lessons, args.chunks)
+    total = args.lessons * args.chunks
+
+    serial_app = create_app(latency_ms=args.latency_ms)
+    serial = build_service(serial_app)
+    started = time.perf_counter()
+    for chunks in catalog:
+        for chunk in chunks:
+            await serial.create_embedding(chunk)
+    serial_time = time.perf_counter() - started
+
+    batched_app = create_app(latency_ms=args.latency_ms)
+    batched = build_service(batched_app)
+    started = time.perf_counter()
+    for chunks in catalog:
+        await batched.create_embeddings(chunks, batch_size=args.batch_size,
+                                        max_concurrency=args.concurrency)
+    batched_time = time.perf_counter() - started
+
+    print(f"lessons={args.lessons} chunks/lesson={args.chunks} latency={args.latency_ms}ms")
+    print(f" serial: {serial_time:7.2f}s  {total / serial_time:8.1f} chunks/s  "
+          f"requests={serial_app.state.requests}")
+    print(f"batched: {batched_time:7.2f}s  {total / batched_time:8.1f} chunks/s  "
+          f"requests={batched_app.state.requests}")
+    print(f"speedup: x{serial_time / batched_time:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""
+Stub-сервер OpenAI Embeddings API для офлайн-тестов и бенчмарков
+
+Реализует POST /v1/embeddings в формате OpenAI: детерминированные векторы
+(по хешу текста), искусственная задержка на запрос и на каждый вход,
+счетчик запросов на GET /stats.
+
+Запуск (из директории backend):
+    python -m benchmarks.stub_embeddings_server --port 8900 --latency-ms 150
+    OPENAI_BASE_URL=http://localhost:8900/v1 OPENAI_API_KEY=stub python main.py
+"""
+
+import argparse
+import asyncio
+import hashlib
+import struct
+from typing import List, Union
+
+import uvicorn
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+EMBEDDING_DIM = 1536
+
+
+class EmbeddingRequest(BaseModel):
+    model: str
+    input: Union[str, List[str]]
+    encoding_format: str = "float"
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """Детерминированный нормированный вектор, зависящий только от текста"""
+    values = []
+    counter = 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+        values.extend(b / 127.5 - 1.0 for b in struct.unpack("32B", digest))
+        counter += 1
+    values = values[:dim]
+    norm = sum(v * v for v in values) ** 0.5 or 1.0
+    return [v / norm for v in values]
+
+
+def create_app(latency_ms: float = 100.0, per_input_ms: float = 1.0) -> FastAPI:
+    app = FastAPI(title="Stub Embeddings API")
+    app.state.requests = 0
+    app.state.inputs = 0
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: EmbeddingRequest):
+        inputs = [request.input] if isinstance(request.input, str) else request.input
+        app.state.requests += 1
+        app.state.inputs += len(inputs)
+
+        # Имитация сетевой задержки и времени инференса
+        await asyncio.sleep((latency_ms + per_input_ms * len(inputs)) / 1000)
+
+        return {
+            "object": "list",
+            "model": request.model,
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {
+                "prompt_tokens": sum(len(t.split()) for t in inputs),
+                "total_tokens": sum(len(t.split()) for t in inputs),
+            },
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests, "inputs": app.state.inputs}
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI embeddings server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--per-input-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.latency_ms, args.per_input_ms),
+                host=args.host, port=args.port)
@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
@@ -8,25 +9,70 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-# PostgreSQL Database с поддержкой pgvector
+IS_SQLITE = "sqlite" in settings.DATABASE_URL
+
+
+def _async_database_url(url: str) -> str:
+    """Преобразует DATABASE_URL в URL для асинхронного драйвера"""
+    if url.startswith("postgresql+asyncpg://") or url.startswith("sqlite+aiosqlite://"):
+        return url
+    if url.startswith("postgresql://") or url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("postgresql+psycopg2://"):
+        return url.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
+def _pool_options() -> dict:
+    """Параметры пула соединений (StaticPool только для SQLite)"""
+    if IS_SQLITE:
+        return {"poolclass": StaticPool}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+# PostgreSQL Database с поддержкой pgvector (синхронный движок для
+# auth и фоновых скриптов, которые еще не переведены на AsyncSession)
 engine = create_engine(
     settings.DATABASE_URL,
-    poolclass=StaticPool,
-    connect_args={
-        "check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
-    echo=settings.DEBUG
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
+    echo=settings.DEBUG,
+    **_pool_options()
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронный движок (asyncpg) для роутеров
+async_engine = create_async_engine(
+    _async_database_url(settings.DATABASE_URL),
+    echo=settings.DEBUG,
+    **_pool_options()
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 Base = declarative_base()
 
 # Redis connection
 redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+# Клиент без декодирования ответов для бинарных значений (кеш embeddings)
+redis_binary_client = redis.from_url(settings.REDIS_URL)
 
 
 def get_db():
-    """Dependency для получения сессии базы данных"""
+    """Dependency для получения синхронной сессии базы данных"""
     db = SessionLocal()
     try:
         yield db
@@ -34,6 +80,12 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Dependency для получения асинхронной сессии базы данных"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def get_redis():
     """Dependency для получения Redis клиента"""
     return redis_client
@@ -43,13 +95,14 @@ async def init_db():
     """Инициализация базы данных с поддержкой pgvector"""
     try:
         # Создаем расширение pgvector если его нет
-        with engine.connect() as conn:
-            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
-            conn.commit()
-            logger.info("pgvector extension enabled")
+        async with async_engine.begin() as conn:
+            if not IS_SQLITE:
+                await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+                logger.info("pgvector extension enabled")
 
         # Создаем таблицы
-        Base.metadata.create_all(bind=engine)
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
         logger.info("Database tables created successfully")
 
     except Exception as e:
@@ -57,24 +110,94 @@ async def init_db():
         raise
 
 
+async def migrate_schema():
+    """Добавление колонок и индексов, которых нет в уже созданных таблицах"""
+    if IS_SQLITE:
+        return
+    try:
+        async with async_engine.begin() as conn:
+            await conn.execute(text("""
+                ALTER TABLE knowledge_base
+                ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)
+            """))
+            # Хеш для строк, загруженных до появления колонки, по той же
+            # формуле, что VectorService.knowledge_content_hash. Из
+            # одинаковых документов хеш получает только первый, остальные
+            # остаются с NULL и не нарушают уникальный индекс
+            await conn.execute(text("""
+                UPDATE knowledge_base kb
+                SET content_hash = pending.hash
+                FROM (
+                    SELECT DISTINCT ON (hash) id, hash
+                    FROM (
+                        SELECT id, encode(sha256(convert_to(
+                            title || E'\\n' || content, 'UTF8')), 'hex') AS hash
+                        FROM knowledge_base
+                        WHERE content_hash IS NULL
+                    ) hashed
+                    ORDER BY hash, id
+                ) pending
+                WHERE kb.id = pending.id
+                  AND NOT EXISTS (
+                      SELECT 1 FROM knowledge_base existing
+                      WHERE existing.content_hash = pending.hash
+                  )
+            """))
+            await conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ix_knowledge_base_content_hash
+                ON knowledge_base (content_hash)
+            """))
+
+            # Генерируемые tsvector колонки для гибридного поиска
+            from models.vector_data import search_vector_expression
+            for table, columns in (("knowledge_base", ("title", "content")),
+                                   ("lesson_embeddings", ("content_chunk",))):
+                await conn.execute(text(f"""
+                    ALTER TABLE {table}
+                    ADD COLUMN IF NOT EXISTS search_vector tsvector
+                    GENERATED ALWAYS AS ({search_vector_expression(*columns)}) STORED
+                """))
+        logger.info("Database schema migrated successfully")
+
+    except Exception as e:
+        logger.error(f"Error migrating database schema: {e}")
+        raise
+
+
 async def create_vector_index():
     """Создание индексов для векторного поиска"""
     try:
-        with engine.connect() as conn:
+        async with async_engine.begin() as conn:
             # Создаем HNSW индекс для быстрого поиска по векторам
-            conn.execute(text("""
-                CREATE INDEX IF NOT EXISTS lesson_content_embedding_idx 
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS lesson_content_embedding_idx
                 ON lesson_embeddings USING hnsw (embedding vector_cosine_ops)
             """))
 
-            conn.execute(text("""
-                CREATE INDEX IF NOT EXISTS knowledge_base_embedding_idx 
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS knowledge_base_embedding_idx
                 ON knowledge_base USING hnsw (embedding vector_cosine_ops)
             """))
 
-            conn.commit()
+            # GIN индексы для полнотекстовой части гибридного поиска
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS knowledge_base_search_vector_idx
+                ON knowledge_base USING gin (search_vector)
+            """))
+
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS lesson_embeddings_search_vector_idx
+                ON lesson_embeddings USING gin (search_vector)
+            """))
+
             logger.info("Vector indexes created successfully")
 
     except Exception as e:
         logger.error(f"Error creating vector indexes: {e}")
         raise
+
+
+async def close_db():
+    """Закрытие пулов соединений при остановке приложения"""
+    await async_engine.dispose()
+    engine.dispose()
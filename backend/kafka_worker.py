@@ -0,0 +1,48 @@
+"""
+Воркер обработки событий Kafka
+
+Запускается отдельно от API; для горизонтального масштабирования
+запустите несколько воркеров с одним --group-id.
+
+Запуск (из директории backend):
+    python kafka_worker.py
+    python kafka_worker.py --topics lesson-events --group-id lesson_events_processor
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+
+from prometheus_client import start_http_server
+
+from config import settings
+from database import close_db
+from services.kafka_consumer import KafkaConsumerWorker
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topics", nargs="+", default=None,
+                        help="по умолчанию все топики событий")
+    parser.add_argument("--group-id", default=None)
+    parser.add_argument("--metrics-port", type=int, default=settings.KAFKA_WORKER_METRICS_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    start_http_server(args.metrics_port)
+
+    worker = KafkaConsumerWorker(topics=args.topics, group_id=args.group_id)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
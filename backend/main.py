@@ -1,34 +1,49 @@
-from fastapi import FastAPI, Depends, Response
+from fastapi import FastAPI, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
 
 from config import settings
-from database import init_db, create_vector_index
+from database import init_db, migrate_schema, create_vector_index, close_db
 from routers import auth, lessons, gamification, ai_routes, search, users, analytics
-from services.kafka_service import KafkaService
-from metrics import PrometheusMiddleware, get_metrics, CONTENT_TYPE_LATEST
+from services.kafka_service import kafka_service
+from metrics import PrometheusMiddleware, get_metrics, system_metrics_sampler
 from analytics import analytics as analytics_service
+from analytics_deletion import user_deletions
+from services.openai_client import openai_client
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     await init_db()
+    await migrate_schema()
     print("Database initialized")
 
     # Создаем векторные индексы
     await create_vector_index()
     print("Vector indexes created")
 
-    # Инициализация Kafka сервиса
-    kafka_service = KafkaService()
-    app.state.kafka_service = kafka_service
-    print("Kafka service initialized")
+    # Системные метрики обновляются в фоне, а не в /metrics
+    system_metrics_sampler.start()
+
+    # Общий пул соединений OpenAI
+    openai_client.start()
+    print("OpenAI client initialized")
+
+    # Инициализация Kafka сервиса (общий producer на процесс)
+    try:
+        await kafka_service.start()
+        app.state.kafka_service = kafka_service
+        print("Kafka service initialized")
+    except Exception as e:
+        print(f"Failed to initialize Kafka producer: {e}")
 
     # Инициализация аналитики
     try:
         await analytics_service.initialize()
+        # Пакетное удаление данных пользователей (GDPR)
+        user_deletions.start()
         print("Analytics service initialized")
     except Exception as e:
         print(f"Failed to initialize analytics: {e}")
@@ -37,7 +52,12 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     if hasattr(app.state, 'kafka_service'):
-        app.state.kafka_service.close()
+        await app.state.kafka_service.close()
+    await user_deletions.stop()
+    await analytics_service.close()
+    await openai_client.close()
+    await close_db()
+    await system_metrics_sampler.stop()
     print("Application shutdown complete")
 
 
@@ -58,8 +78,7 @@ app.add_middleware(
 )
 
 # Prometheus middleware
-prometheus_middleware = PrometheusMiddleware()
-app.middleware("http")(prometheus_middleware)
+app.add_middleware(PrometheusMiddleware)
 
 # Подключение роутеров
 app.include_router(auth.router, prefix=settings.API_V1_STR)
@@ -104,9 +123,14 @@ async def readiness_check():
 
 
 @app.get("/metrics")
-async def metrics():
-    """Prometheus metrics endpoint"""
-    return Response(get_metrics(), media_type=CONTENT_TYPE_LATEST)
+def metrics(request: Request):
+    """Prometheus metrics endpoint
+
+    Синхронный обработчик: в multiprocess mode сбор читает файлы всех
+    воркеров и выполняется в пуле потоков, а не в event loop.
+    """
+    data, content_type = get_metrics(request.headers.get("accept"))
+    return Response(data, media_type=content_type)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,16 @@
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
-from prometheus_client.multiprocess import MultiProcessCollector
-from prometheus_client.registry import REGISTRY
+from prometheus_client import Counter, Histogram, Gauge
+from prometheus_client import multiprocess
+from prometheus_client.exposition import choose_encoder
+from prometheus_client.registry import REGISTRY, CollectorRegistry
+import asyncio
 import time
-from typing import Callable
-from fastapi import Request, Response
+from typing import Dict, Optional, Tuple
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import psutil
 import os
 
+from config import settings
+
 # Метрики для HTTP запросов
 http_requests_total = Counter(
     'http_requests_total',
@@ -17,7 +21,15 @@ http_requests_total = Counter(
 http_request_duration_seconds = Histogram(
     'http_request_duration_seconds',
     'HTTP request duration in seconds',
-    ['method', 'endpoint']
+    ['method', 'endpoint'],
+    buckets=settings.HTTP_LATENCY_BUCKETS
+)
+
+http_requests_in_progress = Gauge(
+    'http_requests_in_progress',
+    'Number of HTTP requests in progress',
+    ['method'],
+    multiprocess_mode='livesum'
 )
 
 # Метрики для бизнес-логики
@@ -44,6 +56,143 @@ ai_request_duration_seconds = Histogram(
     ['request_type']
 )
 
+openai_retries_total = Counter(
+    'openai_retries_total',
+    'Total number of retried OpenAI API requests',
+    ['model', 'error']
+)
+
+openai_inflight_requests = Gauge(
+    'openai_inflight_requests',
+    'Number of OpenAI API requests in progress',
+    ['model']
+)
+
+# Метрики Kafka producer
+kafka_producer_queue_depth = Gauge(
+    'kafka_producer_queue_depth',
+    'Number of events waiting in the Kafka producer queue'
+)
+
+kafka_delivery_latency_seconds = Histogram(
+    'kafka_delivery_latency_seconds',
+    'Time from event enqueue to broker acknowledgement',
+    ['topic'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+kafka_events_dropped_total = Counter(
+    'kafka_events_dropped_total',
+    'Total number of events dropped before reaching Kafka',
+    ['topic', 'reason']
+)
+
+kafka_delivery_errors_total = Counter(
+    'kafka_delivery_errors_total',
+    'Total number of events the broker failed to acknowledge',
+    ['topic']
+)
+
+# Метрики Kafka consumer воркера
+kafka_consumer_messages_total = Counter(
+    'kafka_consumer_messages_total',
+    'Total number of consumed Kafka messages',
+    ['topic', 'status']
+)
+
+kafka_consumer_lag = Gauge(
+    'kafka_consumer_lag',
+    'Messages between partition highwater and consumer position',
+    ['topic', 'partition']
+)
+
+kafka_consumer_batch_duration_seconds = Histogram(
+    'kafka_consumer_batch_duration_seconds',
+    'Time to process one partition batch including the DB commit',
+    ['topic']
+)
+
+# Метрики записи аналитики в ClickHouse
+analytics_buffer_rows = Gauge(
+    'analytics_buffer_rows',
+    'Rows waiting in the ClickHouse batch writer buffer',
+    ['table']
+)
+
+analytics_flushes_total = Counter(
+    'analytics_flushes_total',
+    'Total number of ClickHouse batch inserts',
+    ['table', 'status']
+)
+
+analytics_wal_batches = Gauge(
+    'analytics_wal_batches',
+    'Batches spilled to the local WAL and not yet replayed',
+    ['table']
+)
+
+analytics_quarantined_batches_total = Counter(
+    'analytics_quarantined_batches_total',
+    'Batches rejected by ClickHouse as invalid and moved to the WAL quarantine',
+    ['table']
+)
+
+# Метрики запросов чтения к ClickHouse
+clickhouse_query_duration_seconds = Histogram(
+    'clickhouse_query_duration_seconds',
+    'ClickHouse read query duration in seconds',
+    ['query']
+)
+
+clickhouse_query_errors_total = Counter(
+    'clickhouse_query_errors_total',
+    'Total number of failed ClickHouse read queries',
+    ['query', 'error']
+)
+
+# Метрики кеша результатов аналитики
+analytics_cache_requests_total = Counter(
+    'analytics_cache_requests_total',
+    'Total number of analytics result cache lookups',
+    ['endpoint', 'result']
+)
+
+# Метрики удаления данных пользователей из аналитики
+analytics_deletion_pending_users = Gauge(
+    'analytics_deletion_pending_users',
+    'Number of users waiting for analytics data deletion'
+)
+
+analytics_deletion_batches_total = Counter(
+    'analytics_deletion_batches_total',
+    'Total number of started analytics deletion batches',
+    ['mode']
+)
+
+# Метрики кеша embeddings
+embedding_cache_hits_total = Counter(
+    'embedding_cache_hits_total',
+    'Total number of embedding cache hits',
+    ['tier']
+)
+
+embedding_cache_misses_total = Counter(
+    'embedding_cache_misses_total',
+    'Total number of embedding cache misses'
+)
+
+# Метрики кеша ответов AI-тьютора
+tutor_answer_cache_requests_total = Counter(
+    'tutor_answer_cache_requests_total',
+    'Total number of tutor answer cache lookups',
+    ['result']
+)
+
+tutor_answer_cache_latency_saved_seconds_total = Counter(
+    'tutor_answer_cache_latency_saved_seconds_total',
+    'Total chat completion time saved by tutor answer cache hits'
+)
+
 # Метрики системы
 active_users = Gauge(
     'active_users',
@@ -55,62 +204,115 @@ database_connections = Gauge(
     'Number of active database connections'
 )
 
-# Метрики ресурсов
+# Метрики ресурсов (значения хоста одинаковы во всех воркерах,
+# в multiprocess mode отдается максимум по живым процессам)
 cpu_usage_percent = Gauge(
     'cpu_usage_percent',
-    'CPU usage percentage'
+    'CPU usage percentage',
+    multiprocess_mode='livemax'
 )
 
 memory_usage_bytes = Gauge(
     'memory_usage_bytes',
-    'Memory usage in bytes'
+    'Memory usage in bytes',
+    multiprocess_mode='livemax'
 )
 
 disk_usage_percent = Gauge(
     'disk_usage_percent',
-    'Disk usage percentage'
+    'Disk usage percentage',
+    multiprocess_mode='livemax'
 )
 
 
-class PrometheusMiddleware:
-    """Middleware для сбора метрик HTTP запросов"""
+HTTP_METHODS = frozenset(
+    ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
 
-    def __init__(self, app_name: str = "financial_literacy_app"):
-        self.app_name = app_name
+# Метка для запросов, не совпавших ни с одним маршрутом
+UNMATCHED_ENDPOINT = "unmatched"
 
-    async def __call__(self, request: Request, call_next: Callable) -> Response:
-        start_time = time.time()
 
-        # Получаем путь без query параметров
-        path = request.url.path
-        method = request.method
+def _route_template(scope: Scope) -> str:
+    """Шаблон маршрута, выбранного роутером (/api/v1/lessons/{lesson_id})"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ENDPOINT
 
-        # Выполняем запрос
-        response = await call_next(request)
 
-        # Записываем метрики
-        duration = time.time() - start_time
-        status_code = str(response.status_code)
+def _trace_exemplar(scope: Scope) -> Optional[Dict[str, str]]:
+    """Exemplar с trace ID из заголовка W3C traceparent"""
+    for name, value in scope["headers"]:
+        if name == b"traceparent":
+            parts = value.decode("latin-1").split("-")
+            if (len(parts) == 4 and len(parts[1]) == 32 and parts[1] != "0" * 32
+                    and all(c in "0123456789abcdef" for c in parts[1])):
+                return {"trace_id": parts[1]}
+            return None
+    return None
 
-        http_requests_total.labels(
-            method=method,
-            endpoint=path,
-            status_code=status_code
-        ).inc()
 
-        http_request_duration_seconds.labels(
-            method=method,
-            endpoint=path
-        ).observe(duration)
+class PrometheusMiddleware:
+    """ASGI middleware для сбора метрик HTTP запросов
+
+    Метка endpoint - шаблон маршрута, а не путь запроса: число временных
+    рядов ограничено числом маршрутов, запросы без маршрута (404 при
+    сканировании путей) попадают в endpoint="unmatched", неизвестные
+    методы - в method="OTHER". Длительность включает передачу всего тела
+    ответа. Trace ID из traceparent прикрепляется как exemplar (виден
+    в формате OpenMetrics, без multiprocess mode).
+    """
+
+    def __init__(self, app: ASGIApp, app_name: str = "financial_literacy_app"):
+        self.app = app
+        self.app_name = app_name
 
-        return response
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"] if scope["method"] in HTTP_METHODS else "OTHER"
+        status_code = "500"
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = str(message["status"])
+            await send(message)
+
+        in_progress = http_requests_in_progress.labels(method=method)
+        in_progress.inc()
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start_time
+            in_progress.dec()
+
+            # Роутер записывает выбранный маршрут в scope
+            endpoint = _route_template(scope)
+            exemplar = _trace_exemplar(scope)
+
+            http_requests_total.labels(
+                method=method,
+                endpoint=endpoint,
+                status_code=status_code
+            ).inc(exemplar=exemplar)
+
+            http_request_duration_seconds.labels(
+                method=method,
+                endpoint=endpoint
+            ).observe(duration, exemplar=exemplar)
 
 
 def update_system_metrics():
-    """Обновляет системные метрики"""
+    """Обновляет системные метрики
+
+    CPU считается с момента предыдущего вызова (interval=None), без
+    ожидания внутри psutil.
+    """
     try:
         # CPU usage
-        cpu_percent = psutil.cpu_percent(interval=1)
+        cpu_percent = psutil.cpu_percent(interval=None)
         cpu_usage_percent.set(cpu_percent)
 
         # Memory usage
@@ -125,17 +327,73 @@ def update_system_metrics():
         print(f"Error updating system metrics: {e}")
 
 
-def get_metrics():
-    """Возвращает метрики в формате Prometheus"""
-    # Обновляем системные метрики
-    update_system_metrics()
+class SystemMetricsSampler:
+    """Фоновое обновление системных метрик
+
+    Метрики обновляются по таймеру в отдельном потоке, а не при каждом
+    запросе /metrics: scrape не ждет psutil и не блокирует event loop.
+    """
+
+    def __init__(self, interval_seconds: float = 15.0):
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        # Первый вызов cpu_percent(interval=None) задает начало интервала
+        psutil.cpu_percent(interval=None)
+        self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            await asyncio.to_thread(update_system_metrics)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if _multiprocess_dir():
+            # Gauge live* этого процесса больше не должны попадать в ответ
+            multiprocess.mark_process_dead(os.getpid())
+
+
+def _multiprocess_dir() -> Optional[str]:
+    return (os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+            or os.environ.get('prometheus_multiproc_dir'))
+
+
+def _build_registry() -> CollectorRegistry:
+    """Реестр для /metrics
+
+    В multiprocess mode метрики всех воркеров собираются из файлов в
+    PROMETHEUS_MULTIPROC_DIR; собственный реестр без метрик процесса,
+    иначе значения текущего воркера были бы отданы дважды.
+    """
+    if not _multiprocess_dir():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+metrics_registry = _build_registry()
+
+# Глобальный сэмплер системных метрик (запускается в lifespan)
+system_metrics_sampler = SystemMetricsSampler(settings.SYSTEM_METRICS_INTERVAL_SECONDS)
+
 
-    # Если используется multiprocess mode
-    if 'prometheus_multiproc_dir' in os.environ:
-        registry = REGISTRY
-        MultiProcessCollector(registry)
+def get_metrics(accept_header: Optional[str] = None) -> Tuple[bytes, str]:
+    """Возвращает метрики и их content type
 
-    return generate_latest()
+    Формат выбирается по Accept: OpenMetrics (с exemplars), если его
+    запрашивает Prometheus, иначе текстовый формат Prometheus.
+    """
+    encoder, content_type = choose_encoder(accept_header)
+    return encoder(metrics_registry), content_type
 
 
 # Декораторы для бизнес-метрик
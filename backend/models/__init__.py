@@ -4,7 +4,7 @@ from .gamification import UserCoins, Challenge, UserChallenge, MassEvent, CoinTr
 from .ai import PersonalPlan, LessonContent, QuizValidation, AIInteraction
 from .vector_data import (
     KnowledgeBase, LessonEmbedding, UserInteraction,
-    SearchQuery, ContentRecommendation, FinancialConcept
+    SearchQuery, ContentRecommendation, FinancialConcept, ConceptNeighbor
 )
 
 __all__ = [
@@ -39,4 +39,5 @@ __all__ = [
     "SearchQuery",
     "ContentRecommendation",
     "FinancialConcept",
+    "ConceptNeighbor",
 ]
@@ -83,5 +83,5 @@ class AIInteraction(Base):
     cost_usd = Column(Float, nullable=True)
     status = Column(String, default="completed")  # pending, completed, failed
     error_message = Column(Text, nullable=True)
-    metadata = Column(JSON, nullable=True)  # дополнительные данные
+    metadata_ = Column("metadata", JSON, nullable=True)  # дополнительные данные
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -34,7 +34,7 @@ class CoinTransaction(Base):
     transaction_type = Column(String, nullable=False)
     description = Column(String, nullable=True)
     # дополнительная информация о транзакции
-    metadata = Column(JSON, nullable=True)
+    metadata_ = Column("metadata", JSON, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationships
@@ -1,10 +1,18 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float, Boolean, Computed, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 from pgvector.sqlalchemy import Vector
+from config import settings
 from database import Base
 
 
+def search_vector_expression(*columns: str) -> str:
+    """Выражение для генерируемой tsvector колонки полнотекстового поиска"""
+    document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+    return f"to_tsvector('{settings.SEARCH_TEXT_CONFIG}'::regconfig, {document})"
+
+
 class KnowledgeBase(Base):
     """База знаний по финансовой грамотности"""
     __tablename__ = "knowledge_base"
@@ -21,6 +29,11 @@ class KnowledgeBase(Base):
     tags = Column(String, nullable=True)  # comma-separated tags
     source = Column(String, nullable=True)  # источник информации
     embedding = Column(Vector(1536), nullable=True)  # OpenAI embedding vector
+    # sha256 заголовка и содержания для дедупликации при загрузке
+    content_hash = Column(String(64), nullable=True, unique=True, index=True)
+    # полнотекстовый индекс для гибридного поиска
+    search_vector = deferred(Column(
+        TSVECTOR, Computed(search_vector_expression("title", "content"), persisted=True)))
     is_verified = Column(Boolean, default=False)  # проверено экспертами
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -36,7 +49,9 @@ class LessonEmbedding(Base):
     chunk_index = Column(Integer, nullable=False)  # порядковый номер части
     embedding = Column(Vector(1536), nullable=False)  # OpenAI embedding vector
     # дополнительные метаданные в JSON
-    metadata = Column(String, nullable=True)
+    metadata_ = Column("metadata", String, nullable=True)
+    search_vector = deferred(Column(
+        TSVECTOR, Computed(search_vector_expression("content_chunk"), persisted=True)))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationships
@@ -107,3 +122,19 @@ class FinancialConcept(Base):
     usage_count = Column(Integer, default=0)  # сколько раз использовался
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+
+class ConceptNeighbor(Base):
+    """Предвычисленный граф ближайших концепций (по векторному сходству)"""
+    __tablename__ = "concept_neighbors"
+
+    concept_id = Column(Integer, ForeignKey("financial_concepts.id", ondelete="CASCADE"),
+                        primary_key=True)
+    neighbor_id = Column(Integer, ForeignKey("financial_concepts.id", ondelete="CASCADE"),
+                         primary_key=True)
+    similarity = Column(Float, nullable=False)  # 1 - косинусное расстояние
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_concept_neighbors_concept_similarity", "concept_id", "similarity"),
+    )
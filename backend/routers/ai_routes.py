@@ -1,8 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+import time
 
-from database import get_db
+from config import settings
+from database import get_async_db, AsyncSessionLocal
 from models.user import User
 from models.ai import PersonalPlan, LessonContent, QuizValidation, AIInteraction
 from models.lesson import Lesson, Quiz
@@ -14,6 +17,7 @@ from schemas.ai import (
 )
 from services.ai_service import AIService
 from services.vector_service import VectorService
+from services.answer_cache import tutor_answer_cache
 from routers.auth import get_current_user_dependency
 
 router = APIRouter(prefix="/ai", tags=["AI & Machine Learning"])
@@ -23,7 +27,7 @@ router = APIRouter(prefix="/ai", tags=["AI & Machine Learning"])
 async def create_personal_plan(
     plan_request: PersonalPlanCreate,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Создание персонального плана обучения с помощью OpenAI"""
@@ -31,15 +35,16 @@ async def create_personal_plan(
         ai_service = AIService(db)
 
         # Проверяем, есть ли уже план у пользователя
-        existing_plan = db.query(PersonalPlan).filter(
+        result = await db.execute(select(PersonalPlan).where(
             PersonalPlan.user_id == current_user.id,
             PersonalPlan.is_active == True
-        ).first()
+        ))
+        existing_plan = result.scalars().first()
 
         if existing_plan:
             # Деактивируем старый план
             existing_plan.is_active = False
-            db.commit()
+            await db.commit()
 
         # Генерируем новый план
         personal_plan = await ai_service.generate_personal_plan(
@@ -52,8 +57,7 @@ async def create_personal_plan(
         # В фоне векторизуем план для поиска
         background_tasks.add_task(
             vectorize_plan_content,
-            personal_plan.id,
-            db
+            personal_plan.id
         )
 
         return personal_plan
@@ -67,14 +71,15 @@ async def create_personal_plan(
 
 @router.get("/personal-plan", response_model=PersonalPlanResponse)
 async def get_personal_plan(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение текущего персонального плана пользователя"""
-    plan = db.query(PersonalPlan).filter(
+    result = await db.execute(select(PersonalPlan).where(
         PersonalPlan.user_id == current_user.id,
         PersonalPlan.is_active == True
-    ).first()
+    ))
+    plan = result.scalars().first()
 
     if not plan:
         raise HTTPException(
@@ -88,14 +93,13 @@ async def get_personal_plan(
 @router.post("/lesson-content", response_model=LessonContentResponse)
 async def generate_lesson_content(
     content_request: LessonContentRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Генерация адаптивного контента урока с помощью OpenAI"""
     try:
         # Проверяем существование урока
-        lesson = db.query(Lesson).filter(
-            Lesson.id == content_request.lesson_id).first()
+        lesson = await db.get(Lesson, content_request.lesson_id)
         if not lesson:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -122,14 +126,13 @@ async def generate_lesson_content(
 @router.post("/quiz-validation", response_model=QuizValidationResponse)
 async def validate_quiz_answer(
     validation_request: QuizValidationRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Интеллектуальная валидация ответа на тест с помощью OpenAI"""
     try:
         # Проверяем существование теста
-        quiz = db.query(Quiz).filter(
-            Quiz.id == validation_request.quiz_id).first()
+        quiz = await db.get(Quiz, validation_request.quiz_id)
         if not quiz:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -156,7 +159,7 @@ async def validate_quiz_answer(
 @router.post("/generate-concepts", response_model=List[FinancialConceptResponse])
 async def generate_financial_concepts(
     concept_request: ConceptGenerationRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Генерация финансовых концепций с помощью OpenAI"""
@@ -193,7 +196,7 @@ async def generate_financial_concepts(
 async def ai_tutor_chat(
     question: str,
     context: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """AI-тьютор для ответов на вопросы по финансовой грамотности"""
@@ -208,6 +211,12 @@ async def ai_tutor_chat(
             limit=3
         )
 
+        # Ответ на близкий вопрос с тем же контекстом берем из кеша
+        # (embedding вопроса уже в кеше embeddings после поиска)
+        question_embedding = await vector_service.create_embedding(question)
+        context_key = tutor_answer_cache.context_key(search_results, context)
+        cached = await tutor_answer_cache.get(ai_service.model, context_key, question_embedding)
+
         # Формируем контекст для AI
         knowledge_context = "\n".join([
             f"- {result['title']}: {result['content'][:200]}..."
@@ -227,27 +236,44 @@ async def ai_tutor_chat(
         структурированный ответ с практическими советами.
         """
 
-        response = await ai_service.client.chat.completions.create(
-            model=ai_service.model,
-            messages=[
-                {"role": "system",
-                    "content": ai_service._get_financial_expert_system_prompt()},
-                {"role": "user", "content": tutor_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-
-        ai_response = response.choices[0].message.content
+        if cached:
+            ai_response = cached["answer"]
 
-        # Логируем взаимодействие
-        await ai_service._log_ai_interaction(
-            user_id=current_user.id,
-            interaction_type="tutor_chat",
-            prompt=tutor_prompt,
-            response=ai_response,
-            tokens_used=response.usage.total_tokens
-        )
+            await ai_service._log_ai_interaction(
+                user_id=current_user.id,
+                interaction_type="tutor_chat",
+                prompt=tutor_prompt,
+                response=ai_response,
+                tokens_used=0,
+                metadata={"cache": "hit", "similarity": cached["similarity"]}
+            )
+        else:
+            start_time = time.time()
+            response = await ai_service.client.chat_completion(
+                model=ai_service.model,
+                messages=[
+                    {"role": "system",
+                        "content": ai_service._get_financial_expert_system_prompt()},
+                    {"role": "user", "content": tutor_prompt}
+                ],
+                temperature=0.7,
+                max_tokens=1000
+            )
+            generation_seconds = time.time() - start_time
+
+            ai_response = response.choices[0].message.content
+            await tutor_answer_cache.set(ai_service.model, context_key, question,
+                                         question_embedding, ai_response, generation_seconds)
+
+            # Логируем взаимодействие
+            await ai_service._log_ai_interaction(
+                user_id=current_user.id,
+                interaction_type="tutor_chat",
+                prompt=tutor_prompt,
+                response=ai_response,
+                tokens_used=response.usage.total_tokens,
+                processing_time_ms=int(generation_seconds * 1000)
+            )
 
         # Извлекаем связанные концепции из результатов поиска
         related_concepts = [result['title'] for result in search_results]
@@ -275,10 +301,27 @@ async def ai_tutor_chat(
         )
 
 
+@router.delete("/tutor-chat/cache")
+async def invalidate_tutor_cache(
+    model: Optional[str] = None,
+    current_user: User = Depends(get_current_user_dependency)
+):
+    """Сброс кеша ответов AI-тьютора для модели (по умолчанию - текущей)"""
+    # В реальном приложении здесь была бы проверка прав администратора
+    model = model or settings.OPENAI_MODEL
+    generation = await tutor_answer_cache.invalidate_model(model)
+    if generation is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Кеш ответов недоступен"
+        )
+    return {"model": model, "generation": generation}
+
+
 @router.get("/recommendations", response_model=List[PersonalizedRecommendation])
 async def get_ai_recommendations(
     limit: int = 5,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение персонализированных рекомендаций от AI"""
@@ -310,7 +353,7 @@ async def get_ai_recommendations(
 async def analyze_content_quality(
     content: str,
     content_type: str = "lesson",
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Анализ качества образовательного контента с помощью AI"""
@@ -332,7 +375,7 @@ async def analyze_content_quality(
         Дай рекомендации по улучшению.
         """
 
-        response = await ai_service.client.chat.completions.create(
+        response = await ai_service.client.chat_completion(
             model=ai_service.model,
             messages=[
                 {"role": "system",
@@ -372,33 +415,34 @@ async def get_ai_interactions(
     interaction_type: Optional[str] = None,
     skip: int = 0,
     limit: int = 20,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение истории взаимодействий с AI"""
-    query = db.query(AIInteraction).filter(
+    query = select(AIInteraction).where(
         AIInteraction.user_id == current_user.id)
 
     if interaction_type:
-        query = query.filter(
+        query = query.where(
             AIInteraction.interaction_type == interaction_type)
 
-    interactions = query.order_by(
-        AIInteraction.created_at.desc()).offset(skip).limit(limit).all()
-    return interactions
+    result = await db.execute(query.order_by(
+        AIInteraction.created_at.desc()).offset(skip).limit(limit))
+    return result.scalars().all()
 
 
 @router.get("/learning-path/{plan_id}", response_model=List[LearningPathStep])
 async def get_learning_path_steps(
     plan_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение детализированных шагов обучения из персонального плана"""
-    plan = db.query(PersonalPlan).filter(
+    result = await db.execute(select(PersonalPlan).where(
         PersonalPlan.id == plan_id,
         PersonalPlan.user_id == current_user.id
-    ).first()
+    ))
+    plan = result.scalars().first()
 
     if not plan:
         raise HTTPException(
@@ -426,12 +470,15 @@ async def get_learning_path_steps(
 
 
 # Вспомогательные функции
-async def vectorize_plan_content(plan_id: int, db: Session):
+async def vectorize_plan_content(plan_id: int):
     """Фоновая задача для векторизации контента плана"""
     try:
-        plan = db.query(PersonalPlan).filter(
-            PersonalPlan.id == plan_id).first()
-        if plan:
+        # Сессия запроса к этому моменту уже закрыта, открываем свою
+        async with AsyncSessionLocal() as db:
+            plan = await db.get(PersonalPlan, plan_id)
+            if not plan:
+                return
+
             vector_service = VectorService(db)
 
             # Создаем текстовое представление плана для векторизации
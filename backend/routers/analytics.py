@@ -1,9 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
+import asyncio
 import uuid
 
 from analytics import analytics, AnalyticsEvent, EventType
+from analytics_cache import analytics_cache
+from analytics_deletion import user_deletions
+from analytics_export import ENCODERS, MEDIA_TYPES, UserEventsExport, gzip_stream
 from schemas.analytics import (
     AnalyticsEventCreate,
     UserAnalyticsResponse,
@@ -75,10 +80,19 @@ async def get_platform_analytics(
             raise HTTPException(
                 status_code=403, detail="Admin access required")
 
-        data = await analytics.get_platform_analytics(days)
+        data, cache_age = await analytics_cache.get_or_compute(
+            "platform", {"days": days},
+            lambda: analytics.get_platform_analytics(days)
+        )
+
+        if not data:
+            raise HTTPException(
+                status_code=503, detail="Analytics storage is unavailable")
 
-        return PlatformAnalyticsResponse(**data)
+        return PlatformAnalyticsResponse(**data, cache_age_seconds=cache_age)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to get platform analytics: {str(e)}")
@@ -94,10 +108,18 @@ async def get_real_time_metrics(
             raise HTTPException(
                 status_code=403, detail="Admin access required")
 
-        data = await analytics.get_real_time_metrics()
+        data, cache_age = await analytics_cache.get_or_compute(
+            "real_time", {}, analytics.get_real_time_metrics
+        )
+
+        if not data:
+            raise HTTPException(
+                status_code=503, detail="Analytics storage is unavailable")
 
-        return RealTimeMetricsResponse(**data)
+        return RealTimeMetricsResponse(**data, cache_age_seconds=cache_age)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to get real-time metrics: {str(e)}")
@@ -201,6 +223,32 @@ async def track_ai_chat(
             status_code=500, detail=f"Failed to track AI chat: {str(e)}")
 
 
+async def _build_dashboard_overview() -> Dict[str, Any]:
+    """Краткий обзор для дашборда"""
+    # Получаем данные за последние 7 дней (запросы обоих методов параллельно)
+    platform_data, real_time_data = await asyncio.gather(
+        analytics.get_platform_analytics(7),
+        analytics.get_real_time_metrics()
+    )
+    if not platform_data or not real_time_data:
+        # Ошибка ClickHouse: пустой результат не попадает в кеш
+        return {}
+
+    platform_overview = platform_data.get("overview") or {}
+    last_hour = real_time_data.get("last_hour") or {}
+    return {
+        "total_users_7d": platform_overview.get("total_users", 0),
+        "new_registrations_7d": platform_overview.get("new_registrations", 0),
+        "lessons_completed_7d": platform_overview.get("lessons_completed", 0),
+        "ai_interactions_7d": platform_overview.get("ai_interactions", 0),
+        "active_users_now": last_hour.get("active_users", 0),
+        "active_sessions_now": real_time_data.get("active_sessions") or 0,
+        "top_lessons": platform_data.get("top_lessons", [])[:5],
+        "conversion_funnel": platform_data.get("funnel") or {},
+        "failed_sections": platform_data["failed_sections"] + real_time_data["failed_sections"]
+    }
+
+
 @router.get("/dashboard/overview")
 async def get_dashboard_overview(
     current_user=Depends(get_current_user)
@@ -211,24 +259,18 @@ async def get_dashboard_overview(
             raise HTTPException(
                 status_code=403, detail="Admin access required")
 
-        # Получаем данные за последние 7 дней
-        platform_data = await analytics.get_platform_analytics(7)
-        real_time_data = await analytics.get_real_time_metrics()
+        overview, cache_age = await analytics_cache.get_or_compute(
+            "dashboard_overview", {}, _build_dashboard_overview
+        )
 
-        # Формируем краткий обзор
-        overview = {
-            "total_users_7d": platform_data.get("overview", {}).get("total_users", 0),
-            "new_registrations_7d": platform_data.get("overview", {}).get("new_registrations", 0),
-            "lessons_completed_7d": platform_data.get("overview", {}).get("lessons_completed", 0),
-            "ai_interactions_7d": platform_data.get("overview", {}).get("ai_interactions", 0),
-            "active_users_now": real_time_data.get("last_hour", {}).get("active_users", 0),
-            "active_sessions_now": real_time_data.get("active_sessions", 0),
-            "top_lessons": platform_data.get("top_lessons", [])[:5],
-            "conversion_funnel": platform_data.get("funnel", {})
-        }
+        if not overview:
+            raise HTTPException(
+                status_code=503, detail="Analytics storage is unavailable")
 
-        return overview
+        return {**overview, "cache_age_seconds": cache_age}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to get dashboard overview: {str(e)}")
@@ -237,79 +279,111 @@ async def get_dashboard_overview(
 @router.get("/export/user/{user_id}")
 async def export_user_data(
     user_id: str,
-    format: str = Query("json", regex="^(json|csv)$"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    start: Optional[datetime] = Query(None, description="Начало периода (включительно)"),
+    end: Optional[datetime] = Query(None, description="Конец периода (не включительно)"),
+    after_event_id: Optional[str] = Query(
+        None, description="Продолжить после события с этим id и timestamp = start"),
+    gzip: bool = Query(True, description="Сжимать ответ gzip (кроме parquet)"),
     current_user=Depends(get_current_user)
 ):
-    """Экспорт данных пользователя (GDPR compliance)"""
+    """Потоковый экспорт событий пользователя (GDPR compliance)
+
+    События отдаются по мере чтения из ClickHouse в порядке (timestamp,
+    event_id), память не зависит от их количества. Прерванную выгрузку
+    можно продолжить с последней полученной строки через start и
+    after_event_id.
+    """
     try:
         # Проверяем права доступа
         if current_user.id != user_id and not current_user.is_admin:
             raise HTTPException(status_code=403, detail="Access denied")
 
-        data = await analytics.get_user_analytics(user_id)
+        export = UserEventsExport(
+            analytics._create_client, user_id,
+            start=start, end=end, after_event_id=after_event_id
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    stream = ENCODERS[format](export.chunks())
+    filename = f"user_{user_id}_events.{format}"
+    media_type = MEDIA_TYPES[format]
+    # Parquet уже сжат внутри файла
+    if gzip and format != "parquet":
+        stream = gzip_stream(stream)
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.delete("/user/{user_id}", status_code=202)
+async def delete_user_analytics(
+    user_id: str,
+    current_user=Depends(get_current_user)
+):
+    """Удаление аналитических данных пользователя (GDPR compliance)
 
-        if format == "csv":
-            # Конвертируем в CSV формат
-            import csv
-            import io
+    Данные пользователя сразу исключаются из запросов аналитики, а
+    физически удаляются пакетной мутацией вместе с другими запросами
+    (ANALYTICS_DELETION_INTERVAL_SECONDS). Прогресс -
+    GET /user/{user_id}/deletion.
+    """
+    try:
+        if not current_user.is_admin:
+            raise HTTPException(
+                status_code=403, detail="Admin access required")
 
-            output = io.StringIO()
-            writer = csv.writer(output)
+        return await user_deletions.request(user_id)
 
-            # Записываем заголовки и данные
-            writer.writerow(["Type", "Data"])
-            for key, value in data.items():
-                writer.writerow([key, str(value)])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Failed to delete user analytics: {str(e)}")
 
-            return {
-                "format": "csv",
-                "data": output.getvalue()
-            }
 
-        return {
-            "format": "json",
-            "data": data
-        }
+@router.get("/user/{user_id}/deletion")
+async def get_user_deletion_status(
+    user_id: str,
+    current_user=Depends(get_current_user)
+):
+    """Статус удаления данных пользователя и прогресс мутаций по таблицам"""
+    try:
+        if current_user.id != user_id and not current_user.is_admin:
+            raise HTTPException(status_code=403, detail="Access denied")
 
+        return await user_deletions.status(user_id)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
-            status_code=500, detail=f"Failed to export user data: {str(e)}")
+            status_code=500, detail=f"Failed to get deletion status: {str(e)}")
 
 
-@router.delete("/user/{user_id}")
-async def delete_user_analytics(
-    user_id: str,
+@router.get("/deletions")
+async def get_deletion_batches(
+    limit: int = Query(20, ge=1, le=100),
     current_user=Depends(get_current_user)
 ):
-    """Удаление аналитических данных пользователя (GDPR compliance)"""
+    """Последние пакеты удаления данных пользователей"""
     try:
         if not current_user.is_admin:
             raise HTTPException(
                 status_code=403, detail="Admin access required")
 
-        # Удаляем данные пользователя из всех таблиц
-        analytics.client.execute(
-            "ALTER TABLE events DELETE WHERE user_id = %(user_id)s",
-            {"user_id": user_id}
-        )
-
-        analytics.client.execute(
-            "ALTER TABLE users DELETE WHERE user_id = %(user_id)s",
-            {"user_id": user_id}
-        )
-
-        analytics.client.execute(
-            "ALTER TABLE sessions DELETE WHERE user_id = %(user_id)s",
-            {"user_id": user_id}
-        )
-
-        analytics.client.execute(
-            "ALTER TABLE lessons_analytics DELETE WHERE user_id = %(user_id)s",
-            {"user_id": user_id}
-        )
-
-        return {"status": "success", "message": "User analytics data deleted"}
+        return {"batches": await user_deletions.batches(limit)}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
-            status_code=500, detail=f"Failed to delete user analytics: {str(e)}")
+            status_code=500, detail=f"Failed to get deletion batches: {str(e)}")
@@ -2,10 +2,12 @@ from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, EmailStr
-from database import get_db, get_redis
+from database import get_db, get_async_db, get_redis
+from models.user import User
 from services.auth_service import AuthService
-from services.kafka_service import KafkaService
+from services.kafka_service import KafkaService, get_kafka_service
 import redis
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
@@ -51,7 +53,8 @@ class UserResponse(BaseModel):
 async def register(
     user_data: UserRegister,
     db: Session = Depends(get_db),
-    redis_client: redis.Redis = Depends(get_redis)
+    redis_client: redis.Redis = Depends(get_redis),
+    kafka_service: KafkaService = Depends(get_kafka_service)
 ):
     """Регистрация нового пользователя"""
 
@@ -63,7 +66,6 @@ async def register(
         )
 
     auth_service = AuthService(db, redis_client)
-    kafka_service = KafkaService()
 
     try:
         # Создаем пользователя
@@ -99,12 +101,12 @@ async def register(
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db),
-    redis_client: redis.Redis = Depends(get_redis)
+    redis_client: redis.Redis = Depends(get_redis),
+    kafka_service: KafkaService = Depends(get_kafka_service)
 ):
     """Авторизация пользователя"""
 
     auth_service = AuthService(db, redis_client)
-    kafka_service = KafkaService()
 
     # Аутентификация пользователя
     user = auth_service.authenticate_user(
@@ -237,12 +239,13 @@ async def get_current_user(
 # Dependency для получения текущего пользователя
 async def get_current_user_dependency(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     redis_client: redis.Redis = Depends(get_redis)
 ):
     """Dependency для получения текущего пользователя"""
 
-    auth_service = AuthService(db, redis_client)
+    # Проверка токена не обращается к БД, поэтому сессия не нужна
+    auth_service = AuthService(None, redis_client)
 
     payload = auth_service.verify_token(token)
     if not payload:
@@ -252,7 +255,7 @@ async def get_current_user_dependency(
         )
 
     user_id = int(payload.get("sub"))
-    user = auth_service.get_user_by_id(user_id)
+    user = await db.get(User, user_id)
 
     if not user:
         raise HTTPException(
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from typing import List, Optional
 from datetime import datetime, timedelta
 
-from database import get_db
+from database import get_async_db
 from models.user import User
 from models.gamification import (
     UserCoins, CoinTransaction, Challenge, UserChallenge,
@@ -16,7 +18,7 @@ from schemas.gamification import (
     LeaderboardEntry, ChallengeProgress
 )
 from routers.auth import get_current_user_dependency
-from services.kafka_service import KafkaService
+from services.kafka_service import KafkaService, get_kafka_service
 
 router = APIRouter(prefix="/gamification", tags=["Gamification"])
 
@@ -25,7 +27,7 @@ router = APIRouter(prefix="/gamification", tags=["Gamification"])
 @router.post("/challenges", response_model=ChallengeResponse)
 async def create_challenge(
     challenge: ChallengeCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Создание нового челленджа (только для администраторов)"""
@@ -43,8 +45,8 @@ async def create_challenge(
     )
 
     db.add(db_challenge)
-    db.commit()
-    db.refresh(db_challenge)
+    await db.commit()
+    await db.refresh(db_challenge)
 
     return db_challenge
 
@@ -56,28 +58,27 @@ async def get_challenges(
     is_active: bool = True,
     skip: int = 0,
     limit: int = 20,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение списка челленджей"""
-    query = db.query(Challenge).filter(Challenge.is_active == is_active)
+    query = select(Challenge).where(Challenge.is_active == is_active)
 
     if category:
-        query = query.filter(Challenge.category == category)
+        query = query.where(Challenge.category == category)
     if difficulty_level:
-        query = query.filter(Challenge.difficulty_level == difficulty_level)
+        query = query.where(Challenge.difficulty_level == difficulty_level)
 
-    challenges = query.offset(skip).limit(limit).all()
-    return challenges
+    result = await db.execute(query.offset(skip).limit(limit))
+    return result.scalars().all()
 
 
 @router.get("/challenges/{challenge_id}", response_model=ChallengeResponse)
 async def get_challenge(
     challenge_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение челленджа по ID"""
-    challenge = db.query(Challenge).filter(
-        Challenge.id == challenge_id).first()
+    challenge = await db.get(Challenge, challenge_id)
     if not challenge:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -89,12 +90,12 @@ async def get_challenge(
 @router.post("/challenges/{challenge_id}/join")
 async def join_challenge(
     challenge_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user_dependency)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_dependency),
+    kafka_service: KafkaService = Depends(get_kafka_service)
 ):
     """Присоединение к челленджу"""
-    challenge = db.query(Challenge).filter(
-        Challenge.id == challenge_id).first()
+    challenge = await db.get(Challenge, challenge_id)
     if not challenge:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -102,10 +103,11 @@ async def join_challenge(
         )
 
     # Проверяем, не участвует ли уже пользователь
-    existing = db.query(UserChallenge).filter(
+    result = await db.execute(select(UserChallenge).where(
         UserChallenge.user_id == current_user.id,
         UserChallenge.challenge_id == challenge_id
-    ).first()
+    ))
+    existing = result.scalars().first()
 
     if existing:
         raise HTTPException(
@@ -120,16 +122,14 @@ async def join_challenge(
     )
 
     db.add(user_challenge)
-    db.commit()
+    await db.commit()
 
     # Отправляем событие в Kafka
-    kafka_service = KafkaService()
-    await kafka_service.publish_gamification_event({
-        "event_type": "challenge_joined",
-        "user_id": current_user.id,
-        "challenge_id": challenge_id,
-        "timestamp": datetime.utcnow().isoformat()
-    })
+    await kafka_service.publish_gamification_event(
+        user_id=current_user.id,
+        event_type="challenge_joined",
+        data={"challenge_id": challenge_id}
+    )
 
     return {"message": "Успешно присоединились к челленджу"}
 
@@ -137,33 +137,36 @@ async def join_challenge(
 @router.get("/my-challenges", response_model=List[UserChallengeResponse])
 async def get_my_challenges(
     status_filter: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение челленджей пользователя"""
-    query = db.query(UserChallenge).filter(
+    query = select(UserChallenge).where(
         UserChallenge.user_id == current_user.id)
 
     if status_filter == "completed":
-        query = query.filter(UserChallenge.is_completed == True)
+        query = query.where(UserChallenge.is_completed == True)
     elif status_filter == "active":
-        query = query.filter(UserChallenge.is_completed == False)
+        query = query.where(UserChallenge.is_completed == False)
 
-    user_challenges = query.all()
-    return user_challenges
+    result = await db.execute(query)
+    return result.scalars().all()
 
 
 @router.get("/challenges/{challenge_id}/progress", response_model=ChallengeProgress)
 async def get_challenge_progress(
     challenge_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение прогресса по челленджу"""
-    user_challenge = db.query(UserChallenge).filter(
+    result = await db.execute(select(UserChallenge).options(
+        selectinload(UserChallenge.challenge)
+    ).where(
         UserChallenge.user_id == current_user.id,
         UserChallenge.challenge_id == challenge_id
-    ).first()
+    ))
+    user_challenge = result.scalars().first()
 
     if not user_challenge:
         raise HTTPException(
@@ -194,7 +197,7 @@ async def get_challenge_progress(
 @router.post("/events", response_model=MassEventResponse)
 async def create_mass_event(
     event: MassEventCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Создание массового события (только для администраторов)"""
@@ -210,8 +213,8 @@ async def create_mass_event(
     )
 
     db.add(db_event)
-    db.commit()
-    db.refresh(db_event)
+    await db.commit()
+    await db.refresh(db_event)
 
     return db_event
 
@@ -221,30 +224,30 @@ async def get_mass_events(
     is_active: bool = True,
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение списка массовых событий"""
-    query = db.query(MassEvent).filter(MassEvent.is_active == is_active)
+    query = select(MassEvent).where(MassEvent.is_active == is_active)
 
     if is_active:
         now = datetime.utcnow()
-        query = query.filter(
+        query = query.where(
             MassEvent.start_date <= now,
             MassEvent.end_date >= now
         )
 
-    events = query.offset(skip).limit(limit).all()
-    return events
+    result = await db.execute(query.offset(skip).limit(limit))
+    return result.scalars().all()
 
 
 @router.post("/events/{event_id}/join")
 async def join_mass_event(
     event_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Присоединение к массовому событию"""
-    event = db.query(MassEvent).filter(MassEvent.id == event_id).first()
+    event = await db.get(MassEvent, event_id)
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -252,10 +255,11 @@ async def join_mass_event(
         )
 
     # Проверяем, не участвует ли уже пользователь
-    existing = db.query(EventParticipant).filter(
+    result = await db.execute(select(EventParticipant).where(
         EventParticipant.user_id == current_user.id,
         EventParticipant.event_id == event_id
-    ).first()
+    ))
+    existing = result.scalars().first()
 
     if existing:
         raise HTTPException(
@@ -274,7 +278,7 @@ async def join_mass_event(
     # Обновляем счетчик участников
     event.current_participants += 1
 
-    db.commit()
+    await db.commit()
 
     return {"message": "Успешно присоединились к событию"}
 
@@ -282,12 +286,13 @@ async def join_mass_event(
 # Коины и транзакции
 @router.get("/coins", response_model=UserCoinsResponse)
 async def get_user_coins(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение баланса коинов пользователя"""
-    user_coins = db.query(UserCoins).filter(
-        UserCoins.user_id == current_user.id).first()
+    result = await db.execute(select(UserCoins).where(
+        UserCoins.user_id == current_user.id))
+    user_coins = result.scalars().first()
 
     if not user_coins:
         # Создаем запись если её нет
@@ -298,8 +303,8 @@ async def get_user_coins(
             total_spent=0
         )
         db.add(user_coins)
-        db.commit()
-        db.refresh(user_coins)
+        await db.commit()
+        await db.refresh(user_coins)
 
     return user_coins
 
@@ -309,45 +314,49 @@ async def get_coin_transactions(
     transaction_type: Optional[str] = None,
     skip: int = 0,
     limit: int = 20,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение истории транзакций коинов"""
-    query = db.query(CoinTransaction).filter(
+    query = select(CoinTransaction).where(
         CoinTransaction.user_id == current_user.id)
 
     if transaction_type:
-        query = query.filter(
+        query = query.where(
             CoinTransaction.transaction_type == transaction_type)
 
-    transactions = query.order_by(
-        CoinTransaction.created_at.desc()).offset(skip).limit(limit).all()
-    return transactions
+    result = await db.execute(query.order_by(
+        CoinTransaction.created_at.desc()).offset(skip).limit(limit))
+    return result.scalars().all()
 
 
 # Статистика и лидерборды
 @router.get("/stats", response_model=GamificationStats)
 async def get_gamification_stats(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение статистики геймификации пользователя"""
-    user_coins = db.query(UserCoins).filter(
-        UserCoins.user_id == current_user.id).first()
-
-    active_challenges = db.query(UserChallenge).filter(
-        UserChallenge.user_id == current_user.id,
-        UserChallenge.is_completed == False
-    ).count()
+    result = await db.execute(select(UserCoins).where(
+        UserCoins.user_id == current_user.id))
+    user_coins = result.scalars().first()
+
+    active_challenges = await db.scalar(
+        select(func.count()).select_from(UserChallenge).where(
+            UserChallenge.user_id == current_user.id,
+            UserChallenge.is_completed == False
+        ))
 
-    completed_challenges = db.query(UserChallenge).filter(
-        UserChallenge.user_id == current_user.id,
-        UserChallenge.is_completed == True
-    ).count()
+    completed_challenges = await db.scalar(
+        select(func.count()).select_from(UserChallenge).where(
+            UserChallenge.user_id == current_user.id,
+            UserChallenge.is_completed == True
+        ))
 
-    active_events = db.query(EventParticipant).filter(
-        EventParticipant.user_id == current_user.id
-    ).count()
+    active_events = await db.scalar(
+        select(func.count()).select_from(EventParticipant).where(
+            EventParticipant.user_id == current_user.id
+        ))
 
     return GamificationStats(
         total_coins=user_coins.current_balance if user_coins else 0,
@@ -363,20 +372,22 @@ async def get_gamification_stats(
 @router.get("/leaderboard", response_model=List[LeaderboardEntry])
 async def get_leaderboard(
     limit: int = Query(10, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение таблицы лидеров"""
     # Получаем топ пользователей по коинам
-    top_users = db.query(UserCoins, User).join(User).order_by(
+    result = await db.execute(select(UserCoins, User).join(User).order_by(
         UserCoins.current_balance.desc()
-    ).limit(limit).all()
+    ).limit(limit))
+    top_users = result.all()
 
     leaderboard = []
     for rank, (user_coins, user) in enumerate(top_users, 1):
-        completed_challenges = db.query(UserChallenge).filter(
-            UserChallenge.user_id == user.id,
-            UserChallenge.is_completed == True
-        ).count()
+        completed_challenges = await db.scalar(
+            select(func.count()).select_from(UserChallenge).where(
+                UserChallenge.user_id == user.id,
+                UserChallenge.is_completed == True
+            ))
 
         leaderboard.append(LeaderboardEntry(
             user_id=user.id,
@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from pydantic import BaseModel
-from database import get_db
+from database import get_async_db
 from models.user import User
 from models.lesson import Lesson, LessonProgress, Quiz, QuizAnswer
 from routers.auth import get_current_user_dependency
-from services.kafka_service import KafkaService
+from services.kafka_service import KafkaService, get_kafka_service
 
 router = APIRouter(prefix="/lessons", tags=["Lessons"])
 
@@ -55,29 +56,29 @@ class QuizAnswerRequest(BaseModel):
 async def get_lessons(
     category: str = None,
     difficulty: str = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение списка уроков"""
-    query = db.query(Lesson).filter(Lesson.is_active == True)
+    query = select(Lesson).where(Lesson.is_active == True)
 
     if category:
-        query = query.filter(Lesson.category == category)
+        query = query.where(Lesson.category == category)
     if difficulty:
-        query = query.filter(Lesson.difficulty_level == difficulty)
+        query = query.where(Lesson.difficulty_level == difficulty)
 
-    lessons = query.order_by(Lesson.order_index).all()
-    return lessons
+    result = await db.execute(query.order_by(Lesson.order_index))
+    return result.scalars().all()
 
 
 @router.get("/{lesson_id}", response_model=LessonResponse)
 async def get_lesson(
     lesson_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение конкретного урока"""
-    lesson = db.query(Lesson).filter(Lesson.id == lesson_id).first()
+    lesson = await db.get(Lesson, lesson_id)
 
     if not lesson:
         raise HTTPException(
@@ -91,11 +92,12 @@ async def get_lesson(
 @router.post("/{lesson_id}/start")
 async def start_lesson(
     lesson_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user_dependency)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_dependency),
+    kafka_service: KafkaService = Depends(get_kafka_service)
 ):
     """Начало прохождения урока"""
-    lesson = db.query(Lesson).filter(Lesson.id == lesson_id).first()
+    lesson = await db.get(Lesson, lesson_id)
 
     if not lesson:
         raise HTTPException(
@@ -104,10 +106,11 @@ async def start_lesson(
         )
 
     # Проверяем, есть ли уже прогресс
-    progress = db.query(LessonProgress).filter(
+    result = await db.execute(select(LessonProgress).where(
         LessonProgress.user_id == current_user.id,
         LessonProgress.lesson_id == lesson_id
-    ).first()
+    ))
+    progress = result.scalars().first()
 
     if not progress:
         progress = LessonProgress(
@@ -116,11 +119,10 @@ async def start_lesson(
             status="in_progress"
         )
         db.add(progress)
-        db.commit()
-        db.refresh(progress)
+        await db.commit()
+        await db.refresh(progress)
 
     # Отправляем событие в Kafka
-    kafka_service = KafkaService()
     await kafka_service.publish_lesson_event(
         user_id=current_user.id,
         lesson_id=lesson_id,
@@ -134,25 +136,26 @@ async def start_lesson(
 @router.get("/{lesson_id}/quizzes", response_model=List[QuizResponse])
 async def get_lesson_quizzes(
     lesson_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение тестов урока"""
-    quizzes = db.query(Quiz).filter(
+    result = await db.execute(select(Quiz).where(
         Quiz.lesson_id == lesson_id
-    ).order_by(Quiz.order_index).all()
+    ).order_by(Quiz.order_index))
 
-    return quizzes
+    return result.scalars().all()
 
 
 @router.post("/quiz/answer")
 async def answer_quiz(
     answer_data: QuizAnswerRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user_dependency)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_dependency),
+    kafka_service: KafkaService = Depends(get_kafka_service)
 ):
     """Ответ на тест"""
-    quiz = db.query(Quiz).filter(Quiz.id == answer_data.quiz_id).first()
+    quiz = await db.get(Quiz, answer_data.quiz_id)
 
     if not quiz:
         raise HTTPException(
@@ -174,10 +177,9 @@ async def answer_quiz(
     )
 
     db.add(quiz_answer)
-    db.commit()
+    await db.commit()
 
     # Отправляем событие в Kafka
-    kafka_service = KafkaService()
     await kafka_service.publish_lesson_event(
         user_id=current_user.id,
         lesson_id=quiz.lesson_id,
@@ -198,12 +200,12 @@ async def answer_quiz(
 
 @router.get("/progress/my", response_model=List[LessonProgressResponse])
 async def get_my_progress(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение прогресса пользователя"""
-    progress = db.query(LessonProgress).filter(
+    result = await db.execute(select(LessonProgress).where(
         LessonProgress.user_id == current_user.id
-    ).all()
+    ))
 
-    return progress
+    return result.scalars().all()
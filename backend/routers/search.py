@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
-from database import get_db
+import io
+from database import get_async_db
 from models.user import User
 from services.vector_service import VectorService
+from services.knowledge_ingestion import (
+    MAX_BATCH_SIZE, IngestionError, KnowledgeIngestionService, iter_knowledge_records
+)
 from routers.auth import get_current_user_dependency
 
 router = APIRouter(prefix="/search", tags=["Search & Recommendations"])
@@ -15,6 +21,8 @@ class SearchRequest(BaseModel):
     content_types: Optional[List[str]] = None
     categories: Optional[List[str]] = None
     limit: int = 10
+    hybrid: Optional[bool] = None  # None - значение SEARCH_HYBRID из настроек
+    search_fields: Optional[List[str]] = None  # дополнительные колонки результата
 
 
 class SearchResult(BaseModel):
@@ -27,6 +35,8 @@ class SearchResult(BaseModel):
     similarity: float
     source: Optional[str] = None
     duration_minutes: Optional[int] = None
+    score: Optional[float] = None  # RRF оценка гибридного поиска
+    fields: Optional[Dict[str, Any]] = None  # запрошенные search_fields
 
 
 class RecommendationResult(BaseModel):
@@ -53,7 +63,7 @@ class KnowledgeBaseRequest(BaseModel):
 @router.post("/semantic", response_model=List[SearchResult])
 async def semantic_search(
     search_request: SearchRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Семантический поиск по базе знаний и урокам"""
@@ -65,11 +75,18 @@ async def semantic_search(
             user_id=current_user.id,
             content_types=search_request.content_types,
             categories=search_request.categories,
-            limit=search_request.limit
+            limit=search_request.limit,
+            hybrid=search_request.hybrid,
+            search_fields=search_request.search_fields
         )
 
         return [SearchResult(**result) for result in results]
 
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -80,7 +97,7 @@ async def semantic_search(
 @router.get("/recommendations", response_model=List[RecommendationResult])
 async def get_recommendations(
     limit: int = Query(5, ge=1, le=20),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение персонализированных рекомендаций"""
@@ -105,7 +122,7 @@ async def get_recommendations(
 async def find_related_concepts(
     concept: str,
     limit: int = Query(5, ge=1, le=10),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Поиск связанных финансовых концепций"""
@@ -137,7 +154,7 @@ async def find_related_concepts(
 @router.post("/knowledge-base")
 async def add_knowledge(
     knowledge_request: KnowledgeBaseRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Добавление знаний в базу (только для администраторов)"""
@@ -161,6 +178,12 @@ async def add_knowledge(
             "message": "Знания успешно добавлены в базу"
         }
 
+    except IntegrityError:
+        # Уникальный индекс по content_hash: такой документ уже есть
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Документ с таким заголовком и содержанием уже есть в базе"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -168,10 +191,68 @@ async def add_knowledge(
         )
 
 
+class BulkIngestionResult(BaseModel):
+    processed: int
+    inserted: int
+    duplicates: int
+    invalid: int
+    batches: int
+    offset: int
+    elapsed_seconds: float
+    docs_per_second: float
+
+
+@router.post("/knowledge-base/bulk", response_model=BulkIngestionResult)
+async def bulk_add_knowledge(
+    file: UploadFile = File(..., description="Документы в формате JSONL или CSV"),
+    format: str = Query("jsonl", pattern="^(jsonl|csv)$"),
+    skip: int = Query(0, ge=0, description="Пропустить записи (offset прошлой загрузки)"),
+    batch_size: Optional[int] = Query(None, ge=1, le=MAX_BATCH_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_dependency)
+):
+    """Пакетная загрузка знаний в базу (только для администраторов)
+
+    Файл читается потоком; при обрыве загрузку можно продолжить,
+    передав skip равным offset из ответа (в том числе из ответа с
+    ошибкой) или из логов.
+    """
+    # В реальном приложении здесь была бы проверка прав администратора
+    try:
+        stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+        ingestion_service = KnowledgeIngestionService(db)
+
+        stats = await ingestion_service.ingest(
+            iter_knowledge_records(stream, format),
+            batch_size=batch_size,
+            skip=skip
+        )
+
+        return BulkIngestionResult(**stats)
+
+    except IngestionError as e:
+        # Пакеты до offset уже закоммичены: продолжение - skip=offset
+        if isinstance(e.__cause__, ValueError):
+            status_code = status.HTTP_400_BAD_REQUEST
+            message = f"Некорректный файл: {str(e.__cause__)}"
+        else:
+            status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+            message = f"Ошибка при пакетной загрузке знаний: {str(e.__cause__)}"
+        raise HTTPException(
+            status_code=status_code,
+            detail={"message": message, "offset": e.offset, **e.stats}
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при пакетной загрузке знаний: {str(e)}"
+        )
+
+
 @router.post("/vectorize-lesson/{lesson_id}")
 async def vectorize_lesson(
     lesson_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Векторизация контента урока (только для администраторов)"""
@@ -202,20 +283,21 @@ async def vectorize_lesson(
 async def get_trending_content(
     limit: int = Query(10, ge=1, le=20),
     category: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение популярного контента"""
     try:
         from models.vector_data import KnowledgeBase
 
-        query = db.query(KnowledgeBase).filter(
+        query = select(KnowledgeBase).where(
             KnowledgeBase.is_verified == True)
 
         if category:
-            query = query.filter(KnowledgeBase.category == category)
+            query = query.where(KnowledgeBase.category == category)
 
-        trending = query.order_by(
-            KnowledgeBase.created_at.desc()).limit(limit).all()
+        result = await db.execute(query.order_by(
+            KnowledgeBase.created_at.desc()).limit(limit))
+        trending = result.scalars().all()
 
         return [{
             'id': kb.id,
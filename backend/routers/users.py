@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 
-from database import get_db
+from database import get_async_db
 from models.user import User, UserProfile
 from models.lesson import LessonProgress
 from models.gamification import UserCoins, UserChallenge
@@ -18,12 +19,13 @@ router = APIRouter(prefix="/users", tags=["Users & Profiles"])
 
 @router.get("/me", response_model=UserWithProfile)
 async def get_current_user_profile(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение профиля текущего пользователя"""
-    profile = db.query(UserProfile).filter(
-        UserProfile.user_id == current_user.id).first()
+    result = await db.execute(select(UserProfile).where(
+        UserProfile.user_id == current_user.id))
+    profile = result.scalars().first()
 
     user_data = UserWithProfile(
         id=current_user.id,
@@ -41,13 +43,14 @@ async def get_current_user_profile(
 @router.post("/profile", response_model=UserProfileResponse)
 async def create_user_profile(
     profile_data: UserProfileCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Создание профиля пользователя"""
     # Проверяем, есть ли уже профиль
-    existing_profile = db.query(UserProfile).filter(
-        UserProfile.user_id == current_user.id).first()
+    result = await db.execute(select(UserProfile).where(
+        UserProfile.user_id == current_user.id))
+    existing_profile = result.scalars().first()
     if existing_profile:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -66,8 +69,8 @@ async def create_user_profile(
     )
 
     db.add(profile)
-    db.commit()
-    db.refresh(profile)
+    await db.commit()
+    await db.refresh(profile)
 
     return profile
 
@@ -75,12 +78,13 @@ async def create_user_profile(
 @router.put("/profile", response_model=UserProfileResponse)
 async def update_user_profile(
     profile_data: UserProfileUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Обновление профиля пользователя"""
-    profile = db.query(UserProfile).filter(
-        UserProfile.user_id == current_user.id).first()
+    result = await db.execute(select(UserProfile).where(
+        UserProfile.user_id == current_user.id))
+    profile = result.scalars().first()
 
     if not profile:
         raise HTTPException(
@@ -93,20 +97,21 @@ async def update_user_profile(
     for field, value in update_data.items():
         setattr(profile, field, value)
 
-    db.commit()
-    db.refresh(profile)
+    await db.commit()
+    await db.refresh(profile)
 
     return profile
 
 
 @router.get("/profile", response_model=UserProfileResponse)
 async def get_user_profile(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение профиля пользователя"""
-    profile = db.query(UserProfile).filter(
-        UserProfile.user_id == current_user.id).first()
+    result = await db.execute(select(UserProfile).where(
+        UserProfile.user_id == current_user.id))
+    profile = result.scalars().first()
 
     if not profile:
         raise HTTPException(
@@ -119,12 +124,13 @@ async def get_user_profile(
 
 @router.delete("/profile")
 async def delete_user_profile(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Удаление профиля пользователя"""
-    profile = db.query(UserProfile).filter(
-        UserProfile.user_id == current_user.id).first()
+    result = await db.execute(select(UserProfile).where(
+        UserProfile.user_id == current_user.id))
+    profile = result.scalars().first()
 
     if not profile:
         raise HTTPException(
@@ -132,22 +138,23 @@ async def delete_user_profile(
             detail="Профиль не найден"
         )
 
-    db.delete(profile)
-    db.commit()
+    await db.delete(profile)
+    await db.commit()
 
     return {"message": "Профиль успешно удален"}
 
 
 @router.get("/stats", response_model=LessonStats)
 async def get_user_learning_stats(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение статистики обучения пользователя"""
     # Получаем прогресс по урокам
-    progress_records = db.query(LessonProgress).filter(
+    result = await db.execute(select(LessonProgress).where(
         LessonProgress.user_id == current_user.id
-    ).all()
+    ))
+    progress_records = result.scalars().all()
 
     total_lessons = len(progress_records)
     completed_lessons = len(
@@ -177,14 +184,15 @@ async def get_user_learning_stats(
 
 @router.get("/dashboard")
 async def get_user_dashboard(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение данных для дашборда пользователя"""
     # Статистика обучения
-    progress_records = db.query(LessonProgress).filter(
+    result = await db.execute(select(LessonProgress).where(
         LessonProgress.user_id == current_user.id
-    ).all()
+    ))
+    progress_records = result.scalars().all()
 
     completed_lessons = len(
         [p for p in progress_records if p.status == "completed"])
@@ -192,17 +200,20 @@ async def get_user_dashboard(
         [p for p in progress_records if p.status == "in_progress"])
 
     # Статистика геймификации
-    user_coins = db.query(UserCoins).filter(
-        UserCoins.user_id == current_user.id).first()
-    active_challenges = db.query(UserChallenge).filter(
-        UserChallenge.user_id == current_user.id,
-        UserChallenge.is_completed == False
-    ).count()
+    result = await db.execute(select(UserCoins).where(
+        UserCoins.user_id == current_user.id))
+    user_coins = result.scalars().first()
+    active_challenges = await db.scalar(
+        select(func.count()).select_from(UserChallenge).where(
+            UserChallenge.user_id == current_user.id,
+            UserChallenge.is_completed == False
+        ))
 
     # Последние активности
-    recent_progress = db.query(LessonProgress).filter(
+    result = await db.execute(select(LessonProgress).where(
         LessonProgress.user_id == current_user.id
-    ).order_by(LessonProgress.started_at.desc()).limit(5).all()
+    ).order_by(LessonProgress.started_at.desc()).limit(5))
+    recent_progress = result.scalars().all()
 
     return {
         "learning_stats": {
@@ -228,26 +239,29 @@ async def get_user_dashboard(
 
 @router.get("/achievements")
 async def get_user_achievements(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение достижений пользователя"""
     # Получаем статистику для расчета достижений
-    progress_records = db.query(LessonProgress).filter(
+    result = await db.execute(select(LessonProgress).where(
         LessonProgress.user_id == current_user.id
-    ).all()
+    ))
+    progress_records = result.scalars().all()
 
     completed_lessons = len(
         [p for p in progress_records if p.status == "completed"])
     total_time_spent = sum(p.time_spent_minutes for p in progress_records)
 
-    completed_challenges = db.query(UserChallenge).filter(
-        UserChallenge.user_id == current_user.id,
-        UserChallenge.is_completed == True
-    ).count()
+    completed_challenges = await db.scalar(
+        select(func.count()).select_from(UserChallenge).where(
+            UserChallenge.user_id == current_user.id,
+            UserChallenge.is_completed == True
+        ))
 
-    user_coins = db.query(UserCoins).filter(
-        UserCoins.user_id == current_user.id).first()
+    result = await db.execute(select(UserCoins).where(
+        UserCoins.user_id == current_user.id))
+    user_coins = result.scalars().first()
     total_coins = user_coins.total_earned if user_coins else 0
 
     # Определяем достижения
@@ -337,12 +351,13 @@ async def get_user_achievements(
 
 @router.get("/preferences")
 async def get_user_preferences(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Получение настроек пользователя"""
-    profile = db.query(UserProfile).filter(
-        UserProfile.user_id == current_user.id).first()
+    result = await db.execute(select(UserProfile).where(
+        UserProfile.user_id == current_user.id))
+    profile = result.scalars().first()
 
     return {
         "notifications": {
@@ -368,7 +383,7 @@ async def get_user_preferences(
 @router.put("/preferences")
 async def update_user_preferences(
     preferences: dict,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Обновление настроек пользователя"""
@@ -384,7 +399,7 @@ async def update_user_preferences(
 @router.delete("/account")
 async def delete_user_account(
     confirmation: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user_dependency)
 ):
     """Удаление аккаунта пользователя"""
@@ -400,7 +415,9 @@ async def delete_user_account(
     # 3. Отправка уведомления
 
     # Пока просто деактивируем пользователя
+    await db.execute(update(User).where(
+        User.id == current_user.id).values(is_active=False))
+    await db.commit()
     current_user.is_active = False
-    db.commit()
 
     return {"message": "Аккаунт успешно деактивирован"}
@@ -44,8 +44,9 @@ class LessonProgress(BaseModel):
 class UserAnalyticsResponse(BaseModel):
     """Ответ с аналитикой пользователя"""
     user_stats: Optional[UserStats]
-    daily_activity: List[DailyActivity]
-    lessons_progress: List[LessonProgress]
+    daily_activity: List[DailyActivity] = []
+    lessons_progress: List[LessonProgress] = []
+    failed_sections: List[str] = []  # разделы, запросы которых не удались
 
 
 class PlatformOverview(BaseModel):
@@ -84,10 +85,12 @@ class ConversionFunnel(BaseModel):
 
 class PlatformAnalyticsResponse(BaseModel):
     """Ответ с аналитикой платформы"""
-    overview: PlatformOverview
-    daily_metrics: List[DailyMetrics]
-    top_lessons: List[TopLesson]
-    funnel: ConversionFunnel
+    overview: Optional[PlatformOverview] = None
+    daily_metrics: List[DailyMetrics] = []
+    top_lessons: List[TopLesson] = []
+    funnel: Optional[ConversionFunnel] = None
+    failed_sections: List[str] = []  # разделы, запросы которых не удались
+    cache_age_seconds: float = 0.0  # возраст результата в кеше
 
 
 class RealTimeOverview(BaseModel):
@@ -105,9 +108,11 @@ class EventTypeCount(BaseModel):
 
 class RealTimeMetricsResponse(BaseModel):
     """Ответ с метриками в реальном времени"""
-    last_hour: RealTimeOverview
-    events_by_type: List[EventTypeCount]
-    active_sessions: int
+    last_hour: Optional[RealTimeOverview] = None
+    events_by_type: List[EventTypeCount] = []
+    active_sessions: Optional[int] = None
+    failed_sections: List[str] = []  # разделы, запросы которых не удались
+    cache_age_seconds: float = 0.0  # возраст результата в кеше
 
 
 class AnalyticsConfig(BaseModel):
@@ -53,6 +53,10 @@ class SearchRequest(BaseModel):
     difficulty_levels: Optional[List[str]] = Field(
         None, description="Фильтр по уровням сложности")
     limit: int = Field(10, ge=1, le=50, description="Количество результатов")
+    hybrid: Optional[bool] = Field(
+        None, description="Учитывать полнотекстовый ранг (reciprocal rank fusion)")
+    search_fields: Optional[List[str]] = Field(
+        None, description="Дополнительные колонки результата")
 
 
 class SearchResult(BaseModel):
@@ -66,6 +70,8 @@ class SearchResult(BaseModel):
     source: Optional[str] = None
     duration_minutes: Optional[int] = None
     tags: Optional[str] = None
+    score: Optional[float] = None
+    fields: Optional[Dict[str, Any]] = None
 
 
 class RecommendationResult(BaseModel):
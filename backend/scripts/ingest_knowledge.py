@@ -0,0 +1,65 @@
+"""
+Офлайн-загрузка базы знаний из JSONL/CSV
+
+Каждая запись должна содержать title, content, content_type, category и
+difficulty_level (tags и source - необязательно). Прогресс сохраняется в
+checkpoint-файл после каждого пакета; повторный запуск с тем же файлом
+продолжает загрузку с места остановки.
+
+Запуск (из директории backend):
+    python -m scripts.ingest_knowledge corpus.jsonl
+    python -m scripts.ingest_knowledge corpus.csv --format csv --batch-size 1000
+"""
+
+import argparse
+import asyncio
+import logging
+
+from database import AsyncSessionLocal, close_db
+from services.knowledge_ingestion import (
+    IngestionCheckpoint, KnowledgeIngestionService, iter_knowledge_records
+)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="файл с документами")
+    parser.add_argument("--format", choices=["jsonl", "csv"],
+                        help="по умолчанию определяется по расширению")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--checkpoint", default=None,
+                        help="по умолчанию <path>.checkpoint")
+    parser.add_argument("--restart", action="store_true",
+                        help="игнорировать сохраненный checkpoint")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+    checkpoint = IngestionCheckpoint(args.checkpoint or f"{args.path}.checkpoint")
+    skip = 0 if args.restart else checkpoint.load()
+    if skip:
+        print(f"Resuming from record {skip}")
+
+    try:
+        async with AsyncSessionLocal() as db:
+            service = KnowledgeIngestionService(db)
+            with open(args.path, "r", encoding="utf-8", newline="") as stream:
+                stats = await service.ingest(
+                    iter_knowledge_records(stream, fmt),
+                    batch_size=args.batch_size,
+                    skip=skip,
+                    on_batch=checkpoint.save
+                )
+        checkpoint.save(stats["offset"], stats)
+    finally:
+        await close_db()
+
+    print(f"processed={stats['processed']} inserted={stats['inserted']} "
+          f"duplicates={stats['duplicates']} invalid={stats['invalid']} "
+          f"elapsed={stats['elapsed_seconds']}s rate={stats['docs_per_second']} docs/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""
+Миграции схемы аналитики в ClickHouse
+
+Без флагов применяет автоматические миграции и показывает состояние:
+примененные версии и партиции events, ожидающие backfill.
+
+После обновления всех экземпляров приложения:
+    python -m scripts.migrate_analytics --typed-columns  # миграция v2
+    # перезапустить все экземпляры приложения
+    python -m scripts.migrate_analytics --backfill       # по одной партиции
+    python -m scripts.migrate_analytics --finalize       # ручные миграции
+
+--typed-columns добавляет типизированные колонки events; до нее все
+экземпляры должны вставлять события с явным списком колонок (см.
+analytics_schema). --backfill материализует эти колонки в старых
+партициях events и пересчитывает агрегаты events_hourly/events_daily
+за закрытые месяцы (текущий - повторным запуском после его окончания);
+--finalize удаляет JSON-колонки событий и старые представления
+daily_stats/hourly_stats.
+
+Запуск (из директории backend).
+"""
+
+import argparse
+import logging
+import sys
+
+from analytics import analytics
+from analytics_schema import (
+    MIGRATIONS, apply_migrations, applied_versions, backfill_events,
+    backfill_rollups, pending_backfill_partitions
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--typed-columns", action="store_true",
+                        help="применить миграцию v2 (типизированные колонки событий)")
+    parser.add_argument("--backfill", action="store_true",
+                        help="дозаполнить колонки событий и агрегаты по партициям")
+    parser.add_argument("--finalize", action="store_true",
+                        help="применить ручные миграции (удаление старых колонок и представлений)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    client = analytics._create_client()
+
+    try:
+        apply_migrations(client)
+
+        if args.typed_columns:
+            apply_migrations(client, include_manual=True, target=2)
+
+        typed_columns = 2 in applied_versions(client)
+        if args.backfill:
+            if typed_columns:
+                total = backfill_events(
+                    client,
+                    on_partition=lambda partition_id, number, count: print(
+                        f"[{number}/{count}] partition {partition_id} backfilled")
+                )
+                print(f"Backfilled partitions: {total}")
+            else:
+                print("Typed event columns are not added yet (--typed-columns), "
+                      "skipping events backfill")
+            total = backfill_rollups(
+                client,
+                on_partition=lambda rollup, partition_id: print(
+                    f"{rollup}: partition {partition_id} backfilled")
+            )
+            print(f"Backfilled rollup partitions: {total}")
+
+        if args.finalize:
+            if not typed_columns:
+                print("Typed event columns are not added yet, run --typed-columns first")
+                sys.exit(1)
+            pending = pending_backfill_partitions(client)
+            if pending:
+                print(f"Backfill is not finished, pending partitions: {', '.join(pending)}")
+                sys.exit(1)
+            apply_migrations(client, include_manual=True)
+
+        applied = applied_versions(client)
+        for migration in MIGRATIONS:
+            state = "applied" if migration.version in applied else (
+                "manual" if migration.manual else "pending")
+            print(f"{migration.version:>3} {state:<8} {migration.description}")
+        if typed_columns:
+            pending = pending_backfill_partitions(client)
+            print(f"Partitions pending backfill: {', '.join(pending) if pending else 'none'}")
+    finally:
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
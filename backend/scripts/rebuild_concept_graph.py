@@ -0,0 +1,28 @@
+"""
+Полная перестройка графа связанных концепций (concept_neighbors)
+
+Нужна один раз для концепций, созданных до появления графа; новые
+концепции добавляются в граф инкрементально в generate_financial_concepts.
+
+Запуск (из директории backend):
+    python -m scripts.rebuild_concept_graph
+"""
+
+import asyncio
+import logging
+
+from database import AsyncSessionLocal, close_db
+from services.vector_service import VectorService
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        async with AsyncSessionLocal() as db:
+            await VectorService(db).refresh_concept_neighbors()
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,32 +1,32 @@
-import openai
 import json
 import time
 import tiktoken
 from typing import Dict, List, Optional, Any
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models.ai import PersonalPlan, LessonContent, QuizValidation, AIInteraction
 from models.user import User, UserProfile
 from models.lesson import Lesson, Quiz
 from models.vector_data import KnowledgeBase, FinancialConcept
 from config import settings
+from services.openai_client import openai_client
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class AIService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
-        self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+        self.client = openai_client
         self.model = settings.OPENAI_MODEL
         self.encoding = tiktoken.encoding_for_model("gpt-4")
 
     async def generate_personal_plan(self, user_id: int, goals: List[str],
                                      experience_level: str, preferences: Optional[Dict] = None) -> PersonalPlan:
         """Генерация персонального плана обучения с учетом базы знаний"""
-        user = self.db.query(User).filter(User.id == user_id).first()
-        profile = self.db.query(UserProfile).filter(
-            UserProfile.user_id == user_id).first()
+        user = await self.db.get(User, user_id)
+        profile = await self._get_user_profile(user_id)
 
         # Получаем релевантные знания из базы
         relevant_knowledge = await self._get_relevant_knowledge_for_plan(goals, experience_level)
@@ -38,7 +38,7 @@ class AIService:
         start_time = time.time()
 
         try:
-            response = await self.client.chat.completions.create(
+            response = await self.client.chat_completion(
                 model=self.model,
                 messages=[
                     {"role": "system",
@@ -70,8 +70,8 @@ class AIService:
             )
 
             self.db.add(personal_plan)
-            self.db.commit()
-            self.db.refresh(personal_plan)
+            await self.db.commit()
+            await self.db.refresh(personal_plan)
 
             # Логируем взаимодействие с AI
             await self._log_ai_interaction(
@@ -99,10 +99,9 @@ class AIService:
     async def generate_adaptive_lesson_content(self, lesson_id: int, user_id: int,
                                                content_type: str = "explanation") -> LessonContent:
         """Генерация адаптивного контента урока под конкретного пользователя"""
-        lesson = self.db.query(Lesson).filter(Lesson.id == lesson_id).first()
-        user = self.db.query(User).filter(User.id == user_id).first()
-        profile = self.db.query(UserProfile).filter(
-            UserProfile.user_id == user_id).first()
+        lesson = await self.db.get(Lesson, lesson_id)
+        user = await self.db.get(User, user_id)
+        profile = await self._get_user_profile(user_id)
 
         # Получаем контекст из базы знаний
         context_knowledge = await self._get_lesson_context(lesson)
@@ -117,7 +116,7 @@ class AIService:
         start_time = time.time()
 
         try:
-            response = await self.client.chat.completions.create(
+            response = await self.client.chat_completion(
                 model=self.model,
                 messages=[
                     {"role": "system",
@@ -149,8 +148,8 @@ class AIService:
             )
 
             self.db.add(lesson_content)
-            self.db.commit()
-            self.db.refresh(lesson_content)
+            await self.db.commit()
+            await self.db.refresh(lesson_content)
 
             # Логируем взаимодействие с AI
             await self._log_ai_interaction(
@@ -180,9 +179,8 @@ class AIService:
     async def intelligent_quiz_validation(self, quiz_id: int, user_answer: str,
                                           user_id: int) -> QuizValidation:
         """Интеллектуальная валидация ответа с детальной обратной связью"""
-        quiz = self.db.query(Quiz).filter(Quiz.id == quiz_id).first()
-        lesson = self.db.query(Lesson).filter(
-            Lesson.id == quiz.lesson_id).first()
+        quiz = await self.db.get(Quiz, quiz_id)
+        lesson = await self.db.get(Lesson, quiz.lesson_id)
 
         # Получаем контекст из базы знаний
         context = await self._get_quiz_context(quiz, lesson)
@@ -193,7 +191,7 @@ class AIService:
         start_time = time.time()
 
         try:
-            response = await self.client.chat.completions.create(
+            response = await self.client.chat_completion(
                 model=self.model,
                 messages=[
                     {"role": "system", "content": self._get_quiz_validator_system_prompt()},
@@ -225,8 +223,8 @@ class AIService:
             )
 
             self.db.add(quiz_validation)
-            self.db.commit()
-            self.db.refresh(quiz_validation)
+            await self.db.commit()
+            await self.db.refresh(quiz_validation)
 
             # Логируем взаимодействие с AI
             await self._log_ai_interaction(
@@ -267,7 +265,7 @@ class AIService:
         """
 
         try:
-            response = await self.client.chat.completions.create(
+            response = await self.client.chat_completion(
                 model=self.model,
                 messages=[
                     {"role": "system",
@@ -284,15 +282,18 @@ class AIService:
             function_call = response.choices[0].message.function_call
             concepts_data = json.loads(function_call.arguments)
 
-            concepts = []
-            for concept_data in concepts_data.get("concepts", []):
-                # Создаем embedding для концепции
-                from services.vector_service import VectorService
-                vector_service = VectorService(self.db)
+            from services.vector_service import VectorService
+            vector_service = VectorService(self.db)
 
-                concept_text = f"{concept_data['term']} {concept_data['definition']} {concept_data['simple_explanation']}"
-                embedding = await vector_service.create_embedding(concept_text)
+            # Создаем embeddings для всех концепций одним пакетом
+            concepts_list = concepts_data.get("concepts", [])
+            embeddings = await vector_service.create_embeddings([
+                f"{concept_data['term']} {concept_data['definition']} {concept_data['simple_explanation']}"
+                for concept_data in concepts_list
+            ])
 
+            concepts = []
+            for concept_data, embedding in zip(concepts_list, embeddings):
                 concept = FinancialConcept(
                     term=concept_data["term"],
                     definition=concept_data["definition"],
@@ -308,7 +309,10 @@ class AIService:
                 self.db.add(concept)
                 concepts.append(concept)
 
-            self.db.commit()
+            await self.db.commit()
+
+            # Обновляем граф связанных концепций для новых терминов
+            await vector_service.refresh_concept_neighbors([concept.id for concept in concepts])
 
             # Логируем взаимодействие с AI
             await self._log_ai_interaction(
@@ -463,29 +467,36 @@ class AIService:
         }
 
     # Вспомогательные методы
+    async def _get_user_profile(self, user_id: int) -> Optional[UserProfile]:
+        """Получение профиля пользователя"""
+        result = await self.db.execute(select(UserProfile).where(
+            UserProfile.user_id == user_id))
+        return result.scalars().first()
+
     async def _get_relevant_knowledge_for_plan(self, goals: List[str], experience_level: str) -> List[KnowledgeBase]:
         """Получение релевантных знаний для создания плана"""
-        knowledge = self.db.query(KnowledgeBase).filter(
+        result = await self.db.execute(select(KnowledgeBase).where(
             KnowledgeBase.difficulty_level == experience_level,
             KnowledgeBase.is_verified == True
-        ).limit(10).all()
-        return knowledge
+        ).limit(10))
+        return result.scalars().all()
 
     async def _get_lesson_context(self, lesson: Lesson) -> List[KnowledgeBase]:
         """Получение контекста для урока из базы знаний"""
-        context = self.db.query(KnowledgeBase).filter(
+        result = await self.db.execute(select(KnowledgeBase).where(
             KnowledgeBase.category == lesson.category,
             KnowledgeBase.is_verified == True
-        ).limit(5).all()
-        return context
+        ).limit(5))
+        return result.scalars().all()
 
     async def _analyze_user_progress(self, user_id: int) -> Dict:
         """Анализ прогресса пользователя"""
         from models.lesson import LessonProgress
 
-        progress = self.db.query(LessonProgress).filter(
+        result = await self.db.execute(select(LessonProgress).where(
             LessonProgress.user_id == user_id
-        ).all()
+        ))
+        progress = result.scalars().all()
 
         return {
             "completed_lessons": len([p for p in progress if p.status == "completed"]),
@@ -496,9 +507,10 @@ class AIService:
 
     async def _get_quiz_context(self, quiz: Quiz, lesson: Lesson) -> str:
         """Получение контекста для валидации теста"""
-        context_knowledge = self.db.query(KnowledgeBase).filter(
+        result = await self.db.execute(select(KnowledgeBase).where(
             KnowledgeBase.category == lesson.category
-        ).limit(3).all()
+        ).limit(3))
+        context_knowledge = result.scalars().all()
 
         context = f"Урок: {lesson.title}\nКатегория: {lesson.category}\n"
         if context_knowledge:
@@ -628,8 +640,8 @@ class AIService:
             processing_time_ms=processing_time_ms,
             status=status,
             error_message=error_message,
-            metadata=metadata
+            metadata_=metadata
         )
 
         self.db.add(ai_interaction)
-        self.db.commit()
+        await self.db.commit()
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import redis
+
+from config import settings
+from database import redis_binary_client
+from metrics import (
+    tutor_answer_cache_requests_total, tutor_answer_cache_latency_saved_seconds_total
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticAnswerCache:
+    """Семантический кеш ответов AI-тьютора в Redis
+
+    Ответы группируются по модели и набору документов контекста: один
+    Redis hash на группу, в нем вектор вопроса и ответ для каждой записи.
+    При поиске выбирается запись с максимальным косинусным сходством
+    вопроса, если оно не ниже порога. Инвалидация модели - увеличение ее
+    поколения в ключе, старые группы удаляются по TTL. Клиент Redis
+    синхронный: публичные методы выполняют запросы и сравнение векторов
+    в потоке, не блокируя event loop.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None,
+                 similarity_threshold: float = 0.95,
+                 ttl_seconds: int = 24 * 3600,
+                 max_entries: int = 50):
+        self.redis = redis_client
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    @staticmethod
+    def context_key(results: List[Dict[str, Any]], extra_context: Optional[str] = None) -> str:
+        """Хеш документов контекста (тип и id) и дополнительного контекста"""
+        ids = sorted(f"{r['content_type']}:{r['content_id']}" for r in results)
+        payload = "|".join(ids) + "\n" + (extra_context or "")
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _generation(self, model: str) -> int:
+        raw = self.redis.get(f"tutor_cache:gen:{model}")
+        return int(raw) if raw else 0
+
+    def _bucket_key(self, model: str, context_key: str) -> str:
+        return f"tutor_cache:{model}:{self._generation(model)}:{context_key}"
+
+    async def get(self, model: str, context_key: str,
+                  question_embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """Ответ на близкий вопрос с тем же контекстом; None при промахе"""
+        if self.redis is None:
+            return None
+        return await asyncio.to_thread(self._get, model, context_key, question_embedding)
+
+    def _get(self, model: str, context_key: str,
+             question_embedding: List[float]) -> Optional[Dict[str, Any]]:
+        try:
+            entries = self.redis.hgetall(self._bucket_key(model, context_key))
+        except redis.RedisError as e:
+            logger.warning(f"Tutor answer cache Redis read failed: {e}")
+            entries = {}
+
+        best, best_similarity = None, self.similarity_threshold
+        now = time.time()
+        query = np.asarray(question_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+
+        for field, raw in entries.items():
+            if not field.endswith(b":v"):
+                continue
+            payload = entries.get(field[:-2] + b":a")
+            if payload is None or query_norm == 0:
+                continue
+            vector = np.frombuffer(raw, dtype=np.float32)
+            similarity = float(np.dot(query, vector) /
+                               (query_norm * np.linalg.norm(vector)))
+            if similarity < best_similarity:
+                continue
+            entry = json.loads(payload)
+            if now - entry["created_at"] > self.ttl_seconds:
+                continue
+            best, best_similarity = entry, similarity
+
+        if best is None:
+            tutor_answer_cache_requests_total.labels(result="miss").inc()
+            return None
+
+        tutor_answer_cache_requests_total.labels(result="hit").inc()
+        tutor_answer_cache_latency_saved_seconds_total.inc(best["generation_seconds"])
+        best["similarity"] = best_similarity
+        return best
+
+    async def set(self, model: str, context_key: str, question: str,
+                  question_embedding: List[float], answer: str, generation_seconds: float):
+        """Сохранение ответа; в группе остаются max_entries последних записей"""
+        if self.redis is None:
+            return
+        await asyncio.to_thread(self._set, model, context_key, question,
+                                question_embedding, answer, generation_seconds)
+
+    def _set(self, model: str, context_key: str, question: str,
+             question_embedding: List[float], answer: str, generation_seconds: float):
+        entry_id = uuid.uuid4().hex
+        entry = {
+            "question": question,
+            "answer": answer,
+            "created_at": time.time(),
+            "generation_seconds": generation_seconds,
+        }
+
+        try:
+            key = self._bucket_key(model, context_key)
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(key, mapping={
+                f"{entry_id}:v": np.asarray(question_embedding, dtype=np.float32).tobytes(),
+                f"{entry_id}:a": json.dumps(entry, ensure_ascii=False),
+            })
+            pipe.expire(key, self.ttl_seconds)
+            pipe.hlen(key)
+            _, _, length = pipe.execute()
+
+            if length > self.max_entries * 2:
+                self._trim(key)
+        except redis.RedisError as e:
+            logger.warning(f"Tutor answer cache Redis write failed: {e}")
+
+    def _trim(self, key: str):
+        """Удаление самых старых записей группы сверх max_entries"""
+        answers = {field[:-2]: json.loads(raw)
+                   for field, raw in self.redis.hgetall(key).items()
+                   if field.endswith(b":a")}
+        stale = sorted(answers, key=lambda entry_id: answers[entry_id]["created_at"])
+        stale = stale[:max(0, len(stale) - self.max_entries)]
+        if stale:
+            self.redis.hdel(key, *[entry_id + suffix for entry_id in stale
+                                   for suffix in (b":v", b":a")])
+
+    async def invalidate_model(self, model: str) -> Optional[int]:
+        """Сброс всех ответов модели; возвращает новое поколение, None - Redis недоступен"""
+        if self.redis is None:
+            return 0
+        try:
+            return int(await asyncio.to_thread(self.redis.incr, f"tutor_cache:gen:{model}"))
+        except redis.RedisError as e:
+            logger.error(f"Tutor answer cache Redis invalidation failed: {e}")
+            return None
+
+
+# Глобальный экземпляр кеша ответов тьютора
+tutor_answer_cache = SemanticAnswerCache(
+    redis_client=redis_binary_client if settings.TUTOR_CACHE_ENABLED else None,
+    similarity_threshold=settings.TUTOR_CACHE_SIMILARITY_THRESHOLD,
+    ttl_seconds=settings.TUTOR_CACHE_TTL_SECONDS,
+    max_entries=settings.TUTOR_CACHE_MAX_ENTRIES
+)
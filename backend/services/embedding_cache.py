@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+import redis
+
+from config import settings
+from database import redis_binary_client
+from metrics import embedding_cache_hits_total, embedding_cache_misses_total
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Двухуровневый кеш embeddings: LRU в процессе + Redis
+
+    Ключ - имя модели и sha256 очищенного текста. Векторы хранятся как
+    float32 bytes (6 КБ на вектор 1536 вместо ~30 КБ JSON). Клиент Redis
+    синхронный, его вызовы выполняются в потоке, не блокируя event loop.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None,
+                 lru_size: int = 5000, ttl_seconds: int = 30 * 24 * 3600):
+        self.redis = redis_client
+        self.lru_size = lru_size
+        self.ttl_seconds = ttl_seconds
+        self._lru: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, cleaned_text: str) -> str:
+        digest = hashlib.sha256(cleaned_text.encode("utf-8")).hexdigest()
+        return f"emb:{model}:{digest}"
+
+    @staticmethod
+    def _encode(vector: List[float]) -> bytes:
+        return np.asarray(vector, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def _decode(raw: bytes) -> List[float]:
+        return np.frombuffer(raw, dtype=np.float32).tolist()
+
+    def _lru_get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            raw = self._lru.get(key)
+            if raw is not None:
+                self._lru.move_to_end(key)
+            return raw
+
+    def _lru_set(self, key: str, raw: bytes):
+        with self._lock:
+            self._lru[key] = raw
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    async def get_many(self, model: str, cleaned_texts: List[str]) -> List[Optional[List[float]]]:
+        """Поиск векторов для списка текстов; None для промахов"""
+        keys = [self.make_key(model, t) for t in cleaned_texts]
+        results: List[Optional[List[float]]] = [None] * len(keys)
+        redis_missing: Dict[int, str] = {}
+
+        for i, key in enumerate(keys):
+            raw = self._lru_get(key)
+            if raw is not None:
+                results[i] = self._decode(raw)
+                embedding_cache_hits_total.labels(tier="memory").inc()
+            else:
+                redis_missing[i] = key
+
+        if redis_missing and self.redis is not None:
+            try:
+                values = await asyncio.to_thread(self.redis.mget, list(redis_missing.values()))
+            except redis.RedisError as e:
+                logger.warning(f"Embedding cache Redis read failed: {e}")
+                values = [None] * len(redis_missing)
+
+            for (i, key), raw in zip(redis_missing.items(), values):
+                if raw is not None:
+                    self._lru_set(key, raw)
+                    results[i] = self._decode(raw)
+                    embedding_cache_hits_total.labels(tier="redis").inc()
+
+        misses = sum(1 for r in results if r is None)
+        if misses:
+            embedding_cache_misses_total.inc(misses)
+
+        return results
+
+    async def get(self, model: str, cleaned_text: str) -> Optional[List[float]]:
+        return (await self.get_many(model, [cleaned_text]))[0]
+
+    async def set_many(self, model: str, cleaned_texts: List[str], vectors: List[List[float]]):
+        """Сохранение векторов в оба уровня кеша"""
+        entries = {self.make_key(model, t): self._encode(v)
+                   for t, v in zip(cleaned_texts, vectors)}
+
+        for key, raw in entries.items():
+            self._lru_set(key, raw)
+
+        if self.redis is not None and entries:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for key, raw in entries.items():
+                    pipe.set(key, raw, ex=self.ttl_seconds)
+                await asyncio.to_thread(pipe.execute)
+            except redis.RedisError as e:
+                logger.warning(f"Embedding cache Redis write failed: {e}")
+
+    async def set(self, model: str, cleaned_text: str, vector: List[float]):
+        await self.set_many(model, [cleaned_text], [vector])
+
+    def clear_memory(self):
+        with self._lock:
+            self._lru.clear()
+
+
+# Глобальный экземпляр кеша, общий для всех VectorService
+embedding_cache = EmbeddingCache(
+    redis_client=redis_binary_client,
+    lru_size=settings.EMBEDDING_CACHE_LRU_SIZE,
+    ttl_seconds=settings.EMBEDDING_CACHE_TTL_SECONDS
+)
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiokafka import AIOKafkaConsumer, AIOKafkaProducer, ConsumerRecord, TopicPartition
+from aiokafka.errors import KafkaError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal
+from metrics import (
+    kafka_consumer_messages_total, kafka_consumer_lag,
+    kafka_consumer_batch_duration_seconds
+)
+from services.kafka_service import KafkaService
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[..., Awaitable[None]]
+
+
+class KafkaConsumerWorker:
+    """Воркер обработки событий Kafka
+
+    Один AIOKafkaConsumer на процесс в consumer group: масштабирование -
+    запуск нескольких воркеров с одним group_id, партиции распределяет
+    брокер. Сообщения забираются пакетами (getmany); партиции пакета
+    обрабатываются параллельно, сообщения внутри партиции - по порядку.
+    На пакет партиции открывается одна сессия БД; offset фиксируется
+    вручную только после коммита сессии. Необрабатываемые сообщения
+    уходят в dead-letter топик и не останавливают партицию.
+    """
+
+    def __init__(self, topics: Optional[List[str]] = None,
+                 group_id: Optional[str] = None,
+                 service: Optional[KafkaService] = None):
+        self.service = service or KafkaService()
+        self.handlers: Dict[str, EventHandler] = {
+            settings.KAFKA_TOPIC_USER_EVENTS: self.service._process_user_event,
+            settings.KAFKA_TOPIC_LESSON_EVENTS: self.service._process_lesson_event,
+            settings.KAFKA_TOPIC_GAMIFICATION: self.service._process_gamification_event,
+        }
+        self.topics = topics or list(self.handlers.keys())
+        unknown = set(self.topics) - self.handlers.keys()
+        if unknown:
+            raise ValueError(f"No handlers for topics: {', '.join(sorted(unknown))}")
+
+        self.group_id = group_id or settings.KAFKA_CONSUMER_GROUP
+        self.consumer: Optional[AIOKafkaConsumer] = None
+        self.producer: Optional[AIOKafkaProducer] = None
+        self._semaphore = asyncio.Semaphore(settings.KAFKA_CONSUMER_MAX_CONCURRENCY)
+        self._stopping = asyncio.Event()
+
+    async def start(self):
+        self.consumer = AIOKafkaConsumer(
+            *self.topics,
+            bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+            group_id=self.group_id,
+            value_deserializer=lambda m: json.loads(m.decode('utf-8')),
+            key_deserializer=lambda k: k.decode('utf-8') if k else None,
+            auto_offset_reset=settings.KAFKA_CONSUMER_OFFSET_RESET,
+            enable_auto_commit=False,
+            max_poll_records=settings.KAFKA_CONSUMER_BATCH_SIZE
+        )
+        self.producer = AIOKafkaProducer(
+            bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+            value_serializer=lambda v: json.dumps(v, default=str).encode('utf-8'),
+            key_serializer=lambda k: k.encode('utf-8') if k else None,
+            acks='all',
+            enable_idempotence=True
+        )
+        await self.producer.start()
+        await self.consumer.start()
+        logger.info(f"Kafka consumer group {self.group_id} subscribed to {self.topics}")
+
+    def stop(self):
+        """Остановка после обработки текущего пакета"""
+        self._stopping.set()
+
+    async def run(self):
+        """Цикл чтения пакетов до вызова stop()"""
+        await self.start()
+        try:
+            while not self._stopping.is_set():
+                batches = await self.consumer.getmany(
+                    timeout_ms=settings.KAFKA_CONSUMER_POLL_TIMEOUT_MS,
+                    max_records=settings.KAFKA_CONSUMER_BATCH_SIZE
+                )
+                if batches:
+                    await self._process_batches(batches)
+                await self._update_lag()
+        finally:
+            await self.consumer.stop()
+            await self.producer.stop()
+            logger.info(f"Kafka consumer group {self.group_id} stopped")
+
+    async def _process_batches(self, batches: Dict[TopicPartition, List[ConsumerRecord]]):
+        results = await asyncio.gather(
+            *(self._process_partition(tp, messages) for tp, messages in batches.items()))
+
+        offsets = {tp: offset for tp, offset in zip(batches.keys(), results)
+                   if offset is not None}
+        if offsets:
+            try:
+                await self.consumer.commit(offsets)
+            except KafkaError as e:
+                # Партиции могли уйти другому воркеру при ребалансировке,
+                # сообщения будут обработаны повторно (at-least-once)
+                logger.warning(f"Failed to commit offsets {offsets}: {e}")
+
+    async def _process_partition(self, tp: TopicPartition,
+                                 messages: List[ConsumerRecord]) -> Optional[int]:
+        """Обработка пакета одной партиции; возвращает offset для коммита
+
+        Каждое сообщение обрабатывается в своем savepoint: ошибка
+        обработчика откатывает только его изменения. Сообщение, которое
+        не удалось обработать KAFKA_CONSUMER_MAX_ATTEMPTS раз, уходит в
+        KAFKA_TOPIC_DEAD_LETTER. Если не удался коммит пакета, сообщения
+        обрабатываются заново по одному в своей транзакции, уже
+        отправленные в dead-letter пропускаются. None -
+        dead-letter топик недоступен, партиция перематывается на начало
+        пакета и будет прочитана снова.
+        """
+        handler = self.handlers[tp.topic]
+        started = time.perf_counter()
+
+        async with self._semaphore:
+            async with AsyncSessionLocal() as db:
+                dead_lettered: Set[int] = set()
+                for message in messages:
+                    error = await self._handle(handler, message, db)
+                    if error is None:
+                        continue
+                    # В dead-letter до коммита БД: offset фиксируется
+                    # только когда сообщение сохранено в Kafka
+                    if not await self._dead_letter(tp, message, error):
+                        await db.rollback()
+                        kafka_consumer_messages_total.labels(
+                            topic=tp.topic, status="retried").inc(len(messages))
+                        self.consumer.seek(tp, messages[0].offset)
+                        return None
+                    dead_lettered.add(message.offset)
+
+                try:
+                    await db.commit()
+                    offset = messages[-1].offset + 1
+                    dead = len(dead_lettered)
+                except Exception as e:
+                    await db.rollback()
+                    logger.error(f"Failed to commit batch for {tp.topic}[{tp.partition}], "
+                                 f"processing messages one by one: {e}")
+                    offset, dead = await self._process_one_by_one(
+                        tp, handler, messages, dead_lettered)
+
+        processed = offset - messages[0].offset - dead
+        kafka_consumer_messages_total.labels(topic=tp.topic, status="processed").inc(processed)
+        kafka_consumer_batch_duration_seconds.labels(topic=tp.topic).observe(
+            time.perf_counter() - started)
+
+        return offset
+
+    async def _handle(self, handler: EventHandler, message: ConsumerRecord,
+                      db: AsyncSession) -> Optional[Exception]:
+        """Обработка сообщения в savepoint; возвращает ошибку последней попытки"""
+        error = None
+        for attempt in range(1, settings.KAFKA_CONSUMER_MAX_ATTEMPTS + 1):
+            try:
+                async with db.begin_nested():
+                    await handler(message.value, db)
+                return None
+            except Exception as e:
+                error = e
+                logger.warning(f"Error handling {message.topic}[{message.partition}]"
+                               f"@{message.offset} (attempt {attempt}): {e}")
+        return error
+
+    async def _process_one_by_one(self, tp: TopicPartition, handler: EventHandler,
+                                  messages: List[ConsumerRecord],
+                                  dead_lettered: Set[int]) -> Tuple[Optional[int], int]:
+        """Обработка пакета по одному сообщению в транзакции
+
+        Сообщение, коммит которого не удался KAFKA_CONSUMER_MAX_ATTEMPTS
+        раз, уходит в dead-letter топик. Сообщения из dead_lettered уже
+        отправлены туда при обработке пакета и пропускаются. Возвращает
+        offset для коммита и число сообщений в dead-letter.
+        """
+        dead = 0
+        for message in messages:
+            if message.offset in dead_lettered:
+                dead += 1
+                continue
+            error = None
+            for attempt in range(1, settings.KAFKA_CONSUMER_MAX_ATTEMPTS + 1):
+                async with AsyncSessionLocal() as db:
+                    try:
+                        await handler(message.value, db)
+                        await db.commit()
+                        error = None
+                        break
+                    except Exception as e:
+                        await db.rollback()
+                        error = e
+                        logger.warning(f"Error committing {tp.topic}[{tp.partition}]"
+                                       f"@{message.offset} (attempt {attempt}): {e}")
+            if error is None:
+                continue
+            if not await self._dead_letter(tp, message, error):
+                # Обработанные сообщения до этого уже в БД
+                kafka_consumer_messages_total.labels(topic=tp.topic, status="retried").inc(
+                    messages[-1].offset + 1 - message.offset)
+                self.consumer.seek(tp, message.offset)
+                return message.offset, dead
+            dead += 1
+        return messages[-1].offset + 1, dead
+
+    async def _dead_letter(self, tp: TopicPartition, message: ConsumerRecord,
+                           error: Exception) -> bool:
+        """Отправка сообщения в dead-letter топик с ожиданием подтверждения"""
+        try:
+            await self.producer.send_and_wait(
+                settings.KAFKA_TOPIC_DEAD_LETTER,
+                key=message.key,
+                value={
+                    "topic": tp.topic,
+                    "partition": tp.partition,
+                    "offset": message.offset,
+                    "error": repr(error),
+                    "value": message.value,
+                }
+            )
+        except KafkaError as e:
+            logger.error(f"Failed to send {tp.topic}[{tp.partition}]@{message.offset} "
+                         f"to dead-letter topic: {e}")
+            return False
+        logger.error(f"Message {tp.topic}[{tp.partition}]@{message.offset} sent to "
+                     f"{settings.KAFKA_TOPIC_DEAD_LETTER}: {error}")
+        kafka_consumer_messages_total.labels(topic=tp.topic, status="dead_lettered").inc()
+        return True
+
+    async def _update_lag(self):
+        """Отставание по назначенным партициям: highwater - текущая позиция"""
+        for tp in self.consumer.assignment():
+            highwater = self.consumer.highwater(tp)
+            if highwater is None:
+                continue
+            position = await self.consumer.position(tp)
+            kafka_consumer_lag.labels(topic=tp.topic, partition=str(tp.partition)).set(
+                max(0, highwater - position))
@@ -1,50 +1,64 @@
 import json
 import logging
+import time
 from typing import Dict, Any, Optional
-from kafka import KafkaProducer, KafkaConsumer
-from kafka.errors import KafkaError
+from aiokafka import AIOKafkaProducer
+from aiokafka.errors import KafkaError
+from sqlalchemy.ext.asyncio import AsyncSession
 from config import settings
+from metrics import (
+    kafka_producer_queue_depth, kafka_delivery_latency_seconds,
+    kafka_events_dropped_total, kafka_delivery_errors_total
+)
 import asyncio
 from datetime import datetime
 
 
 class KafkaService:
+    """Публикация и потребление событий Kafka
+
+    Producer один на процесс: start()/close() вызываются из lifespan в
+    main.py, роутеры получают сервис через get_kafka_service. Публикация
+    только кладет событие в ограниченную очередь; фоновая задача передает
+    события в AIOKafkaProducer, который собирает их в пакеты (linger_ms,
+    max_batch_size) и сжимает. При заполненной очереди событие либо
+    отбрасывается (KAFKA_PRODUCER_QUEUE_POLICY="drop"), либо публикация
+    ждет свободного места ("block").
+
+    Обработка событий (_process_*_event) вызывается воркером
+    services/kafka_consumer.py, запускаемым отдельно (kafka_worker.py).
+    """
+
     def __init__(self):
         self.bootstrap_servers = settings.KAFKA_BOOTSTRAP_SERVERS
-        self.producer = None
-        self.consumers = {}
+        self.producer: Optional[AIOKafkaProducer] = None
         self.logger = logging.getLogger(__name__)
-
-    def get_producer(self) -> KafkaProducer:
-        """Получение Kafka producer"""
-        if not self.producer:
-            self.producer = KafkaProducer(
-                bootstrap_servers=self.bootstrap_servers,
-                value_serializer=lambda v: json.dumps(
-                    v, default=str).encode('utf-8'),
-                key_serializer=lambda k: k.encode('utf-8') if k else None,
-                acks='all',
-                retries=3,
-                retry_backoff_ms=1000
-            )
-        return self.producer
-
-    def get_consumer(self, topic: str, group_id: str) -> KafkaConsumer:
-        """Получение Kafka consumer"""
-        consumer_key = f"{topic}_{group_id}"
-
-        if consumer_key not in self.consumers:
-            self.consumers[consumer_key] = KafkaConsumer(
-                topic,
-                bootstrap_servers=self.bootstrap_servers,
-                group_id=group_id,
-                value_deserializer=lambda m: json.loads(m.decode('utf-8')),
-                key_deserializer=lambda k: k.decode('utf-8') if k else None,
-                auto_offset_reset='latest',
-                enable_auto_commit=True
-            )
-
-        return self.consumers[consumer_key]
+        self.queue_policy = settings.KAFKA_PRODUCER_QUEUE_POLICY
+        self._queue: Optional[asyncio.Queue] = None
+        self._sender_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Подключение producer и запуск фоновой отправки"""
+        if self.producer is not None:
+            return
+
+        self.producer = AIOKafkaProducer(
+            bootstrap_servers=self.bootstrap_servers,
+            value_serializer=lambda v: json.dumps(
+                v, default=str).encode('utf-8'),
+            key_serializer=lambda k: k.encode('utf-8') if k else None,
+            acks='all',
+            enable_idempotence=True,
+            linger_ms=settings.KAFKA_PRODUCER_LINGER_MS,
+            max_batch_size=settings.KAFKA_PRODUCER_BATCH_SIZE,
+            compression_type=settings.KAFKA_PRODUCER_COMPRESSION,
+            retry_backoff_ms=1000
+        )
+        await self.producer.start()
+
+        self._queue = asyncio.Queue(maxsize=settings.KAFKA_PRODUCER_QUEUE_SIZE)
+        self._sender_task = asyncio.create_task(self._send_loop())
+        self.logger.info(f"Kafka producer connected to {self.bootstrap_servers}")
 
     async def publish_user_event(self, user_id: int, event_type: str, data: Dict[str, Any]):
         """Публикация события пользователя"""
@@ -84,66 +98,56 @@ class KafkaService:
         await self._publish_event(settings.KAFKA_TOPIC_GAMIFICATION, str(user_id), event)
 
     async def _publish_event(self, topic: str, key: str, event: Dict[str, Any]):
-        """Базовый метод для публикации события"""
-        try:
-            producer = self.get_producer()
-            future = producer.send(topic, key=key, value=event)
-
-            # Ждем подтверждения отправки
-            record_metadata = future.get(timeout=10)
-
-            self.logger.info(
-                f"Event published to topic {topic}, partition {record_metadata.partition}, "
-                f"offset {record_metadata.offset}"
-            )
-
-        except KafkaError as e:
-            self.logger.error(f"Failed to publish event to topic {topic}: {e}")
-            raise
-        except Exception as e:
-            self.logger.error(f"Unexpected error publishing event: {e}")
-            raise
-
-    async def consume_user_events(self, group_id: str = "user_events_processor"):
-        """Потребление событий пользователей"""
-        consumer = self.get_consumer(
-            settings.KAFKA_TOPIC_USER_EVENTS, group_id)
-
-        try:
-            for message in consumer:
-                await self._process_user_event(message.value)
-        except Exception as e:
-            self.logger.error(f"Error consuming user events: {e}")
-        finally:
-            consumer.close()
-
-    async def consume_lesson_events(self, group_id: str = "lesson_events_processor"):
-        """Потребление событий уроков"""
-        consumer = self.get_consumer(
-            settings.KAFKA_TOPIC_LESSON_EVENTS, group_id)
-
-        try:
-            for message in consumer:
-                await self._process_lesson_event(message.value)
-        except Exception as e:
-            self.logger.error(f"Error consuming lesson events: {e}")
-        finally:
-            consumer.close()
-
-    async def consume_gamification_events(self, group_id: str = "gamification_processor"):
-        """Потребление событий геймификации"""
-        consumer = self.get_consumer(
-            settings.KAFKA_TOPIC_GAMIFICATION, group_id)
-
-        try:
-            for message in consumer:
-                await self._process_gamification_event(message.value)
-        except Exception as e:
-            self.logger.error(f"Error consuming gamification events: {e}")
-        finally:
-            consumer.close()
-
-    async def _process_user_event(self, event: Dict[str, Any]):
+        """Постановка события в очередь отправки (без ожидания брокера)"""
+        if self._queue is None:
+            self.logger.warning(f"Kafka producer is not started, event for {topic} dropped")
+            kafka_events_dropped_total.labels(topic=topic, reason="not_started").inc()
+            return
+
+        item = (topic, key, event, time.perf_counter())
+        if self.queue_policy == "block":
+            await self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                kafka_events_dropped_total.labels(topic=topic, reason="queue_full").inc()
+                self.logger.warning(f"Kafka producer queue is full, event for {topic} dropped")
+                return
+        kafka_producer_queue_depth.set(self._queue.qsize())
+
+    async def _send_loop(self):
+        """Передача событий из очереди в producer"""
+        while True:
+            topic, key, event, enqueued_at = await self._queue.get()
+            kafka_producer_queue_depth.set(self._queue.qsize())
+            try:
+                # send() ждет только места в буфере producer, не подтверждения
+                delivery = await self.producer.send(topic, key=key, value=event)
+                delivery.add_done_callback(
+                    lambda future, topic=topic, enqueued_at=enqueued_at:
+                        self._on_delivery(future, topic, enqueued_at))
+            except KafkaError as e:
+                kafka_delivery_errors_total.labels(topic=topic).inc()
+                self.logger.error(f"Failed to publish event to topic {topic}: {e}")
+            except Exception as e:
+                kafka_delivery_errors_total.labels(topic=topic).inc()
+                self.logger.error(f"Unexpected error publishing event: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _on_delivery(self, future: asyncio.Future, topic: str, enqueued_at: float):
+        """Учет подтверждения брокера"""
+        if future.cancelled() or future.exception() is not None:
+            kafka_delivery_errors_total.labels(topic=topic).inc()
+            self.logger.error(
+                f"Failed to deliver event to topic {topic}: "
+                f"{'cancelled' if future.cancelled() else future.exception()}")
+            return
+        kafka_delivery_latency_seconds.labels(topic=topic).observe(
+            time.perf_counter() - enqueued_at)
+
+    async def _process_user_event(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка события пользователя"""
         event_type = event.get("event_type")
         user_id = event.get("user_id")
@@ -153,13 +157,13 @@ class KafkaService:
 
         # Здесь была бы логика обработки различных типов событий
         if event_type == "user_registered":
-            await self._handle_user_registration(event)
+            await self._handle_user_registration(event, db)
         elif event_type == "user_login":
-            await self._handle_user_login(event)
+            await self._handle_user_login(event, db)
         elif event_type == "profile_updated":
-            await self._handle_profile_update(event)
+            await self._handle_profile_update(event, db)
 
-    async def _process_lesson_event(self, event: Dict[str, Any]):
+    async def _process_lesson_event(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка события урока"""
         event_type = event.get("event_type")
         user_id = event.get("user_id")
@@ -169,13 +173,13 @@ class KafkaService:
             f"Processing lesson event: {event_type} for user {user_id}, lesson {lesson_id}")
 
         if event_type == "lesson_started":
-            await self._handle_lesson_started(event)
+            await self._handle_lesson_started(event, db)
         elif event_type == "lesson_completed":
-            await self._handle_lesson_completed(event)
+            await self._handle_lesson_completed(event, db)
         elif event_type == "quiz_answered":
-            await self._handle_quiz_answered(event)
+            await self._handle_quiz_answered(event, db)
 
-    async def _process_gamification_event(self, event: Dict[str, Any]):
+    async def _process_gamification_event(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка события геймификации"""
         event_type = event.get("event_type")
         user_id = event.get("user_id")
@@ -184,64 +188,87 @@ class KafkaService:
             f"Processing gamification event: {event_type} for user {user_id}")
 
         if event_type == "coins_earned":
-            await self._handle_coins_earned(event)
+            await self._handle_coins_earned(event, db)
         elif event_type == "challenge_completed":
-            await self._handle_challenge_completed(event)
+            await self._handle_challenge_completed(event, db)
         elif event_type == "achievement_unlocked":
-            await self._handle_achievement_unlocked(event)
+            await self._handle_achievement_unlocked(event, db)
 
     # Обработчики конкретных событий
-    async def _handle_user_registration(self, event: Dict[str, Any]):
+    async def _handle_user_registration(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка регистрации пользователя"""
         # Отправка приветственного email, создание начальных данных и т.д.
         pass
 
-    async def _handle_user_login(self, event: Dict[str, Any]):
+    async def _handle_user_login(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка входа пользователя"""
         # Обновление статистики, проверка ежедневных бонусов и т.д.
         pass
 
-    async def _handle_profile_update(self, event: Dict[str, Any]):
+    async def _handle_profile_update(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка обновления профиля"""
         # Пересчет персонального плана, обновление рекомендаций и т.д.
         pass
 
-    async def _handle_lesson_started(self, event: Dict[str, Any]):
+    async def _handle_lesson_started(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка начала урока"""
         # Логирование прогресса, обновление статистики и т.д.
         pass
 
-    async def _handle_lesson_completed(self, event: Dict[str, Any]):
+    async def _handle_lesson_completed(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка завершения урока"""
         # Начисление коинов, проверка достижений, обновление прогресса и т.д.
         pass
 
-    async def _handle_quiz_answered(self, event: Dict[str, Any]):
+    async def _handle_quiz_answered(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка ответа на тест"""
         # Валидация ответа, начисление очков, обновление статистики и т.д.
         pass
 
-    async def _handle_coins_earned(self, event: Dict[str, Any]):
+    async def _handle_coins_earned(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка начисления коинов"""
         # Обновление баланса, проверка достижений и т.д.
         pass
 
-    async def _handle_challenge_completed(self, event: Dict[str, Any]):
+    async def _handle_challenge_completed(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка завершения челленджа"""
         # Начисление наград, обновление рейтинга и т.д.
         pass
 
-    async def _handle_achievement_unlocked(self, event: Dict[str, Any]):
+    async def _handle_achievement_unlocked(self, event: Dict[str, Any], db: Optional[AsyncSession] = None):
         """Обработка разблокировки достижения"""
         # Отправка уведомлений, обновление профиля и т.д.
         pass
 
-    def close(self):
-        """Закрытие соединений"""
+    async def close(self):
+        """Отправка оставшихся событий и закрытие соединений"""
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(
+                    self._queue.join(), timeout=settings.KAFKA_PRODUCER_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.logger.warning(
+                    f"Kafka producer queue not drained, {self._queue.qsize()} events lost")
+
+        if self._sender_task is not None:
+            self._sender_task.cancel()
+            try:
+                await self._sender_task
+            except asyncio.CancelledError:
+                pass
+            self._sender_task = None
+
         if self.producer:
-            self.producer.close()
+            # stop() дожидается отправки накопленных пакетов
+            await self.producer.stop()
+            self.producer = None
+        self._queue = None
+
+
+# Глобальный экземпляр, жизненным циклом управляет lifespan в main.py
+kafka_service = KafkaService()
 
-        for consumer in self.consumers.values():
-            consumer.close()
 
-        self.consumers.clear()
+def get_kafka_service() -> KafkaService:
+    """Dependency для получения общего Kafka сервиса"""
+    return kafka_service
@@ -0,0 +1,217 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from models.vector_data import KnowledgeBase
+from services.vector_service import VectorService
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_FIELDS = ("title", "content", "content_type", "category", "difficulty_level")
+OPTIONAL_FIELDS = ("tags", "source")
+
+# asyncpg передает в запрос не больше 32767 параметров, а многострочный
+# INSERT занимает до параметра на колонку в каждой строке
+MAX_BATCH_SIZE = 32767 // len(KnowledgeBase.__table__.columns)
+
+
+class IngestionError(Exception):
+    """Загрузка прервана; offset - записи до последнего закоммиченного пакета"""
+
+    def __init__(self, offset: int, stats: Dict[str, Any]):
+        super().__init__(f"Knowledge ingestion failed, resume with skip={offset}")
+        self.offset = offset
+        self.stats = stats
+
+
+def iter_knowledge_records(stream: TextIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    """Потоковое чтение документов из JSONL или CSV (по одной записи)"""
+    if fmt == "jsonl":
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    elif fmt == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+class IngestionCheckpoint:
+    """Файл с количеством уже загруженных записей для продолжения загрузки"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            return int(json.load(f).get("offset", 0))
+
+    def save(self, offset: int, stats: Dict[str, Any]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"offset": offset, "stats": stats}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class KnowledgeIngestionService:
+    """Пакетная загрузка документов в knowledge_base
+
+    Документы читаются потоком (чтение и разбор источника - в отдельном
+    потоке, пакетами), дедуплицируются по content_hash (внутри
+    пакета и по уже загруженным строкам), векторизуются пакетами и
+    записываются одним многострочным INSERT ... ON CONFLICT DO NOTHING
+    на пакет, по транзакции на пакет.
+    """
+
+    def __init__(self, db: AsyncSession, vector_service: Optional[VectorService] = None):
+        self.db = db
+        self.vector_service = vector_service or VectorService(db)
+
+    async def ingest(self, records: Iterable[Dict[str, Any]],
+                     batch_size: Optional[int] = None,
+                     skip: int = 0,
+                     on_batch: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Загрузка документов; skip - сколько записей пропустить (продолжение)
+
+        on_batch(offset, stats) вызывается после коммита каждого пакета,
+        offset - количество обработанных записей от начала источника.
+        При ошибке выбрасывает IngestionError с offset последнего
+        закоммиченного пакета; batch_size ограничен MAX_BATCH_SIZE.
+        """
+        batch_size = min(batch_size or settings.KNOWLEDGE_INGEST_BATCH_SIZE, MAX_BATCH_SIZE)
+        stats = {
+            "processed": 0,
+            "inserted": 0,
+            "duplicates": 0,
+            "invalid": 0,
+            "batches": 0,
+        }
+        offset = 0
+        committed = skip
+        batch: List[Dict[str, Any]] = []
+        started = time.perf_counter()
+
+        iterator = iter(records)
+
+        try:
+            while True:
+                # Чтение файла и разбор записей блокирующие - вне event loop
+                chunk = await asyncio.to_thread(lambda: list(islice(iterator, batch_size)))
+                if not chunk:
+                    break
+
+                for record in chunk:
+                    offset += 1
+                    if offset <= skip:
+                        continue
+
+                    batch.append(record)
+                    if len(batch) >= batch_size:
+                        await self._ingest_batch(batch, stats)
+                        batch = []
+                        committed = offset
+                        self._report(offset, skip, stats, started, on_batch)
+
+            if batch:
+                await self._ingest_batch(batch, stats)
+                committed = offset
+                self._report(offset, skip, stats, started, on_batch)
+        except Exception as e:
+            await self.db.rollback()
+            logger.error(f"Knowledge ingestion failed after offset {committed}: {e}")
+            raise IngestionError(committed, dict(stats)) from e
+
+        stats["offset"] = max(offset, skip)
+        stats["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+        stats["docs_per_second"] = self._rate(stats["processed"], started)
+        logger.info(f"Knowledge ingestion finished: {stats}")
+        return stats
+
+    async def _ingest_batch(self, batch: List[Dict[str, Any]], stats: Dict[str, Any]):
+        stats["processed"] += len(batch)
+        stats["batches"] += 1
+
+        # Валидация и дедупликация внутри пакета
+        rows: Dict[str, Dict[str, Any]] = {}
+        for record in batch:
+            row = self._normalize(record)
+            if row is None:
+                stats["invalid"] += 1
+                continue
+            if row["content_hash"] in rows:
+                stats["duplicates"] += 1
+                continue
+            rows[row["content_hash"]] = row
+
+        if not rows:
+            return
+
+        # Дедупликация по уже загруженным документам
+        result = await self.db.execute(
+            text("SELECT content_hash FROM knowledge_base WHERE content_hash = ANY(:hashes)"),
+            {"hashes": list(rows.keys())}
+        )
+        for (existing_hash,) in result:
+            rows.pop(existing_hash, None)
+            stats["duplicates"] += 1
+
+        if not rows:
+            return
+
+        new_rows = list(rows.values())
+        vectors = await self.vector_service.create_embeddings(
+            [f"{row['title']}\n{row['content']}" for row in new_rows])
+        for row, vector in zip(new_rows, vectors):
+            row["embedding"] = vector
+
+        statement = pg_insert(KnowledgeBase).values(new_rows).on_conflict_do_nothing(
+            index_elements=[KnowledgeBase.content_hash]
+        ).returning(KnowledgeBase.id)
+        inserted = len((await self.db.execute(statement)).all())
+        await self.db.commit()
+
+        stats["inserted"] += inserted
+        stats["duplicates"] += len(new_rows) - inserted
+
+    def _normalize(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Приведение записи к колонкам knowledge_base; None если запись неполная"""
+        if any(not record.get(field) for field in REQUIRED_FIELDS):
+            return None
+
+        row = {field: str(record[field]).strip() for field in REQUIRED_FIELDS}
+        for field in OPTIONAL_FIELDS:
+            value = record.get(field)
+            if isinstance(value, list):
+                value = ", ".join(str(v) for v in value)
+            row[field] = value or None
+
+        row["content_hash"] = VectorService.knowledge_content_hash(
+            row["title"], row["content"])
+        return row
+
+    def _report(self, offset: int, skip: int, stats: Dict[str, Any], started: float,
+                on_batch: Optional[Callable[[int, Dict[str, Any]], None]]):
+        stats["docs_per_second"] = self._rate(stats["processed"], started)
+        logger.info(
+            f"Ingested batch: offset={offset} inserted={stats['inserted']} "
+            f"duplicates={stats['duplicates']} rate={stats['docs_per_second']} docs/s")
+        if on_batch:
+            on_batch(offset, dict(stats))
+
+    @staticmethod
+    def _rate(count: int, started: float) -> float:
+        elapsed = time.perf_counter() - started
+        return round(count / elapsed, 1) if elapsed > 0 else 0.0
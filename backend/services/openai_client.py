@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+import openai
+
+from config import settings
+from metrics import openai_inflight_requests, openai_retries_total
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых запрос имеет смысл повторить
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """Асинхронный token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+class OpenAIClient:
+    """Общий на процесс AsyncOpenAI клиент
+
+    Один пул HTTP соединений на все запросы, для каждой модели - семафор
+    одновременных запросов и token bucket по запросам в минуту. Повторы
+    ошибок 429/5xx/сети выполняются здесь с экспоненциальной задержкой и
+    jitter (встроенные повторы SDK отключены). Жизненным циклом управляет
+    lifespan в main.py; в скриптах клиент создается при первом вызове.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 http_client: Optional[httpx.AsyncClient] = None,
+                 max_concurrency: Optional[int] = None,
+                 requests_per_minute: Optional[int] = None,
+                 max_retries: Optional[int] = None):
+        self.api_key = api_key or settings.OPENAI_API_KEY
+        self.base_url = base_url or settings.OPENAI_BASE_URL
+        self.max_concurrency = max_concurrency or settings.OPENAI_MAX_CONCURRENCY
+        self.requests_per_minute = requests_per_minute or settings.OPENAI_REQUESTS_PER_MINUTE
+        self.max_retries = settings.OPENAI_MAX_RETRIES if max_retries is None else max_retries
+        self._http_client = http_client
+        self._client: Optional[openai.AsyncOpenAI] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    @property
+    def client(self) -> openai.AsyncOpenAI:
+        if self._client is None:
+            self.start()
+        return self._client
+
+    def start(self):
+        """Создание пула соединений"""
+        if self._client is not None:
+            return
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.OPENAI_MAX_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(settings.OPENAI_TIMEOUT_SECONDS, connect=10.0)
+            )
+        self._client = openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=self._http_client,
+            max_retries=0
+        )
+
+    async def close(self):
+        """Закрытие пула соединений при остановке приложения"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self._http_client = None
+
+    async def chat_completion(self, **kwargs) -> Any:
+        """chat.completions.create с лимитами модели и повторами"""
+        return await self._call(kwargs["model"], self.client.chat.completions.create, kwargs)
+
+    async def create_embeddings(self, **kwargs) -> Any:
+        """embeddings.create с лимитами модели и повторами"""
+        return await self._call(kwargs["model"], self.client.embeddings.create, kwargs)
+
+    async def _call(self, model: str, method: Callable[..., Awaitable[Any]],
+                    kwargs: Dict[str, Any]) -> Any:
+        semaphore = self._semaphores.setdefault(
+            model, asyncio.Semaphore(self.max_concurrency))
+        bucket = self._buckets.setdefault(
+            model, TokenBucket(self.requests_per_minute / 60.0, self.max_concurrency))
+
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            async with semaphore:
+                openai_inflight_requests.labels(model=model).inc()
+                try:
+                    return await method(**kwargs)
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self._retry_delay(attempt, e)
+                    openai_retries_total.labels(model=model, error=type(e).__name__).inc()
+                    logger.warning(
+                        f"OpenAI {model} request failed ({type(e).__name__}), "
+                        f"retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                finally:
+                    openai_inflight_requests.labels(model=model).dec()
+
+            # Ждем вне семафора, чтобы не держать слот модели
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _retry_delay(attempt: int, error: Exception) -> float:
+        """Задержка перед повтором: Retry-After или full jitter backoff"""
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return min(float(retry_after), settings.OPENAI_RETRY_MAX_DELAY)
+                except ValueError:
+                    pass
+        ceiling = min(settings.OPENAI_RETRY_MAX_DELAY,
+                      settings.OPENAI_RETRY_BASE_DELAY * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+
+# Глобальный клиент для всего процесса
+openai_client = OpenAIClient()
@@ -1,51 +1,146 @@
-import openai
 import tiktoken
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
-from sqlalchemy.orm import Session
-from sqlalchemy import text, func
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Union
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, insert, text, func
+from sqlalchemy.orm import aliased, defer
 from models.vector_data import (
     KnowledgeBase, LessonEmbedding, UserInteraction,
-    SearchQuery, ContentRecommendation, FinancialConcept
+    SearchQuery, ContentRecommendation, FinancialConcept, ConceptNeighbor
 )
 from models.lesson import Lesson
 from models.user import User
 from config import settings
+from services.embedding_cache import embedding_cache
+from services.openai_client import openai_client
+import asyncio
+import hashlib
 import logging
 import json
 import re
 
 logger = logging.getLogger(__name__)
 
+# Лимит токенов на один текст для embedding модели
+MAX_EMBEDDING_TOKENS = 8000
+
+# Границы предложений при разбивке контента на части
+SENTENCE_END = re.compile(r'[.!?]+')
+
+# Дополнительные колонки результатов поиска (search_fields):
+# имя -> (выражение для knowledge_base, выражение для уроков)
+SEARCH_FIELDS = {
+    'full_content': ("kb.content", "le.content_chunk"),
+    'tags': ("kb.tags", "NULL::varchar"),
+    'content_subtype': ("kb.content_type", "NULL::varchar"),
+    'is_verified': ("kb.is_verified", "NULL::boolean"),
+    'description': ("NULL::text", "l.description"),
+    'keywords': ("NULL::text", "l.keywords"),
+    'chunk_index': ("NULL::integer", "le.chunk_index"),
+    'created_at': ("kb.created_at", "l.created_at"),
+}
+
+
+def vector_literal(values: Iterable[float]) -> str:
+    """Значение vector для сырого SQL: '[x1,x2,...]' с CAST(... AS vector)"""
+    return "[" + ",".join(str(float(value)) for value in values) + "]"
+
 
 class VectorService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
-        self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-        self.encoding = tiktoken.encoding_for_model("text-embedding-ada-002")
+        self.client = openai_client
+        self.embedding_model = settings.EMBEDDING_MODEL
+        self.encoding = tiktoken.encoding_for_model(self.embedding_model)
+        self.cache = embedding_cache
 
     async def create_embedding(self, text: str) -> List[float]:
         """Создание векторного представления текста"""
         try:
-            # Очищаем и подготавливаем текст
+            # Очищаем текст и проверяем кеш до токенизации
             cleaned_text = self._clean_text(text)
+            cached = await self.cache.get(self.embedding_model, cleaned_text)
+            if cached is not None:
+                return cached
 
-            # Проверяем длину токенов
-            tokens = self.encoding.encode(cleaned_text)
-            if len(tokens) > 8000:  # Лимит для embedding модели
-                cleaned_text = self.encoding.decode(tokens[:8000])
+            model_input, _ = self._truncate_to_token_limit(cleaned_text)
 
-            response = await self.client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=cleaned_text
+            response = await self.client.create_embeddings(
+                model=self.embedding_model,
+                input=model_input
             )
 
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
+            await self.cache.set(self.embedding_model, cleaned_text, embedding)
+            return embedding
 
         except Exception as e:
             logger.error(f"Error creating embedding: {e}")
             raise
 
+    async def create_embeddings(self, texts: List[str],
+                                batch_size: Optional[int] = None,
+                                max_batch_tokens: Optional[int] = None,
+                                max_concurrency: Optional[int] = None) -> List[List[float]]:
+        """Пакетное создание embeddings: много текстов за один запрос к API
+
+        Тексты группируются в пакеты не больше batch_size штук и
+        max_batch_tokens токенов; одновременно выполняется не больше
+        max_concurrency запросов. Порядок результатов совпадает с texts.
+        Уже закешированные тексты в API не отправляются.
+        """
+        if not texts:
+            return []
+
+        batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        max_batch_tokens = max_batch_tokens or settings.EMBEDDING_BATCH_MAX_TOKENS
+        semaphore = asyncio.Semaphore(
+            max_concurrency or settings.EMBEDDING_MAX_CONCURRENCY)
+
+        cleaned = [self._clean_text(t) for t in texts]
+        embeddings = await self.cache.get_many(self.embedding_model, cleaned)
+
+        # Одинаковые тексты отправляем в API один раз
+        pending: Dict[str, List[int]] = {}
+        for i, vector in enumerate(embeddings):
+            if vector is None:
+                pending.setdefault(cleaned[i], []).append(i)
+        if not pending:
+            return embeddings
+
+        unique_texts = list(pending.keys())
+        prepared = [self._truncate_to_token_limit(t) for t in unique_texts]
+        batches = self._build_embedding_batches(
+            prepared, batch_size, max_batch_tokens)
+        created: List[Optional[List[float]]] = [None] * len(unique_texts)
+
+        async def embed_batch(indexes: List[int]):
+            async with semaphore:
+                response = await self.client.create_embeddings(
+                    model=self.embedding_model,
+                    input=[prepared[i][0] for i in indexes]
+                )
+            # API возвращает embeddings с индексом входа внутри пакета
+            for item in response.data:
+                created[indexes[item.index]] = item.embedding
+
+        try:
+            await asyncio.gather(*(embed_batch(batch) for batch in batches))
+        except Exception as e:
+            logger.error(f"Error creating embeddings batch: {e}")
+            raise
+
+        await self.cache.set_many(self.embedding_model, unique_texts, created)
+        for text_value, vector in zip(unique_texts, created):
+            for i in pending[text_value]:
+                embeddings[i] = vector
+
+        cached_count = len(texts) - sum(len(v) for v in pending.values())
+        logger.info(
+            f"Created {len(unique_texts)} embeddings in {len(batches)} requests "
+            f"({cached_count} from cache)")
+        return embeddings
+
     async def add_knowledge_to_base(self, title: str, content: str, content_type: str,
                                     category: str, difficulty_level: str,
                                     tags: Optional[str] = None, source: Optional[str] = None) -> KnowledgeBase:
@@ -62,12 +157,13 @@ class VectorService:
                 difficulty_level=difficulty_level,
                 tags=tags,
                 source=source,
-                embedding=embedding
+                embedding=embedding,
+                content_hash=self.knowledge_content_hash(title, content)
             )
 
             self.db.add(knowledge)
-            self.db.commit()
-            self.db.refresh(knowledge)
+            await self.db.commit()
+            await self.db.refresh(knowledge)
 
             logger.info(f"Added knowledge to base: {title}")
             return knowledge
@@ -78,44 +174,51 @@ class VectorService:
 
     async def vectorize_lesson_content(self, lesson_id: int) -> List[LessonEmbedding]:
         """Векторизация контента урока по частям"""
-        lesson = self.db.query(Lesson).filter(Lesson.id == lesson_id).first()
+        lesson = await self.db.get(Lesson, lesson_id)
         if not lesson:
             raise ValueError(f"Lesson {lesson_id} not found")
 
         # Удаляем старые embeddings
-        self.db.query(LessonEmbedding).filter(
-            LessonEmbedding.lesson_id == lesson_id).delete()
+        await self.db.execute(delete(LessonEmbedding).where(
+            LessonEmbedding.lesson_id == lesson_id))
 
         # Разбиваем контент на части
         chunks = self._split_content_into_chunks(
-            lesson.content, max_tokens=500)
-
-        embeddings = []
-        for i, chunk in enumerate(chunks):
-            try:
-                # Создаем embedding для части
-                embedding_vector = await self.create_embedding(chunk)
-
-                lesson_embedding = LessonEmbedding(
-                    lesson_id=lesson_id,
-                    content_chunk=chunk,
-                    chunk_index=i,
-                    embedding=embedding_vector,
-                    metadata=json.dumps({
-                        "title": lesson.title,
-                        "category": lesson.category,
-                        "difficulty": lesson.difficulty_level
-                    })
-                )
-
-                self.db.add(lesson_embedding)
-                embeddings.append(lesson_embedding)
-
-            except Exception as e:
-                logger.error(
-                    f"Error creating embedding for chunk {i} of lesson {lesson_id}: {e}")
+            lesson.content,
+            max_tokens=settings.LESSON_CHUNK_MAX_TOKENS,
+            overlap_tokens=settings.LESSON_CHUNK_OVERLAP_TOKENS)
+        if not chunks:
+            await self.db.commit()
+            return []
+
+        # Создаем embeddings для всех частей пакетами
+        try:
+            vectors = await self.create_embeddings(chunks)
+        except Exception as e:
+            logger.error(
+                f"Error creating embeddings for lesson {lesson_id}: {e}")
+            await self.db.rollback()
+            raise
 
-        self.db.commit()
+        metadata = json.dumps({
+            "title": lesson.title,
+            "category": lesson.category,
+            "difficulty": lesson.difficulty_level
+        })
+        rows = [{
+            "lesson_id": lesson_id,
+            "content_chunk": chunk,
+            "chunk_index": i,
+            "embedding": vector,
+            "metadata_": metadata
+        } for i, (chunk, vector) in enumerate(zip(chunks, vectors))]
+
+        # Одна пакетная вставка вместо добавления строк по одной
+        result = await self.db.scalars(
+            insert(LessonEmbedding).returning(LessonEmbedding), rows)
+        embeddings = result.all()
+
+        await self.db.commit()
         logger.info(
             f"Created {len(embeddings)} embeddings for lesson {lesson_id}")
         return embeddings
@@ -123,9 +226,26 @@ class VectorService:
     async def semantic_search(self, query: str, user_id: Optional[int] = None,
                               content_types: Optional[List[str]] = None,
                               categories: Optional[List[str]] = None,
-                              limit: int = 10) -> List[Dict[str, Any]]:
-        """Семантический поиск по базе знаний и урокам"""
+                              limit: int = 10,
+                              hybrid: Optional[bool] = None,
+                              search_fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Семантический поиск по базе знаний и урокам
+
+        Один запрос к БД: кандидаты из обоих источников, лучшая часть для
+        каждого урока и общий top-k. При hybrid=True векторный ранг
+        объединяется с полнотекстовым через reciprocal rank fusion.
+        Возвращаются только колонки для отображения и фрагмент текста;
+        дополнительные колонки из SEARCH_FIELDS запрашиваются через
+        search_fields и попадают в result['fields'].
+        """
+        unknown_fields = set(search_fields or []) - SEARCH_FIELDS.keys()
+        if unknown_fields:
+            raise ValueError(f"Unknown search fields: {', '.join(sorted(unknown_fields))}")
+
         try:
+            if hybrid is None:
+                hybrid = settings.SEARCH_HYBRID
+
             # Создаем embedding для запроса
             query_embedding = await self.create_embedding(query)
 
@@ -137,27 +257,14 @@ class VectorService:
             )
             self.db.add(search_query)
 
-            results = []
-
-            # Поиск в базе знаний
-            kb_results = await self._search_knowledge_base(
-                query_embedding, content_types, categories, limit//2
+            results = await self._search_content(
+                query, query_embedding, content_types, categories, limit, hybrid,
+                search_fields or []
             )
-            results.extend(kb_results)
-
-            # Поиск в уроках
-            lesson_results = await self._search_lessons(
-                query_embedding, categories, limit//2
-            )
-            results.extend(lesson_results)
-
-            # Сортируем по релевантности
-            results.sort(key=lambda x: x['similarity'], reverse=True)
-            results = results[:limit]
 
             # Обновляем количество результатов
             search_query.results_count = len(results)
-            self.db.commit()
+            await self.db.commit()
 
             # Логируем взаимодействие пользователя
             if user_id:
@@ -173,9 +280,10 @@ class VectorService:
         """Получение персонализированных рекомендаций контента"""
         try:
             # Анализируем историю пользователя
-            user_interactions = self.db.query(UserInteraction).filter(
+            result = await self.db.execute(select(UserInteraction).where(
                 UserInteraction.user_id == user_id
-            ).order_by(UserInteraction.created_at.desc()).limit(50).all()
+            ).order_by(UserInteraction.created_at.desc()).limit(50))
+            user_interactions = result.scalars().all()
 
             if not user_interactions:
                 # Для новых пользователей возвращаем популярный контент
@@ -199,7 +307,7 @@ class VectorService:
                 )
                 self.db.add(content_rec)
 
-            self.db.commit()
+            await self.db.commit()
             return recommendations
 
         except Exception as e:
@@ -208,116 +316,323 @@ class VectorService:
             raise
 
     async def find_related_concepts(self, concept: str, limit: int = 5) -> List[FinancialConcept]:
-        """Поиск связанных финансовых концепций"""
+        """Поиск связанных финансовых концепций
+
+        Для известного термина соседи берутся из графа concept_neighbors
+        без обращения к API embeddings; иначе выполняется векторный поиск.
+        В обоих случаях концепции загружаются одним запросом.
+        """
         try:
+            if limit <= settings.CONCEPT_NEIGHBORS_K:
+                source = aliased(FinancialConcept)
+                result = await self.db.scalars(
+                    select(FinancialConcept)
+                    .join(ConceptNeighbor, ConceptNeighbor.neighbor_id == FinancialConcept.id)
+                    .join(source, source.id == ConceptNeighbor.concept_id)
+                    .where(func.lower(source.term) == concept.strip().lower())
+                    .order_by(ConceptNeighbor.similarity.desc())
+                    .limit(limit)
+                    .options(defer(FinancialConcept.embedding))
+                )
+                concepts = result.all()
+                if concepts:
+                    return concepts
+
             concept_embedding = await self.create_embedding(concept)
 
             # Поиск похожих концепций по векторному сходству
-            query = text("""
-                SELECT *, (embedding <=> :query_embedding) as distance
-                FROM financial_concepts
-                WHERE embedding IS NOT NULL
-                ORDER BY distance
-                LIMIT :limit
-            """)
-
-            result = self.db.execute(query, {
-                'query_embedding': concept_embedding,
-                'limit': limit
-            })
-
-            concepts = []
-            for row in result:
-                concept_obj = self.db.query(FinancialConcept).filter(
-                    FinancialConcept.id == row.id
-                ).first()
-                if concept_obj:
-                    concepts.append(concept_obj)
-
-            return concepts
+            result = await self.db.scalars(
+                select(FinancialConcept)
+                .where(FinancialConcept.embedding.is_not(None))
+                .order_by(FinancialConcept.embedding.cosine_distance(concept_embedding))
+                .limit(limit)
+                .options(defer(FinancialConcept.embedding))
+            )
+            return result.all()
 
         except Exception as e:
             logger.error(f"Error finding related concepts: {e}")
             raise
 
-    async def _search_knowledge_base(self, query_embedding: List[float],
-                                     content_types: Optional[List[str]],
-                                     categories: Optional[List[str]],
-                                     limit: int) -> List[Dict[str, Any]]:
-        """Поиск в базе знаний"""
-        query_parts = [
-            "SELECT *, (embedding <=> :query_embedding) as distance FROM knowledge_base WHERE embedding IS NOT NULL"]
-        params = {'query_embedding': query_embedding}
+    async def refresh_concept_neighbors(self, concept_ids: Optional[List[int]] = None):
+        """Инкрементальное обновление графа concept_neighbors
+
+        Для новых концепций (concept_ids) вычисляются их K ближайших соседей,
+        а сами новые концепции добавляются в списки существующих, если они
+        ближе текущего K-го соседа. Без concept_ids граф строится заново.
+        """
+        k = settings.CONCEPT_NEIGHBORS_K
+
+        if concept_ids is None:
+            await self.db.execute(delete(ConceptNeighbor))
+            concept_ids = list(await self.db.scalars(
+                select(FinancialConcept.id).where(FinancialConcept.embedding.is_not(None))))
+        if not concept_ids:
+            return
+
+        params = {'ids': concept_ids, 'k': k}
+
+        # Соседи новых концепций
+        await self.db.execute(text("""
+            INSERT INTO concept_neighbors (concept_id, neighbor_id, similarity)
+            SELECT c.id, n.id, 1 - (c.embedding <=> n.embedding)
+            FROM financial_concepts c
+            CROSS JOIN LATERAL (
+                SELECT fc.id, fc.embedding
+                FROM financial_concepts fc
+                WHERE fc.id <> c.id AND fc.embedding IS NOT NULL
+                ORDER BY fc.embedding <=> c.embedding
+                LIMIT :k
+            ) n
+            WHERE c.id = ANY(:ids) AND c.embedding IS NOT NULL
+            ON CONFLICT (concept_id, neighbor_id)
+            DO UPDATE SET similarity = EXCLUDED.similarity, updated_at = now()
+        """), params)
+
+        # Новые концепции в списках существующих: только если они ближе
+        # текущего K-го соседа (или список еще не заполнен)
+        await self.db.execute(text("""
+            INSERT INTO concept_neighbors (concept_id, neighbor_id, similarity)
+            SELECT n.id, c.id, 1 - (n.embedding <=> c.embedding)
+            FROM financial_concepts c
+            JOIN financial_concepts n
+              ON n.id <> c.id AND n.embedding IS NOT NULL AND NOT (n.id = ANY(:ids))
+            WHERE c.id = ANY(:ids) AND c.embedding IS NOT NULL
+              AND 1 - (n.embedding <=> c.embedding) > COALESCE((
+                  SELECT min(cn.similarity) FROM concept_neighbors cn
+                  WHERE cn.concept_id = n.id
+                  HAVING count(*) >= :k
+              ), -1)
+            ON CONFLICT (concept_id, neighbor_id)
+            DO UPDATE SET similarity = EXCLUDED.similarity, updated_at = now()
+        """), params)
+
+        # Оставляем K ближайших соседей у затронутых концепций
+        await self.db.execute(text("""
+            DELETE FROM concept_neighbors cn
+            USING (
+                SELECT concept_id, neighbor_id,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY concept_id ORDER BY similarity DESC
+                       ) AS rank
+                FROM concept_neighbors
+                WHERE concept_id IN (
+                    SELECT concept_id FROM concept_neighbors
+                    WHERE neighbor_id = ANY(:ids)
+                )
+            ) ranked
+            WHERE ranked.rank > :k
+              AND cn.concept_id = ranked.concept_id
+              AND cn.neighbor_id = ranked.neighbor_id
+        """), params)
+
+        await self.db.commit()
+        logger.info(f"Refreshed concept neighbors for {len(concept_ids)} concepts")
+
+    async def _search_content(self, query: str, query_embedding: List[float],
+                              content_types: Optional[List[str]],
+                              categories: Optional[List[str]],
+                              limit: int, hybrid: bool,
+                              search_fields: List[str]) -> List[Dict[str, Any]]:
+        """Поиск в базе знаний и уроках одним запросом"""
+        candidates = limit * settings.SEARCH_CANDIDATE_MULTIPLIER
+        params = {
+            # Текстовый литерал '[...]': asyncpg передает vector как текст
+            'query_embedding': vector_literal(query_embedding),
+            'limit': limit,
+            'candidates': candidates,
+            # у урока несколько частей, берем больше кандидатов
+            'chunk_candidates': candidates * settings.SEARCH_CANDIDATE_MULTIPLIER,
+            'snippet_length': settings.SEARCH_SNIPPET_LENGTH,
+        }
 
+        kb_filters = ["kb.embedding IS NOT NULL"]
         if content_types:
-            query_parts.append("AND content_type = ANY(:content_types)")
+            kb_filters.append("kb.content_type = ANY(:content_types)")
             params['content_types'] = content_types
 
+        lesson_filters = ["TRUE"]
         if categories:
-            query_parts.append("AND category = ANY(:categories)")
+            kb_filters.append("kb.category = ANY(:categories)")
+            lesson_filters.append("l.category = ANY(:categories)")
             params['categories'] = categories
 
-        query_parts.append("ORDER BY distance LIMIT :limit")
-        params['limit'] = limit
+        if hybrid:
+            params['query'] = query
+            params['text_config'] = settings.SEARCH_TEXT_CONFIG
+            params['rrf_k'] = settings.SEARCH_RRF_K
 
-        query = text(" ".join(query_parts))
-        result = self.db.execute(query, params)
+        result = await self.db.execute(
+            text(self._build_search_query(" AND ".join(kb_filters),
+                                          " AND ".join(lesson_filters), hybrid,
+                                          search_fields)),
+            params
+        )
 
         results = []
         for row in result:
-            results.append({
-                'content_type': 'knowledge_base',
-                'content_id': row.id,
+            item = {
+                'content_type': row.content_type,
+                'content_id': row.content_id,
                 'title': row.title,
-                'content': row.content[:200] + "..." if len(row.content) > 200 else row.content,
+                'content': row.content,
                 'category': row.category,
                 'difficulty_level': row.difficulty_level,
                 'similarity': 1 - row.distance,
-                'source': row.source
-            })
+                'source': row.source,
+                'duration_minutes': row.duration_minutes
+            }
+            if hybrid:
+                item['score'] = float(row.score)
+            if search_fields:
+                item['fields'] = {name: row._mapping[f"field_{name}"] for name in search_fields}
+            results.append(item)
 
         return results
 
-    async def _search_lessons(self, query_embedding: List[float],
-                              categories: Optional[List[str]],
-                              limit: int) -> List[Dict[str, Any]]:
-        """Поиск в уроках"""
-        query_parts = ["""
-            SELECT l.*, le.content_chunk, (le.embedding <=> :query_embedding) as distance
-            FROM lessons l
-            JOIN lesson_embeddings le ON l.id = le.lesson_id
-            WHERE le.embedding IS NOT NULL
-        """]
-        params = {'query_embedding': query_embedding}
-
-        if categories:
-            query_parts.append("AND l.category = ANY(:categories)")
-            params['categories'] = categories
-
-        query_parts.append("ORDER BY distance LIMIT :limit")
-        params['limit'] = limit
-
-        query = text(" ".join(query_parts))
-        result = self.db.execute(query, params)
-
-        results = []
-        seen_lessons = set()
-
-        for row in result:
-            if row.id not in seen_lessons:
-                results.append({
-                    'content_type': 'lesson',
-                    'content_id': row.id,
-                    'title': row.title,
-                    'content': row.content_chunk,
-                    'category': row.category,
-                    'difficulty_level': row.difficulty_level,
-                    'similarity': 1 - row.distance,
-                    'duration_minutes': row.duration_minutes
-                })
-                seen_lessons.add(row.id)
-
-        return results
+    @staticmethod
+    def _build_search_query(kb_where: str, lesson_where: str, hybrid: bool,
+                            search_fields: List[str]) -> str:
+        """SQL общего поиска по knowledge_base и lesson_embeddings
+
+        Кандидаты выбираются по векторному расстоянию (HNSW индекс), а в
+        гибридном режиме дополнительно по полнотекстовому рангу (GIN индекс
+        по search_vector). Для урока остается одна лучшая часть (DISTINCT ON).
+        Векторы и полный текст из запроса не возвращаются: фрагмент для
+        базы знаний обрезается на стороне БД.
+        """
+        kb_fields = "".join(f", {SEARCH_FIELDS[name][0]} AS field_{name}"
+                            for name in search_fields)
+        lesson_fields = "".join(f", {SEARCH_FIELDS[name][1]} AS field_{name}"
+                                for name in search_fields)
+        keyword_score = "0.0"
+        kb_keyword_candidates = ""
+        chunk_keyword_candidates = ""
+        tsquery_cte = ""
+        tsquery_join = ""
+
+        if hybrid:
+            tsquery_cte = """
+            tsq AS (
+                SELECT plainto_tsquery(CAST(:text_config AS regconfig), :query) AS query
+            ),"""
+            tsquery_join = "CROSS JOIN tsq"
+            keyword_score = "COALESCE(ts_rank_cd({table}.search_vector, tsq.query), 0.0)"
+            kb_keyword_candidates = f"""
+                UNION
+                (SELECT kb.id FROM knowledge_base kb CROSS JOIN tsq
+                 WHERE {kb_where} AND kb.search_vector @@ tsq.query
+                 ORDER BY ts_rank_cd(kb.search_vector, tsq.query) DESC
+                 LIMIT :candidates)"""
+            chunk_keyword_candidates = f"""
+                UNION
+                (SELECT le.id FROM lesson_embeddings le
+                 JOIN lessons l ON l.id = le.lesson_id CROSS JOIN tsq
+                 WHERE {lesson_where} AND le.search_vector @@ tsq.query
+                 ORDER BY ts_rank_cd(le.search_vector, tsq.query) DESC
+                 LIMIT :chunk_candidates)"""
+
+        query = f"""
+            WITH {tsquery_cte}
+            kb_candidates AS (
+                (SELECT kb.id FROM knowledge_base kb
+                 WHERE {kb_where}
+                 ORDER BY kb.embedding <=> CAST(:query_embedding AS vector)
+                 LIMIT :candidates){kb_keyword_candidates}
+            ),
+            chunk_candidates AS (
+                (SELECT le.id FROM lesson_embeddings le
+                 JOIN lessons l ON l.id = le.lesson_id
+                 WHERE {lesson_where}
+                 ORDER BY le.embedding <=> CAST(:query_embedding AS vector)
+                 LIMIT :chunk_candidates){chunk_keyword_candidates}
+            ),
+            hits AS (
+                SELECT 'knowledge_base' AS content_type, kb.id AS content_id,
+                       kb.title,
+                       CASE WHEN length(kb.content) > :snippet_length
+                            THEN left(kb.content, :snippet_length) || '...'
+                            ELSE kb.content
+                       END AS content,
+                       kb.category, kb.difficulty_level,
+                       kb.source, NULL::integer AS duration_minutes,
+                       kb.embedding <=> CAST(:query_embedding AS vector) AS distance,
+                       {keyword_score.format(table="kb")} AS keyword_score{kb_fields}
+                FROM kb_candidates c
+                JOIN knowledge_base kb ON kb.id = c.id {tsquery_join}
+                UNION ALL
+                SELECT * FROM (
+                    SELECT DISTINCT ON (l.id)
+                           'lesson' AS content_type, l.id AS content_id,
+                           l.title, le.content_chunk AS content, l.category,
+                           l.difficulty_level, NULL::varchar AS source,
+                           l.duration_minutes,
+                           le.embedding <=> CAST(:query_embedding AS vector) AS distance,
+                           {keyword_score.format(table="le")} AS keyword_score{lesson_fields}
+                    FROM chunk_candidates c
+                    JOIN lesson_embeddings le ON le.id = c.id
+                    JOIN lessons l ON l.id = le.lesson_id {tsquery_join}
+                    ORDER BY l.id, distance, keyword_score DESC
+                ) best_chunks
+            )"""
+
+        if not hybrid:
+            return query + """
+            SELECT * FROM hits
+            ORDER BY distance
+            LIMIT :limit
+        """
+
+        return query + """,
+            ranked AS (
+                SELECT hits.*,
+                       ROW_NUMBER() OVER (ORDER BY distance) AS vector_rank,
+                       CASE WHEN keyword_score > 0
+                            THEN ROW_NUMBER() OVER (ORDER BY keyword_score DESC)
+                       END AS keyword_rank
+                FROM hits
+            )
+            SELECT ranked.*,
+                   1.0 / (:rrf_k + vector_rank)
+                   + COALESCE(1.0 / (:rrf_k + keyword_rank), 0.0) AS score
+            FROM ranked
+            ORDER BY score DESC, distance
+            LIMIT :limit
+        """
+
+    @staticmethod
+    def knowledge_content_hash(title: str, content: str) -> str:
+        """Хеш документа базы знаний для дедупликации"""
+        return hashlib.sha256(f"{title}\n{content}".encode("utf-8")).hexdigest()
+
+    def _truncate_to_token_limit(self, cleaned_text: str) -> Tuple[str, int]:
+        """Обрезка очищенного текста до лимита токенов модели"""
+        tokens = self.encoding.encode(cleaned_text)
+        if len(tokens) > MAX_EMBEDDING_TOKENS:
+            tokens = tokens[:MAX_EMBEDDING_TOKENS]
+            cleaned_text = self.encoding.decode(tokens)
+
+        return cleaned_text, len(tokens)
+
+    def _build_embedding_batches(self, prepared: List[Tuple[str, int]],
+                                 batch_size: int, max_batch_tokens: int) -> List[List[int]]:
+        """Группировка индексов текстов в пакеты по количеству и токенам"""
+        batches = []
+        current: List[int] = []
+        current_tokens = 0
+
+        for i, (_, n_tokens) in enumerate(prepared):
+            if current and (len(current) >= batch_size or
+                            current_tokens + n_tokens > max_batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += n_tokens
+
+        if current:
+            batches.append(current)
+
+        return batches
 
     def _clean_text(self, text: str) -> str:
         """Очистка текста для векторизации"""
@@ -329,32 +644,90 @@ class VectorService:
         text = re.sub(r'[^\w\s\.\,\!\?\-]', '', text)
         return text.strip()
 
-    def _split_content_into_chunks(self, content: str, max_tokens: int = 500) -> List[str]:
+    def _split_content_into_chunks(self, content: str, max_tokens: int = 500,
+                                   overlap_tokens: int = 0) -> List[str]:
         """Разбивка контента на части для векторизации"""
-        sentences = re.split(r'[.!?]+', content)
-        chunks = []
-        current_chunk = ""
-
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
+        return list(self._iter_content_chunks(content, max_tokens, overlap_tokens))
+
+    def _iter_content_chunks(self, content: Union[str, Iterable[str]],
+                             max_tokens: int = 500,
+                             overlap_tokens: int = 0) -> Iterator[str]:
+        """Потоковая разбивка контента на части не длиннее max_tokens токенов
+
+        Каждое предложение токенизируется один раз (вместе с ведущим
+        пробелом, как оно стоит внутри части), длина части считается
+        нарастающим итогом. Предложение длиннее max_tokens режется по токенам.
+        Последние предложения части длиной до overlap_tokens повторяются
+        в начале следующей. content может быть строкой или итератором
+        фрагментов текста (например, строк файла).
+        """
+        overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        window: List[Tuple[str, int]] = []  # (предложение, число токенов)
+        window_tokens = 0
+        has_new = False  # в окне есть предложения помимо перекрытия
+
+        for sentence in self._iter_sentences(content):
+            cost = len(self.encoding.encode(" " + sentence))
+
+            if cost > max_tokens:
+                # Жесткий лимит: режем длинное предложение на окна токенов
+                if has_new:
+                    yield " ".join(s for s, _ in window)
+                window, window_tokens, has_new = [], 0, False
+                tokens = self.encoding.encode(sentence)
+                for start in range(0, len(tokens), max_tokens):
+                    yield self.encoding.decode(tokens[start:start + max_tokens])
                 continue
 
-            # Проверяем, поместится ли предложение в текущий chunk
-            test_chunk = current_chunk + " " + sentence if current_chunk else sentence
-            tokens = self.encoding.encode(test_chunk)
-
-            if len(tokens) <= max_tokens:
-                current_chunk = test_chunk
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = sentence
-
-        if current_chunk:
-            chunks.append(current_chunk)
-
-        return chunks
+            if window and window_tokens + cost > max_tokens:
+                if has_new:
+                    yield " ".join(s for s, _ in window)
+                window, window_tokens = self._overlap_tail(
+                    window, overlap_tokens, max_tokens - cost)
+                has_new = False
+
+            window.append((sentence, cost))
+            window_tokens += cost
+            has_new = True
+
+        if has_new:
+            yield " ".join(s for s, _ in window)
+
+    @staticmethod
+    def _overlap_tail(window: List[Tuple[str, int]], overlap_tokens: int,
+                      room: int) -> Tuple[List[Tuple[str, int]], int]:
+        """Хвост части длиной не больше overlap_tokens для следующей части"""
+        budget = min(overlap_tokens, room)
+        tail: List[Tuple[str, int]] = []
+        total = 0
+        for sentence, cost in reversed(window):
+            if total + cost > budget:
+                break
+            tail.append((sentence, cost))
+            total += cost
+        tail.reverse()
+        return tail, total
+
+    @staticmethod
+    def _iter_sentences(content: Union[str, Iterable[str]]) -> Iterator[str]:
+        """Потоковое разбиение текста на предложения"""
+        pieces = [content] if isinstance(content, str) else content
+        pending: List[str] = []
+
+        for piece in pieces:
+            start = 0
+            for match in SENTENCE_END.finditer(piece):
+                pending.append(piece[start:match.start()])
+                sentence = "".join(pending).strip()
+                if sentence:
+                    yield sentence
+                pending = []
+                start = match.end()
+            pending.append(piece[start:])
+
+        sentence = "".join(pending).strip()
+        if sentence:
+            yield sentence
 
     async def _log_search_interaction(self, user_id: int, query: str, results: List[Dict[str, Any]]):
         """Логирование поискового взаимодействия"""
@@ -367,18 +740,29 @@ class VectorService:
         )
         self.db.add(interaction)
 
+    @staticmethod
+    def _knowledge_preview_query():
+        """Колонки базы знаний для карточки рекомендации, без вектора и полного текста"""
+        return select(
+            KnowledgeBase.id,
+            KnowledgeBase.title,
+            KnowledgeBase.category,
+            func.left(KnowledgeBase.content, settings.SEARCH_SNIPPET_LENGTH).label("snippet")
+        )
+
     async def _get_trending_content(self, limit: int) -> List[Dict[str, Any]]:
         """Получение популярного контента"""
         # Простая реализация - возвращаем недавно добавленный контент
-        knowledge = self.db.query(KnowledgeBase).filter(
+        result = await self.db.execute(self._knowledge_preview_query().where(
             KnowledgeBase.is_verified == True
-        ).order_by(KnowledgeBase.created_at.desc()).limit(limit).all()
+        ).order_by(KnowledgeBase.created_at.desc()).limit(limit))
+        knowledge = result.all()
 
         return [{
             'content_type': 'knowledge_base',
             'content_id': kb.id,
             'title': kb.title,
-            'content': kb.content[:200] + "...",
+            'content': kb.snippet + "...",
             'category': kb.category,
             'recommendation_type': 'trending',
             'score': 0.8,
@@ -406,8 +790,7 @@ class VectorService:
 
             # Получаем категорию контента
             if interaction.content_type == 'lesson':
-                lesson = self.db.query(Lesson).filter(
-                    Lesson.id == interaction.content_id).first()
+                lesson = await self.db.get(Lesson, interaction.content_id)
                 if lesson:
                     categories[lesson.category] = categories.get(
                         lesson.category, 0) + weight
@@ -434,17 +817,18 @@ class VectorService:
 
         for category, score in top_categories:
             # Находим контент в этой категории
-            knowledge = self.db.query(KnowledgeBase).filter(
+            result = await self.db.execute(self._knowledge_preview_query().where(
                 KnowledgeBase.category == category,
                 KnowledgeBase.is_verified == True
-            ).limit(limit//len(top_categories)).all()
+            ).limit(limit//len(top_categories)))
+            knowledge = result.all()
 
             for kb in knowledge:
                 recommendations.append({
                     'content_type': 'knowledge_base',
                     'content_id': kb.id,
                     'title': kb.title,
-                    'content': kb.content[:200] + "...",
+                    'content': kb.snippet + "...",
                     'category': kb.category,
                     'recommendation_type': 'personalized',
                     'score': score / sum(user_profile['categories'].values()),
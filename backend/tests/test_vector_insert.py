@@ -0,0 +1,56 @@
+"""
+Запись vector через асинхронный движок (asyncpg)
+
+Нужен PostgreSQL с pgvector: DATABASE_URL=postgresql://... pytest tests
+"""
+
+import os
+import uuid
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("DATABASE_URL", "").startswith("postgres"),
+    reason="DATABASE_URL with PostgreSQL + pgvector is not set"
+)
+
+
+@pytest.mark.asyncio
+async def test_orm_insert_and_raw_search_with_vector():
+    from sqlalchemy import delete, insert, select, text
+
+    from database import AsyncSessionLocal, async_engine, init_db, migrate_schema
+    from models.vector_data import KnowledgeBase
+    from services.vector_service import vector_literal
+
+    await init_db()
+    await migrate_schema()
+    title = f"test-vector-{uuid.uuid4().hex}"
+    embedding = [0.0] * 1535 + [1.0]
+
+    try:
+        async with AsyncSessionLocal() as db:
+            # ORM-объект и bulk insert - оба пути записи приложения
+            db.add(KnowledgeBase(title=title, content="a", content_type="tip",
+                                 category="saving", difficulty_level="beginner",
+                                 embedding=embedding))
+            await db.execute(insert(KnowledgeBase).values(
+                title=title, content="b", content_type="tip", category="saving",
+                difficulty_level="beginner", embedding=embedding))
+            await db.commit()
+
+            stored = (await db.scalars(
+                select(KnowledgeBase.embedding).where(KnowledgeBase.title == title))).all()
+            assert len(stored) == 2
+            assert list(stored[0]) == embedding
+
+            distance = await db.scalar(text(
+                "SELECT min(embedding <=> CAST(:query AS vector)) "
+                "FROM knowledge_base WHERE title = :title"
+            ), {"query": vector_literal(embedding), "title": title})
+            assert distance == pytest.approx(0.0)
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(KnowledgeBase).where(KnowledgeBase.title == title))
+            await db.commit()
+        await async_engine.dispose()
@@ -0,0 +1,123 @@
+"""
+Почасовые счетчики событий журнала трекера
+
+Счетчики хранятся по дням UTC (24 значения на день) и обновляются
+инкрементально: catch_up читает журнал только с позиции, до которой он
+уже учтен. EventLog вызывает catch_up после каждого записанного пакета,
+так что счетчики обновляются при записи; строки других процессов
+подхватываются тем же чтением. Новый день UTC начинает новую строку
+счетчиков, прошлые дни не меняются.
+
+Состояние (счетчики, inode журнала и позиция) сохраняется рядом с
+журналом в <журнал>.hourly.json. После перезапуска читается только
+хвост журнала; после сжатия журнала (другой inode) счетчики
+пересчитываются заново - сжатие сохраняет почасовые суммы.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from usage_log import parse_timestamp
+
+HOUR = timedelta(hours=1)
+
+
+class HourlyCounters:
+    """Суммы usage_count по часам UTC"""
+
+    def __init__(self, log_path: str, save_interval: float = 5.0):
+        self.log_path = log_path
+        self.snapshot_path = f"{log_path}.hourly.json"
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._days: Dict[str, List[int]] = {}
+        self._inode: Optional[int] = None
+        self._offset = 0
+        self._saved_at = 0.0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        self._days = snapshot["days"]
+        self._inode = snapshot["inode"]
+        self._offset = snapshot["offset"]
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        # Свой временный файл у каждого процесса: снимок пишут все воркеры
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.snapshot_path)),
+            prefix=os.path.basename(self.snapshot_path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"inode": self._inode, "offset": self._offset, "days": self._days}, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._saved_at = time.monotonic()
+        self._dirty = False
+
+    def catch_up(self):
+        """Учет строк журнала, добавленных с прошлого вызова"""
+        with self._lock:
+            try:
+                f = open(self.log_path, "rb")
+            except FileNotFoundError:
+                return
+            with f:
+                stat = os.fstat(f.fileno())
+                if stat.st_ino != self._inode or stat.st_size < self._offset:
+                    # Журнал сжат или создан заново
+                    self._days, self._offset, self._inode = {}, 0, stat.st_ino
+                    self._dirty = True
+                if stat.st_size == self._offset:
+                    return
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Строка еще дописывается - учтем в следующий раз
+                        break
+                    self._offset += len(line)
+                    self._dirty = True
+                    try:
+                        record = json.loads(line)
+                        self._add(parse_timestamp(record["timestamp"]), record["usage_count"])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+
+            if self._dirty and time.monotonic() - self._saved_at >= self.save_interval:
+                self._save()
+
+    def _add(self, dt: datetime, count: int):
+        dt = dt.astimezone(timezone.utc)
+        day = dt.date().isoformat()
+        hours = self._days.get(day)
+        if hours is None:
+            hours = self._days[day] = [0] * 24
+        hours[dt.hour] += count
+
+    def series(self, start: datetime, end: datetime) -> List[Tuple[datetime, int]]:
+        """(начало часа UTC, сумма) для каждого часа в [start, end)"""
+        hour = start.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        end = end.astimezone(timezone.utc)
+        result = []
+        with self._lock:
+            while hour < end:
+                hours = self._days.get(hour.date().isoformat())
+                result.append((hour, hours[hour.hour] if hours else 0))
+                hour += HOUR
+        return result
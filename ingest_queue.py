@@ -0,0 +1,91 @@
+"""
+Очередь пакетной записи для асинхронного трекера
+
+Обработчики запросов кладут запись в asyncio.Queue и ждут future.
+Один consumer забирает из очереди все накопившееся (до max_batch) и
+обрабатывает пакет одним вызовом в потоке: журнал пишет пакет одним
+write + fsync, SQLite - одной транзакцией. Event loop не блокируется
+файловым вводом-выводом, а число потоков не растет с числом запросов.
+"""
+
+import asyncio
+from typing import Any, Callable, Generic, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class QueueFullError(Exception):
+    """Очередь переполнена: запись не успевает за входящим потоком"""
+
+
+class BatchQueue(Generic[T, R]):
+    """Очередь с пакетной обработкой
+
+    process получает список элементов и возвращает список результатов
+    той же длины; исключение в process передается всем запросам пакета,
+    исключение на месте результата - только запросу этого элемента.
+    """
+
+    def __init__(self, process: Callable[[List[T]], List[R]],
+                 max_batch: int = 1000, max_size: int = 10000):
+        self.process = process
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._task: Optional[asyncio.Task] = None
+        self._current: Optional[asyncio.Future] = None
+
+    async def submit(self, item: T) -> R:
+        """Постановка в очередь и ожидание обработки пакета"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise QueueFullError()
+        return await future
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # Остановка не прерывает пакет, уже отданный в поток
+            self._current = asyncio.ensure_future(self._process(batch))
+            await asyncio.shield(self._current)
+
+    async def _process(self, batch: List[Tuple[T, Any]]):
+        try:
+            results = await asyncio.to_thread(self.process, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def stop(self):
+        """Остановка consumer с обработкой уже принятых записей"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._current is not None:
+            await self._current
+            self._current = None
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._process(batch)
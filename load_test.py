@@ -0,0 +1,99 @@
+"""
+Нагрузочный тест трекера с постоянной частотой запросов
+
+Запросы отправляются по расписанию с заданной частотой (open loop, как
+wrk2): задержка считается от запланированного момента отправки, поэтому
+очередь на стороне клиента при перегрузке сервера входит в p99, а не
+скрывается уменьшением частоты.
+
+Запуск (трекер уже запущен):
+    python load_test.py --url http://localhost:5000 --qps 2000 --duration 30
+    python load_test.py --path /api/users/123/increment --qps 500
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def run_load(url: str, path: str, qps: float, duration: float,
+                   max_inflight: int) -> dict:
+    """Отправляет qps запросов в секунду в течение duration секунд"""
+    latencies = []
+    errors = 0
+    skipped = 0
+    inflight = asyncio.Semaphore(max_inflight)
+    limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=max_inflight)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+        async def send(scheduled: float):
+            nonlocal errors
+            try:
+                body = {"timestamp": datetime.now(timezone.utc).isoformat(), "usage_count": 1}
+                response = await client.post(path, json=body)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - scheduled)
+            except Exception:
+                errors += 1
+            finally:
+                inflight.release()
+
+        tasks = []
+        started = time.perf_counter()
+        total = int(qps * duration)
+        for number in range(total):
+            scheduled = started + number / qps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if inflight.locked():
+                # Клиент упирается в max_inflight - сервер не успевает
+                skipped += 1
+                continue
+            await inflight.acquire()
+            tasks.append(asyncio.create_task(send(scheduled)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "skipped": skipped,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--path", default="/api/update_usage")
+    parser.add_argument("--qps", type=float, default=1000.0, help="целевая частота запросов")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--max-inflight", type=int, default=1000,
+                        help="максимум одновременных запросов клиента")
+    args = parser.parse_args()
+
+    print(f"POST {args.url}{args.path} qps={args.qps} duration={args.duration}s")
+    r = await run_load(args.url, args.path, args.qps, args.duration, args.max_inflight)
+    print(f"{r['rps']:8.1f} req/s  p50={r['p50_ms']:.1f}ms  p95={r['p95_ms']:.1f}ms  "
+          f"p99={r['p99_ms']:.1f}ms  max={r['max_ms']:.1f}ms  "
+          f"errors={r['errors']}  skipped={r['skipped']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
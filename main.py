@@ -1,106 +1,228 @@
-from flask import Flask, request, jsonify
-from datetime import datetime, timezone, timedelta
-import json
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import os
-from flask_cors import CORS
 
-app = Flask(__name__)
-CORS(app)
+from fastapi import FastAPI, Path, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+import uvicorn
 
-DATA_FILE = 'data.json'
-USAGE_FILE = 'data_usage.json'  # отдельный файл для использования
+from hourly_counters import HourlyCounters
+from ingest_queue import BatchQueue, QueueFullError
+from usage_log import EventLog
+from user_store import DEFAULT_HISTOGRAM_EDGES, UserStore
 
-# Изначально, если нет файлов, создаём их
-if not os.path.exists(DATA_FILE):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump([], f)
-if not os.path.exists(USAGE_FILE):
-    with open(USAGE_FILE, 'w', encoding='utf-8') as f:
-        json.dump([], f)
+DATA_FILE = 'data.ndjson'
+USAGE_FILE = 'data_usage.ndjson'  # отдельный журнал для использования
 
-@app.route('/api/update', methods=['POST'])
-def update_data():
-    # Здесь данные о новых уникальных пользователях
-    data = request.get_json()
-    if not data or 'timestamp' not in data or 'usage_count' not in data:
-        return jsonify({"error": "Invalid data"}), 400
+# Append-only журналы событий; старые data.json / data_usage.json
+# переносятся в них при первом запуске
+data_log = EventLog(DATA_FILE)
+data_log.import_json_array('data.json')
+usage_log = EventLog(USAGE_FILE)
+usage_log.import_json_array('data_usage.json')
+
+# Почасовые счетчики обновляются после каждой записи в журнал
+data_counters = HourlyCounters(DATA_FILE)
+data_counters.catch_up()
+data_log.add_listener(data_counters.catch_up)
+usage_counters = HourlyCounters(USAGE_FILE)
+usage_counters.catch_up()
+usage_log.add_listener(usage_counters.catch_up)
+
+MAX_RANGE_DAYS = 366  # максимальный диапазон /api/candles*
+
+# Счетчики пользователей (бывший users.json); при первом запуске
+# переносим users.json в пустую базу
+USERS_DB = 'users.db'
+user_store = UserStore(USERS_DB)
+if user_store.count_users() == 0 and os.path.exists('users.json'):
+    user_store.import_json('users.json')
+
+COUNTER_NAME = r'^[a-z_]{1,32}$'
+MAX_TOP_LIMIT = 100
+
+
+def _log_writer(log: EventLog):
+    def write(records: List[Dict[str, Any]]) -> List[None]:
+        log.append_many(records)
+        return [None] * len(records)
+    return write
+
+
+# Запись идет пакетами: все, что накопилось в очереди, - одним fsync
+# журнала или одной транзакцией SQLite
+data_queue = BatchQueue(_log_writer(data_log))
+usage_queue = BatchQueue(_log_writer(usage_log))
+increment_queue: BatchQueue[Tuple[str, str, int], int] = BatchQueue(user_store.increment_many)
+QUEUES = (data_queue, usage_queue, increment_queue)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for queue in QUEUES:
+        queue.start()
+
+    yield
+
+    # Сначала записываем принятые события, затем закрываем хранилища
+    for queue in QUEUES:
+        await queue.stop()
+    data_log.close()
+    usage_log.close()
+    data_counters.save()
+    usage_counters.save()
+
+
+app = FastAPI(title="Usage tracker", lifespan=lifespan)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
-        candles = json.load(f)
-    candles.append(data)
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(candles, f, ensure_ascii=False, indent=4)
 
-    return jsonify({"status": "ok"}), 200
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request: Request, exc: RequestValidationError):
+    # Прежний формат ошибки трекера: 400 {"error": "Invalid data"}
+    fields = [".".join(str(part) for part in error["loc"]) for error in exc.errors()]
+    return JSONResponse(status_code=400, content={"error": "Invalid data", "fields": fields})
 
-@app.route('/api/update_usage', methods=['POST'])
-def update_usage():
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(status_code=503, content={"error": "Ingest queue is full"})
+
+
+class UsageEvent(BaseModel):
+    """Событие трекера; дополнительные поля сохраняются как есть"""
+    model_config = ConfigDict(extra='allow')
+
+    timestamp: datetime
+    usage_count: int
+
+
+class CounterIncrement(BaseModel):
+    counter: str = Field('usage_count', pattern=COUNTER_NAME)
+    amount: int = Field(1, ge=-10**9, le=10**9)
+
+
+def _event_record(event: UsageEvent) -> Dict[str, Any]:
+    record = event.model_dump()
+    record['timestamp'] = event.timestamp.isoformat()
+    return record
+
+
+@app.post('/api/update')
+async def update_data(event: UsageEvent):
+    # Здесь данные о новых уникальных пользователях
+    await data_queue.submit(_event_record(event))
+    return {"status": "ok"}
+
+
+@app.post('/api/update_usage')
+async def update_usage(event: UsageEvent):
     # Здесь данные о количестве использований (каждое использование отправляет usage_count=1)
-    data = request.get_json()
-    if not data or 'timestamp' not in data or 'usage_count' not in data:
-        return jsonify({"error": "Invalid data"}), 400
-
-    with open(USAGE_FILE, 'r', encoding='utf-8') as f:
-        usage_data = json.load(f)
-    usage_data.append(data)
-    with open(USAGE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(usage_data, f, ensure_ascii=False, indent=4)
-
-    return jsonify({"status": "ok"}), 200
-
-@app.route('/api/candles', methods=['GET'])
-def get_candles():
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
-        candles = json.load(f)
-
-    # Вычисляем сегодняшнюю полуночь по UTC
-    now_utc = datetime.now(timezone.utc)
-    today_midnight_utc = now_utc.replace(hour=0, minute=0, second=0, microsecond=0)
-
-    # Фильтруем данные, оставляя только записи за текущий день
-    todays_data = []
-    for c in candles:
-        dt = datetime.fromisoformat(c['timestamp'])
-        if dt >= today_midnight_utc:
-            todays_data.append(c)
-
-    # Аггрегируем по часу уникальных пользователей
-    aggregated = {}
-    for c in todays_data:
-        dt = datetime.fromisoformat(c['timestamp'])
-        hour_str = dt.strftime("%H:00")
-        aggregated[hour_str] = aggregated.get(hour_str, 0) + c['usage_count']
-
-    result = [{"time": k, "users": v} for k, v in aggregated.items()]
-    result.sort(key=lambda x: x['time'])
-    return jsonify(result), 200
-
-@app.route('/api/candles_usage', methods=['GET'])
-def get_candles_usage():
-    with open(USAGE_FILE, 'r', encoding='utf-8') as f:
-        usage_data = json.load(f)
-
-    # Вычисляем сегодняшнюю полуночь по UTC
-    now_utc = datetime.now(timezone.utc)
-    today_midnight_utc = now_utc.replace(hour=0, minute=0, second=0, microsecond=0)
-
-    # Фильтруем данные, оставляя только записи за текущий день
-    todays_usage = []
-    for c in usage_data:
-        dt = datetime.fromisoformat(c['timestamp'])
-        if dt >= today_midnight_utc:
-            todays_usage.append(c)
-
-    # Аггрегируем по часу количество использований
-    aggregated = {}
-    for c in todays_usage:
-        dt = datetime.fromisoformat(c['timestamp'])
-        hour_str = dt.strftime("%H:00")
-        aggregated[hour_str] = aggregated.get(hour_str, 0) + c['usage_count']
-
-    result = [{"time": k, "users": v} for k, v in aggregated.items()]
-    result.sort(key=lambda x: x['time'])
-    return jsonify(result), 200
+    await usage_queue.submit(_event_record(event))
+    return {"status": "ok"}
+
+
+def hourly_candles(counters: HourlyCounters, start: Optional[date],
+                   end: Optional[date], tz_name: str):
+    """Почасовой ряд по счетчикам за дни start..end в часовом поясе tz
+
+    Параметры запроса: start, end (YYYY-MM-DD, включительно) и tz (имя
+    IANA, по умолчанию UTC); без них - текущий день UTC. Точки отдаются
+    только для часов с событиями; для диапазона из нескольких дней у
+    точек есть поле date.
+    """
+    try:
+        tz = ZoneInfo(tz_name)
+    except (ValueError, ZoneInfoNotFoundError):
+        return JSONResponse(status_code=400, content={"error": "Invalid tz"})
+    start = start or end or datetime.now(tz).date()
+    end = end or start
+    if end < start or (end - start).days >= MAX_RANGE_DAYS:
+        return JSONResponse(status_code=400,
+                            content={"error": f"Range must be 1..{MAX_RANGE_DAYS} days"})
+
+    # Строки, записанные другими процессами
+    counters.catch_up()
+
+    series = counters.series(
+        datetime.combine(start, time.min, tzinfo=tz),
+        datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz)
+    )
+    result = []
+    for hour, count in series:
+        if not count:
+            continue
+        local = hour.astimezone(tz)
+        point = {"time": local.strftime("%H:%M"), "users": count}
+        if end > start:
+            point["date"] = local.date().isoformat()
+        result.append(point)
+    return result
+
+
+# Чтение - синхронные обработчики: файловый ввод-вывод и SQLite
+# выполняются в пуле потоков, а не в event loop
+
+@app.get('/api/candles')
+def get_candles(start: Optional[date] = None, end: Optional[date] = None, tz: str = 'UTC'):
+    # Новые уникальные пользователи по часам
+    return hourly_candles(data_counters, start, end, tz)
+
+
+@app.get('/api/candles_usage')
+def get_candles_usage(start: Optional[date] = None, end: Optional[date] = None, tz: str = 'UTC'):
+    # Количество использований по часам
+    return hourly_candles(usage_counters, start, end, tz)
+
+
+@app.get('/api/users/top')
+def get_top_users(counter: str = Query('usage_count', pattern=COUNTER_NAME),
+                  limit: int = Query(10, ge=1, le=MAX_TOP_LIMIT)):
+    # Топ пользователей по счетчику
+    return [{"user_id": user_id, counter: value} for user_id, value in user_store.top(counter, limit)]
+
+
+@app.get('/api/users/histogram')
+def get_users_histogram(counter: str = Query('usage_count', pattern=COUNTER_NAME),
+                        edges: Optional[str] = Query(None, description="границы через запятую: 0,1,5,10")):
+    # Распределение пользователей по значению счетчика
+    try:
+        edges_list = [int(edge) for edge in edges.split(',')] if edges else DEFAULT_HISTOGRAM_EDGES
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Invalid edges"})
+    if not 1 <= len(edges_list) <= 50:
+        return JSONResponse(status_code=400, content={"error": "Invalid edges"})
+
+    return user_store.histogram(counter, edges_list)
+
+
+@app.post('/api/users/{user_id}/increment')
+async def increment_user_counter(user_id: str = Path(max_length=64),
+                                 body: Optional[CounterIncrement] = None):
+    # Увеличение счетчика пользователя: {"counter": "photos_uploaded", "amount": 1}
+    body = body or CounterIncrement()
+    value = await increment_queue.submit((user_id, body.counter, body.amount))
+    return {"user_id": user_id, "counter": body.counter, "value": value}
+
+
+@app.get('/api/users/{user_id}')
+def get_user_counters(user_id: str = Path(max_length=64)):
+    counters = user_store.get(user_id)
+    if counters is None:
+        return JSONResponse(status_code=404, content={"error": "User not found"})
+    return counters
+
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    # Несколько процессов: uvicorn main:app --host 0.0.0.0 --port 5000 --workers 4
+    uvicorn.run("main:app", host='0.0.0.0', port=5000)
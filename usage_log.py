@@ -0,0 +1,250 @@
+"""
+Append-only журнал событий трекера (NDJSON)
+
+Каждое событие - одна строка JSON в конце файла, запись не зависит от
+размера истории. Строки копятся в памяти, пока идет предыдущий fsync,
+и пишутся следующим одним write + fsync (group commit): append
+возвращается, когда его строка на диске. Запись защищена flock, так что
+в файл могут писать несколько процессов.
+
+Сжатие истории:
+    python usage_log.py data.ndjson --keep-days 30
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ISO timestamp события; время без часового пояса считается UTC"""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+class _Batch:
+    def __init__(self):
+        self.lines: List[bytes] = []
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+
+class EventLog:
+    """Журнал событий в файле NDJSON"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+        self._file_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._batch = _Batch()
+        self._closed = False
+        self._listeners: List[Callable[[], None]] = []
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True,
+                                        name=f"event-log-{os.path.basename(path)}")
+        self._thread.start()
+
+    def add_listener(self, callback: Callable[[], None]):
+        """Вызов callback в потоке записи после каждого записанного пакета"""
+        self._listeners.append(callback)
+
+    def append(self, record: Dict[str, Any], wait: bool = True):
+        """Добавление события; с wait - ожидание fsync его пакета"""
+        self.append_many([record], wait)
+
+    def append_many(self, records: List[Dict[str, Any]], wait: bool = True):
+        """Добавление нескольких событий в один пакет записи"""
+        lines = [(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+                 for record in records]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Event log is closed")
+            batch = self._batch
+            batch.lines.extend(lines)
+            self._cond.notify()
+        if wait:
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._batch.lines and not self._closed:
+                    self._cond.wait()
+                batch, self._batch = self._batch, _Batch()
+                closed = self._closed
+            if batch.lines:
+                try:
+                    self._write(b"".join(batch.lines))
+                except Exception as e:
+                    batch.error = e
+            batch.done.set()
+            if batch.lines and batch.error is None:
+                for callback in self._listeners:
+                    try:
+                        callback()
+                    except Exception as e:
+                        print(f"Event log listener failed: {e}")
+            if closed:
+                return
+
+    def _open(self) -> int:
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self._fd
+
+    def _lock_current(self) -> int:
+        """Эксклюзивный flock на актуальный файл
+
+        После сжатия путь указывает на новый файл: старый дескриптор
+        закрывается и открывается заново, иначе запись ушла бы в
+        удаленный файл.
+        """
+        while True:
+            fd = self._open()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            self._fd = None
+
+    def _write(self, data: bytes):
+        with self._file_lock:
+            fd = self._lock_current()
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                os.fsync(fd)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Все события журнала по порядку
+
+        Недописанная последняя строка (запись идет прямо сейчас или
+        прервалась при сбое) пропускается.
+        """
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def import_json_array(self, json_path: str) -> int:
+        """Перенос событий из старого файла-массива JSON в пустой журнал
+
+        Старый файл переименовывается в *.imported; если журнал уже не
+        пуст, ничего не делает.
+        """
+        if not os.path.exists(json_path):
+            return 0
+        with self._file_lock:
+            fd = self._lock_current()
+            try:
+                if os.fstat(fd).st_size > 0 or not os.path.exists(json_path):
+                    return 0
+                with open(json_path, "r", encoding="utf-8") as f:
+                    records = json.load(f)
+                data = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+                               for record in records).encode("utf-8")
+                os.write(fd, data)
+                os.fsync(fd)
+                os.replace(json_path, json_path + ".imported")
+                return len(records)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def compact(self, before: datetime) -> Dict[str, int]:
+        """Сжатие событий старше before в почасовые суммы
+
+        Все события одного часа заменяются одной записью
+        {"timestamp": начало часа UTC, "usage_count": сумма}: почасовые
+        графики по сжатому журналу не меняются. События после before
+        переносятся как есть. Новый файл подменяет старый через
+        os.replace под flock, запись других процессов ждет и затем
+        переоткрывает файл.
+        """
+        with self._file_lock:
+            fd = self._lock_current()
+            try:
+                hourly: Dict[datetime, int] = {}
+                recent: List[Dict[str, Any]] = []
+                total = 0
+                for record in self:
+                    total += 1
+                    dt = parse_timestamp(record["timestamp"])
+                    if dt < before:
+                        hour = dt.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+                        hourly[hour] = hourly.get(hour, 0) + record["usage_count"]
+                    else:
+                        recent.append(record)
+
+                tmp_path = f"{self.path}.compact"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for hour in sorted(hourly):
+                        f.write(json.dumps({"timestamp": hour.isoformat(),
+                                            "usage_count": hourly[hour]}) + "\n")
+                    for record in recent:
+                        f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+                return {"records_before": total, "records_after": len(hourly) + len(recent)}
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def close(self):
+        """Запись оставшихся событий и закрытие файла"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        with self._file_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сжатие журнала событий трекера")
+    parser.add_argument("path", help="файл журнала (data.ndjson, data_usage.ndjson)")
+    parser.add_argument("--keep-days", type=int, default=30,
+                        help="события за последние N дней остаются без изменений")
+    args = parser.parse_args()
+
+    log = EventLog(args.path)
+    try:
+        before = datetime.now(timezone.utc) - timedelta(days=args.keep_days)
+        stats = log.compact(before)
+        print(f"{args.path}: {stats['records_before']} -> {stats['records_after']} records")
+    finally:
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
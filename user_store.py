@@ -0,0 +1,167 @@
+"""
+Счетчики пользователей трекера в SQLite
+
+Заменяет users.json: счетчики (usage_count, photos_uploaded, ...)
+хранятся строками (user_id, counter, value), увеличение - один UPSERT
+без чтения и перезаписи всех пользователей. Индекс по (counter, value)
+обслуживает топ пользователей и гистограммы для дашбордов. Режим WAL:
+чтение не ждет записи, несколько процессов работают с одной базой.
+
+Импорт из users.json (значения заменяются, повторный импорт безопасен):
+    python user_store.py users.json --db users.db
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+# Границы гистограммы по умолчанию: [0, 1), [1, 2), [2, 5), ... [100, +inf)
+DEFAULT_HISTOGRAM_EDGES = (0, 1, 2, 5, 10, 20, 50, 100)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_counters (
+    user_id TEXT NOT NULL,
+    counter TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (user_id, counter)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS user_counters_top ON user_counters (counter, value);
+"""
+
+
+class UserStore:
+    """Счетчики пользователей по Telegram ID"""
+
+    def __init__(self, path: str):
+        self.path = path
+        # sqlite3.Connection нельзя использовать из нескольких потоков
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # В WAL fsync при checkpoint, а не при каждой транзакции
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def increment(self, user_id: str, counter: str = "usage_count", amount: int = 1) -> int:
+        """Атомарное увеличение счетчика; возвращает новое значение"""
+        value = self.increment_many([(user_id, counter, amount)])[0]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def increment_many(self, increments: List[Tuple[str, str, int]]) -> List[Union[int, Exception]]:
+        """Пакет увеличений (user_id, counter, amount) одной транзакцией
+
+        Возвращает значение счетчика после каждого увеличения по порядку.
+        Каждое увеличение выполняется в своем SAVEPOINT: ошибочное
+        (например, переполнение INTEGER) откатывается и возвращается на
+        своем месте исключением, остальные записываются.
+        """
+        values: List[Union[int, Exception]] = []
+        with self._connection() as conn:
+            conn.execute("BEGIN")
+            for user_id, counter, amount in increments:
+                conn.execute("SAVEPOINT increment")
+                try:
+                    conn.execute(
+                        "INSERT INTO user_counters (user_id, counter, value) VALUES (?, ?, ?) "
+                        "ON CONFLICT (user_id, counter) DO UPDATE SET value = value + excluded.value",
+                        (user_id, counter, amount)
+                    )
+                    # Та же транзакция держит блокировку записи
+                    (value,) = conn.execute(
+                        "SELECT value FROM user_counters WHERE user_id = ? AND counter = ?",
+                        (user_id, counter)
+                    ).fetchone()
+                except (sqlite3.Error, OverflowError) as e:
+                    conn.execute("ROLLBACK TO increment")
+                    value = e
+                conn.execute("RELEASE increment")
+                values.append(value)
+        return values
+
+    def get(self, user_id: str) -> Optional[Dict[str, int]]:
+        """Счетчики пользователя в формате записи users.json"""
+        rows = self._connection().execute(
+            "SELECT counter, value FROM user_counters WHERE user_id = ?", (user_id,)
+        ).fetchall()
+        return dict(rows) if rows else None
+
+    def count_users(self) -> int:
+        (count,) = self._connection().execute(
+            "SELECT count(DISTINCT user_id) FROM user_counters").fetchone()
+        return count
+
+    def top(self, counter: str = "usage_count", limit: int = 10) -> List[Tuple[str, int]]:
+        """Пользователи с наибольшим значением счетчика"""
+        return self._connection().execute(
+            "SELECT user_id, value FROM user_counters WHERE counter = ? "
+            "ORDER BY value DESC LIMIT ?",
+            (counter, limit)
+        ).fetchall()
+
+    def histogram(self, counter: str = "usage_count",
+                  edges: Sequence[int] = DEFAULT_HISTOGRAM_EDGES) -> List[Dict[str, Optional[int]]]:
+        """Число пользователей по интервалам значений [edges[i], edges[i + 1])
+
+        Последний интервал открыт сверху (to = None), значения меньше
+        edges[0] не учитываются. Группировка идет по индексу, в Python
+        приходят только различные значения счетчика.
+        """
+        edges = sorted(edges)
+        buckets = [{"from": low, "to": high, "users": 0}
+                   for low, high in zip(edges, list(edges[1:]) + [None])]
+        rows = self._connection().execute(
+            "SELECT value, count(*) FROM user_counters WHERE counter = ? AND value >= ? "
+            "GROUP BY value ORDER BY value",
+            (counter, edges[0])
+        )
+        index = 0
+        for value, users in rows:
+            while buckets[index]["to"] is not None and value >= buckets[index]["to"]:
+                index += 1
+            buckets[index]["users"] += users
+        return buckets
+
+    def import_users(self, users: Dict[str, Dict[str, int]]) -> int:
+        """Загрузка словаря формата users.json одной транзакцией
+
+        Значения счетчиков заменяются, а не складываются.
+        """
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT INTO user_counters (user_id, counter, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, counter) DO UPDATE SET value = excluded.value",
+                ((str(user_id), counter, int(value))
+                 for user_id, counters in users.items()
+                 for counter, value in counters.items())
+            )
+        return len(users)
+
+    def import_json(self, json_path: str) -> int:
+        with open(json_path, "r", encoding="utf-8") as f:
+            return self.import_users(json.load(f))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт users.json в SQLite")
+    parser.add_argument("json_path", help="файл users.json")
+    parser.add_argument("--db", default="users.db", help="файл базы счетчиков")
+    args = parser.parse_args()
+
+    store = UserStore(args.db)
+    imported = store.import_json(args.json_path)
+    print(f"Imported {imported} users into {args.db}")
+
+
+if __name__ == "__main__":
+    main()